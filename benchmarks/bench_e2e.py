@@ -0,0 +1,375 @@
+"""
+Сквозной бенчмарк конвейера RAG: загрузка документов и ответы на вопросы.
+
+Генерирует синтетический русско-английский корпус, строит индекс через
+setting_up_LLM и отправляет вопросы в AdvancedRAG.query_async с заданной
+параллельностью. Время этапов (load, clean, split, embed, index, retrieve,
+filter, rerank, format, llm, verify) берется из трасс src.monitoring.tracing,
+память - из выборок RSS процесса во время этапа.
+
+LLM заменяется локальной заглушкой OpenAI-совместимого API с задержкой
+--llm-latency-ms, модели эмбеддингов и cross-encoder - маленькими заменителями
+(--models local, по умолчанию) или моделями из RAG_CONFIG (--models config),
+поэтому бенчмарк запускается без сети. Результат сохраняется в JSON и
+сравнивается с сохраненным базовым результатом. Запуск из корня репозитория:
+
+    python -m benchmarks.bench_e2e --docs 200 --doc-kb 20 --queries 200 --concurrency 8 \\
+        --save-baseline bench_baseline.json
+    python -m benchmarks.bench_e2e --docs 200 --doc-kb 20 --queries 200 --concurrency 8 \\
+        --baseline bench_baseline.json --tolerance 0.2
+
+С --baseline код возврата 1, если какая-либо метрика хуже базовой больше чем на tolerance.
+"""
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.bench_splitter import generate_text
+from benchmarks.stub_openai_server import start_stub_server
+from config import RAG_CONFIG
+from src.monitoring.tracing import Tracer, set_tracer
+
+INGEST_STAGES = ('load', 'clean', 'split', 'embed', 'index')
+QUERY_STAGES = ('retrieve', 'filter', 'rerank', 'format', 'llm', 'verify')
+
+
+class RSSSampler:
+    """
+    Фоновые выборки RSS процесса (Linux, /proc/self/statm) для пиковой памяти этапов.
+    """
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples: List[Tuple[float, int]] = []
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def rss(self) -> int:
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except OSError:
+            # Без /proc доступен только пик процесса (ru_maxrss в килобайтах на Linux)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.samples.append((time.time(), self.rss()))
+            self._stop.wait(self.interval)
+
+    def start(self) -> 'RSSSampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def peak(self, start: float, end: float) -> int:
+        """
+        Наибольший RSS в интервале времени; для коротких этапов - ближайшая выборка до конца.
+        """
+        inside = [rss for ts, rss in self.samples if start <= ts <= end]
+        if inside:
+            return max(inside)
+        before = [rss for ts, rss in self.samples if ts <= end]
+        return before[-1] if before else self.rss()
+
+
+def generate_corpus(corpus_dir: str, docs: int, doc_kb: float, seed: int = 0) -> List[str]:
+    """
+    Записывает docs текстовых файлов по doc_kb килобайт и возвращает предложения для вопросов.
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    sentences = []
+    for i in range(docs):
+        text = generate_text(int(doc_kb * 1024), seed=seed + i)
+        with open(os.path.join(corpus_dir, f'doc_{i:05d}.txt'), 'w', encoding='utf-8') as f:
+            f.write(text)
+        candidates = [s.strip() for s in text.split('.') if len(s.split()) >= 6]
+        sentences.extend(rng.sample(candidates, min(3, len(candidates))))
+    return sentences
+
+
+def configure_work_dir(work_dir: str, local_models: bool) -> None:
+    """
+    Направляет индекс, кэши и шарды в рабочую директорию бенчмарка.
+    """
+    RAG_CONFIG['index_dir'] = os.path.join(work_dir, 'index')
+    RAG_CONFIG['text_cache']['dir'] = os.path.join(work_dir, 'text_cache')
+    RAG_CONFIG['out_of_core']['dir'] = os.path.join(work_dir, 'index_build')
+    RAG_CONFIG['sharding']['dir'] = os.path.join(work_dir, 'index_shards')
+    if local_models:
+        # У заменителя нет токенизатора HuggingFace, а процессы шардов загружают модели сами
+        if RAG_CONFIG['splitter'] == 'tokens':
+            RAG_CONFIG['splitter'] = 'offset'
+        RAG_CONFIG['sharding']['shards'] = 0
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3)}
+
+
+def summarize_stages(traces: List[Dict], sampler: RSSSampler, stages: Tuple[str, ...]) -> Dict[str, Dict]:
+    """
+    Сводка по этапам трасс: число вызовов, суммарное время, перцентили, счетчики и пик RSS.
+    """
+    durations = defaultdict(list)
+    counts = defaultdict(lambda: defaultdict(int))
+    peaks = defaultdict(int)
+    for trace in traces:
+        for span in trace['spans']:
+            start = trace['timestamp'] + span['start_ms'] / 1000
+            durations[span['stage']].append(span['duration_ms'] / 1000)
+            for item, value in span['counts'].items():
+                counts[span['stage']][item] += value
+            peaks[span['stage']] = max(peaks[span['stage']],
+                                       sampler.peak(start, start + span['duration_ms'] / 1000))
+    summary = {}
+    for stage in stages:
+        if stage not in durations:
+            continue
+        summary[stage] = {
+            'calls': len(durations[stage]),
+            'total_s': round(sum(durations[stage]), 4),
+            **_percentiles(durations[stage]),
+            'counts': dict(counts[stage]),
+            'peak_rss_mb': round(peaks[stage] / 2 ** 20, 1),
+        }
+    return summary
+
+
+async def run_ingest(llm, corpus_dir: str) -> float:
+    from start_rag import setting_up_LLM
+
+    started = time.perf_counter()
+    await setting_up_LLM(llm, [corpus_dir], rebuild=True)
+    # Модели загружаются в фоне: время ожидания входит в загрузку
+    await asyncio.to_thread(llm.wait_for_models)
+    return time.perf_counter() - started
+
+
+async def run_queries(llm, questions: List[str], concurrency: int) -> Tuple[float, List[float], int]:
+    """
+    Отправляет вопросы с ограничением параллельности; возвращает время, задержки и число ошибок.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def ask(question: str) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                answer = await llm.query_async(question)
+                if answer.startswith("Произошла ошибка"):
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[ask(question) for question in questions])
+    return time.perf_counter() - started, latencies, errors
+
+
+def flatten_metrics(result: Dict) -> Dict[str, float]:
+    """
+    Метрики для сравнения с базовым результатом: *_per_s и qps - чем больше, тем лучше,
+    остальные (время, задержки, память) - чем меньше, тем лучше.
+    """
+    ingest, queries = result['ingest'], result['queries']
+    metrics = {
+        'ingest.seconds': ingest['seconds'],
+        'ingest.chunks_per_s': ingest['chunks_per_s'],
+        'ingest.peak_rss_mb': ingest['peak_rss_mb'],
+        'queries.qps': queries['qps'],
+        'queries.p50_ms': queries['p50_ms'],
+        'queries.p95_ms': queries['p95_ms'],
+        'queries.p99_ms': queries['p99_ms'],
+        'queries.peak_rss_mb': queries['peak_rss_mb'],
+    }
+    for stage, summary in ingest['stages'].items():
+        metrics[f'ingest.{stage}.total_s'] = summary['total_s']
+    for stage, summary in queries['stages'].items():
+        metrics[f'queries.{stage}.p95_ms'] = summary['p95_ms']
+    return metrics
+
+
+def compare_with_baseline(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Печатает изменения метрик относительно базового результата и возвращает ухудшившиеся.
+    """
+    if baseline.get('workload') != result['workload']:
+        print("Внимание: параметры нагрузки отличаются от базовых, сравнение приблизительное")
+    current, base = flatten_metrics(result), flatten_metrics(baseline)
+    regressions = []
+    print(f"\n{'метрика':<32} {'база':>10} {'сейчас':>10} {'изменение':>10}")
+    for name, value in current.items():
+        if name not in base:
+            continue
+        reference = base[name]
+        change = (value - reference) / reference if reference else 0.0
+        higher_is_better = name.endswith('_per_s') or name.endswith('qps')
+        worse = -change if higher_is_better else change
+        mark = ''
+        # Шум коротких этапов не считается ухудшением: порог 10 мс для секунд, 1 для мс, МБ и скоростей
+        noise = 0.01 if name.endswith('seconds') or name.endswith('total_s') else 1.0
+        if worse > tolerance and abs(value - reference) >= noise:
+            regressions.append(name)
+            mark = '  ХУЖЕ'
+        print(f"{name:<32} {reference:>10.3f} {value:>10.3f} {change:>+9.1%}{mark}")
+    return regressions
+
+
+def print_stages(title: str, stages: Dict[str, Dict]) -> None:
+    print(f"\n{title}")
+    print(f"{'этап':<10} {'вызовы':>7} {'всего, с':>9} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} "
+          f"{'RSS, МБ':>8}  счетчики")
+    for stage, summary in stages.items():
+        counts = ', '.join(f'{item}={value}' for item, value in summary['counts'].items())
+        print(f"{stage:<10} {summary['calls']:>7} {summary['total_s']:>9.3f} {summary['p50_ms']:>9.2f} "
+              f"{summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f} {summary['peak_rss_mb']:>8.1f}  {counts}")
+
+
+async def run_benchmark(args: argparse.Namespace, work_dir: str) -> Dict:
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    sentences = generate_corpus(corpus_dir, args.docs, args.doc_kb, args.seed)
+    rng = random.Random(args.seed)
+    questions = [rng.choice(sentences) + '?' for _ in range(args.queries + args.warmup)]
+
+    configure_work_dir(work_dir, args.models == 'local')
+    if args.models == 'local':
+        from benchmarks.local_models import use_local_models
+        use_local_models(args.embedding_dim)
+    tracer = Tracer(True, None, RAG_CONFIG['tracing']['buckets'], max_traces=args.queries + args.warmup + 10)
+    set_tracer(tracer)
+
+    server = start_stub_server(latency=args.llm_latency_ms / 1000)
+    host, port = server.server_address[:2]
+    sampler = RSSSampler().start()
+    try:
+        from src.rag import AdvancedRAG
+        from start_rag import create_LLM
+
+        llm = create_LLM(AdvancedRAG, SimpleNamespace(
+            model_name='stub', api_key='stub-key', base_url=f'http://{host}:{port}/v1', temperature=0.0
+        ))
+
+        ingest_started = time.time()
+        ingest_seconds = await run_ingest(llm, corpus_dir)
+        ingest_traces = [trace for trace in tracer.traces if trace['name'] == 'ingest']
+        chunks = len(llm.vectorstore.docstore) if hasattr(llm.vectorstore, 'docstore') else 0
+        corpus_mb = args.docs * args.doc_kb / 1024
+        ingest = {
+            'seconds': round(ingest_seconds, 3),
+            'chunks': chunks,
+            'chunks_per_s': round(chunks / ingest_seconds, 1),
+            'mb_per_s': round(corpus_mb / ingest_seconds, 3),
+            'peak_rss_mb': round(sampler.peak(ingest_started, time.time()) / 2 ** 20, 1),
+            'stages': summarize_stages(ingest_traces, sampler, INGEST_STAGES),
+        }
+
+        await run_queries(llm, questions[:args.warmup], args.concurrency)
+        tracer.traces.clear()
+        queries_started = time.time()
+        seconds, latencies, errors = await run_queries(llm, questions[args.warmup:], args.concurrency)
+        query_traces = [trace for trace in tracer.traces if trace['name'] == 'query']
+        queries = {
+            'count': len(latencies),
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'qps': round(len(latencies) / seconds, 2),
+            **_percentiles(latencies),
+            'peak_rss_mb': round(sampler.peak(queries_started, time.time()) / 2 ** 20, 1),
+            'stages': summarize_stages(query_traces, sampler, QUERY_STAGES),
+        }
+        await llm.llm.aclose()
+    finally:
+        sampler.stop()
+        server.shutdown()
+
+    return {
+        'workload': {
+            'docs': args.docs, 'doc_kb': args.doc_kb, 'queries': args.queries,
+            'concurrency': args.concurrency, 'llm_latency_ms': args.llm_latency_ms,
+            'models': args.models, 'seed': args.seed,
+        },
+        'environment': {
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'splitter': RAG_CONFIG['splitter'],
+            'precision': RAG_CONFIG['vector_storage']['precision'],
+        },
+        'ingest': ingest,
+        'queries': queries,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк загрузки документов и ответов на вопросы")
+    parser.add_argument('--docs', type=int, default=100, help="Количество документов корпуса")
+    parser.add_argument('--doc-kb', type=float, default=20, help="Размер документа в килобайтах")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5, help="Вопросы для прогрева, не входят в результат")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--llm-latency-ms', type=float, default=50, help="Задержка ответа заглушки LLM")
+    parser.add_argument('--models', choices=('local', 'config'), default='local',
+                        help="local - локальные заменители моделей, config - модели из RAG_CONFIG")
+    parser.add_argument('--embedding-dim', type=int, default=256, help="Размерность эмбеддингов заменителя")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help="Директория корпуса и индекса (по умолчанию временная)")
+    parser.add_argument('--output', help="Файл для сохранения результата в JSON")
+    parser.add_argument('--save-baseline', help="Сохранить результат как базовый")
+    parser.add_argument('--baseline', help="Сравнить с базовым результатом")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Допустимое ухудшение метрики (доля)")
+    args = parser.parse_args(argv)
+
+    if args.work_dir:
+        result = asyncio.run(run_benchmark(args, args.work_dir))
+    else:
+        with tempfile.TemporaryDirectory(prefix='rag-bench-') as work_dir:
+            result = asyncio.run(run_benchmark(args, work_dir))
+
+    ingest, queries = result['ingest'], result['queries']
+    print(f"Загрузка: {ingest['seconds']:.2f} с, чанков {ingest['chunks']} ({ingest['chunks_per_s']:.1f}/с, "
+          f"{ingest['mb_per_s']:.2f} МБ/с), пик RSS {ingest['peak_rss_mb']:.1f} МБ")
+    print_stages("Этапы загрузки", ingest['stages'])
+    print(f"\nВопросы: {queries['count']} за {queries['seconds']:.2f} с ({queries['qps']:.2f}/с), ошибок {queries['errors']}, "
+          f"p50 {queries['p50_ms']:.1f} мс, p95 {queries['p95_ms']:.1f} мс, p99 {queries['p99_ms']:.1f} мс, "
+          f"пик RSS {queries['peak_rss_mb']:.1f} МБ")
+    print_stages("Этапы запроса", queries['stages'])
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\nУхудшились метрики: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
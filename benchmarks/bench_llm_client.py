@@ -0,0 +1,154 @@
+"""
+Бенчмарк клиента LLM с пулом соединений и лимитами на локальной заглушке API.
+
+Отправляет --requests одновременных промптов через RateLimitedChatModel
+в заглушку с лимитом --stub-rpm запросов в минуту и сравнивает клиент
+без лимитов с клиентом, лимит которого совпадает с лимитом заглушки:
+время, ответы 429 на стороне заглушки, новые соединения и наибольшее
+число одновременных запросов. Запуск из корня репозитория:
+
+    python -m benchmarks.bench_llm_client --requests 40 --stub-rpm 60 --max-concurrent 8
+
+С --check вместо таблицы проверяет клиент на заглушке и завершается с кодом 1,
+если хотя бы одна проверка не прошла: клиент с лимитом чуть ниже заглушки не получает
+ответов 429 и ждет пополнения ведра, клиент без лимитов повторяет запросы
+после 429 без ошибок, одновременных запросов не больше --max-concurrent,
+расход токенов уточняется по ответу, клиент работает в нескольких asyncio.run.
+"""
+from typing import List
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.stub_openai_server import start_stub_server
+from src.llm.rate_limited_client import RateLimitedChatModel, TokenBucket
+
+# Сценарий проверок: запросов больше лимита заглушки, чтобы лишние ждали пополнения.
+# Ведро клиента пополняется с момента резервирования, а ведро заглушки - с прихода
+# запроса, поэтому лимит клиента, как и для провайдера, берется с запасом
+CHECK_RPM = 120
+CHECK_CLIENT_RPM = 114
+CHECK_REQUESTS = 125
+CHECK_LATENCY = 0.02
+
+
+async def _run(client: RateLimitedChatModel, requests: int, prompt: str, close: bool = True) -> int:
+    results = await asyncio.gather(*[client.ainvoke(prompt) for _ in range(requests)], return_exceptions=True)
+    if close:
+        await client.aclose()
+    return sum(isinstance(result, Exception) for result in results)
+
+
+def _stub_client(server, max_concurrent: int, rpm: float, retries: int) -> RateLimitedChatModel:
+    host, port = server.server_address[:2]
+    return RateLimitedChatModel(
+        'stub', 'stub-key', f'http://{host}:{port}/v1', 0.0,
+        max_concurrent=max_concurrent,
+        requests_per_minute=rpm,
+        max_rate_limit_retries=retries
+    )
+
+
+def _check(failures: List[str], passed: bool, message: str) -> None:
+    print(f"{'OK' if passed else 'ОШИБКА':>6}  {message}")
+    if not passed:
+        failures.append(message)
+
+
+def run_checks(max_concurrent: int, prompt: str) -> List[str]:
+    """
+    Проверяет клиент на заглушке и возвращает описания непрошедших проверок.
+    """
+    failures = []
+
+    # Лимит клиента чуть ниже лимита заглушки: лишние запросы ждут в ведре, а не получают 429
+    server = start_stub_server(latency=CHECK_LATENCY, rpm=CHECK_RPM)
+    client = _stub_client(server, max_concurrent, CHECK_CLIENT_RPM, 3)
+    started = time.perf_counter()
+    errors = asyncio.run(_run(client, CHECK_REQUESTS, prompt))
+    elapsed = time.perf_counter() - started
+    stats = server.stats.as_dict()
+    server.shutdown()
+    expected_wait = (CHECK_REQUESTS - CHECK_CLIENT_RPM) * 60 / CHECK_CLIENT_RPM
+    _check(failures, errors == 0, f"клиент с лимитом: ошибок {errors}")
+    _check(failures, stats['rate_limited'] == 0, f"клиент с лимитом: ответов 429 {stats['rate_limited']}")
+    _check(failures, elapsed >= 0.9 * expected_wait,
+           f"клиент с лимитом ждет пополнения ведра: {elapsed:.2f} с (не меньше {expected_wait:.2f} с)")
+    _check(failures, stats['max_in_flight'] <= max_concurrent,
+           f"клиент с лимитом: одновременных запросов {stats['max_in_flight']} (не больше {max_concurrent})")
+
+    # Без лимита клиента заглушка отвечает 429: каждый такой запрос повторяется после Retry-After
+    server = start_stub_server(latency=CHECK_LATENCY, rpm=CHECK_RPM)
+    client = _stub_client(server, max_concurrent, 0, 100)
+    errors = asyncio.run(_run(client, CHECK_REQUESTS, prompt))
+    stats = server.stats.as_dict()
+    server.shutdown()
+    _check(failures, stats['rate_limited'] > 0, f"клиент без лимитов: ответов 429 {stats['rate_limited']}")
+    _check(failures, errors == 0, f"клиент без лимитов: ошибок после повторов {errors}")
+    _check(failures, client.rate_limited == stats['rate_limited'],
+           f"клиент без лимитов: учтено ответов 429 {client.rate_limited} из {stats['rate_limited']}")
+    _check(failures, stats['requests'] == CHECK_REQUESTS,
+           f"клиент без лимитов: успешных запросов {stats['requests']} из {CHECK_REQUESTS}")
+    _check(failures, stats['max_in_flight'] <= max_concurrent,
+           f"клиент без лимитов: одновременных запросов {stats['max_in_flight']} (не больше {max_concurrent})")
+
+    # Расход токенов уточняется по usage ответа: из ведра списан фактический расход, а не оценка
+    server = start_stub_server(latency=CHECK_LATENCY)
+    client = _stub_client(server, max_concurrent, 0, 0)
+    client.tokens = TokenBucket(60, capacity=1_000_000)
+
+    async def _invoke_once():
+        try:
+            return await client.ainvoke(prompt)
+        finally:
+            await client.aclose()
+
+    response = asyncio.run(_invoke_once())
+    server.shutdown()
+    total_tokens = response.usage_metadata['total_tokens']
+    spent = client.tokens.capacity - client.tokens._balance
+    _check(failures, abs(spent - total_tokens) < 5,
+           f"расход токенов по ответу: списано {spent:.0f}, в ответе {total_tokens}")
+
+    # Один клиент в нескольких циклах событий (синхронные обертки с asyncio.run)
+    server = start_stub_server(latency=CHECK_LATENCY)
+    client = _stub_client(server, max_concurrent, 0, 0)
+    errors = [asyncio.run(_run(client, max_concurrent * 2, prompt, close=close)) for close in (False, True)]
+    server.shutdown()
+    _check(failures, errors == [0, 0], f"два цикла событий: ошибок {errors}")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Клиент LLM с лимитами на заглушке API")
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--stub-rpm', type=int, default=60)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--max-concurrent', type=int, default=8)
+    parser.add_argument('--prompt-chars', type=int, default=3000)
+    parser.add_argument('--check', action='store_true',
+                        help="Проверить клиент на заглушке (код 1 при ошибке) вместо таблицы")
+    args = parser.parse_args()
+
+    prompt = 'Контекст документа. ' * (args.prompt_chars // 20)
+    if args.check:
+        failures = run_checks(args.max_concurrent, prompt)
+        print(f"Проверок не прошло: {len(failures)}")
+        sys.exit(1 if failures else 0)
+
+    print(f"{'клиент':>12} {'время, с':>9} {'ошибки':>7} {'429':>5} {'соединения':>11} {'параллельно':>12}")
+    for name, rpm in (('без лимитов', 0), ('с лимитом', args.stub_rpm)):
+        server = start_stub_server(latency=args.latency_ms / 1000, rpm=args.stub_rpm)
+        client = _stub_client(server, args.max_concurrent, rpm, 3)
+        started = time.perf_counter()
+        errors = asyncio.run(_run(client, args.requests, prompt))
+        elapsed = time.perf_counter() - started
+        stats = server.stats.as_dict()
+        server.shutdown()
+        print(f"{name:>12} {elapsed:9.2f} {errors:7d} {stats['rate_limited']:5d} "
+              f"{stats['connections']:11d} {stats['max_in_flight']:12d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Бенчмарк стоимости MMR-диверсификации на один запрос.
+
+Сравнивает векторизованный отбор (src.retrieval.mmr) с реализацией
+LangChain (если установлена) на случайных нормализованных векторах
+размерности LaBSE. Запуск из корня репозитория:
+
+    python -m benchmarks.bench_mmr --dim 768 --k 20 --fetch-k 20 50 100 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.retrieval.mmr import maximal_marginal_relevance
+
+
+def _normalized(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _time_per_query(fn, queries: np.ndarray, candidates: np.ndarray) -> float:
+    started = time.perf_counter()
+    for query, vectors in zip(queries, candidates):
+        fn(query, vectors)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Стоимость MMR на один запрос")
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--fetch-k', type=int, nargs='+', default=[20, 50, 100, 200])
+    parser.add_argument('--lambda-mult', type=float, default=0.5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance as langchain_mmr
+    except ImportError:
+        langchain_mmr = None
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'fetch_k':>8} {'vectorized, мкс':>16} {'langchain, мкс':>15}")
+    for fetch_k in args.fetch_k:
+        queries = _normalized(rng, args.queries, args.dim)
+        candidates = np.stack([_normalized(rng, fetch_k, args.dim) for _ in range(args.queries)])
+
+        vectorized = _time_per_query(
+            lambda q, v: maximal_marginal_relevance(q, v, args.k, args.lambda_mult), queries, candidates
+        )
+        if langchain_mmr is not None:
+            baseline = _time_per_query(
+                lambda q, v: langchain_mmr(q, list(v), args.lambda_mult, args.k), queries, candidates
+            )
+            baseline_str = f"{baseline:15.1f}"
+        else:
+            baseline_str = f"{'-':>15}"
+        print(f"{fetch_k:>8} {vectorized:16.1f} {baseline_str}")
+
+
+if __name__ == '__main__':
+    main()
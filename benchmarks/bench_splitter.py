@@ -0,0 +1,78 @@
+"""
+Бенчмарк сплиттеров на документах размером в несколько мегабайт.
+
+Сравнивает OffsetTextSplitter (линейный проход, чанки в виде смещений)
+с RecursiveCharacterTextSplitter из LangChain с параметрами из RAG_CONFIG.
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_splitter --size-mb 1 4 16
+"""
+import argparse
+import random
+import time
+
+from config import RAG_CONFIG
+from src.date.text_splitter import OffsetTextSplitter
+
+WORDS = (
+    "документ статья пункт договор сторона обязательство срок оплата поставка "
+    "товар услуга акт приложение требование право ответственность "
+    "agreement party clause payment delivery section article"
+).split()
+
+
+def generate_text(size_chars: int, seed: int = 0, newlines: bool = True) -> str:
+    """
+    Генерирует синтетический русско-английский текст с предложениями и абзацами.
+    """
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size_chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize()
+        if rng.random() < 0.1:
+            sentence += f" ст. {rng.randint(1, 500)}.{rng.randint(1, 20)}"
+        separator = ". "
+        if newlines:
+            r = rng.random()
+            separator = ".\n\n" if r < 0.05 else ".\n" if r < 0.15 else ". "
+        parts.append(sentence + separator)
+        length += len(sentence) + len(separator)
+    return "".join(parts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сравнение сплиттеров на больших документах")
+    parser.add_argument('--size-mb', type=float, nargs='+', default=[1, 4])
+    parser.add_argument('--no-newlines', action='store_true',
+                        help="Текст без переносов строк (как после старой очистки ProcessDocuments)")
+    parser.add_argument('--skip-recursive', action='store_true')
+    args = parser.parse_args()
+
+    config = RAG_CONFIG["text_splitter"]
+    offset_splitter = OffsetTextSplitter(config["chunk_size"], config["chunk_overlap"], config["separators"])
+    recursive_splitter = None
+    if not args.skip_recursive:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        recursive_splitter = RecursiveCharacterTextSplitter(**config)
+
+    print(f"{'MB':>6} {'splitter':>10} {'chunks':>8} {'avg len':>8} {'sec':>8} {'MB/s':>8}")
+    for size_mb in args.size_mb:
+        text = generate_text(int(size_mb * 1024 * 1024), newlines=not args.no_newlines)
+        runs = [('offset', lambda: list(offset_splitter.split_text_offsets(text)))]
+        if recursive_splitter is not None:
+            runs.append(('recursive', lambda: recursive_splitter.split_text(text)))
+        for name, run in runs:
+            started = time.perf_counter()
+            chunks = run()
+            elapsed = time.perf_counter() - started
+            if name == 'offset':
+                avg_len = sum(end - start for start, end in chunks) / max(len(chunks), 1)
+            else:
+                avg_len = sum(len(chunk) for chunk in chunks) / max(len(chunks), 1)
+            print(f"{size_mb:>6} {name:>10} {len(chunks):>8} {avg_len:>8.1f} "
+                  f"{elapsed:>8.3f} {size_mb / elapsed:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Маленькие локальные заменители модели эмбеддингов и cross-encoder для бенчмарков.
+
+Не требуют torch, sentence_transformers и загрузки весов, поэтому бенчмарк
+конвейера запускается без сети. Качество поиска у заменителей низкое, но
+форма данных и вызовы те же, что у SentenceTransformer и CrossEncoder:
+эмбеддинги - хеширование слов в вектор фиксированной размерности,
+реранжирование - доля общих слов вопроса и документа.
+"""
+from typing import List, Sequence, Tuple, Union
+import re
+import zlib
+
+import numpy as np
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+class HashingEmbeddingModel:
+    """
+    Заменитель SentenceTransformer: слово хешируется в номер координаты и знак.
+
+    Attributes:
+        dim (int): Размерность эмбеддингов
+        max_seq_length (int): Сколько первых слов текста учитывается
+        tokenizer: Токенизатора нет, сплиттер RAG_CONFIG['splitter'] == 'tokens' недоступен
+    """
+    tokenizer = None
+
+    def __init__(self, dim: int = 256, max_seq_length: int = 256) -> None:
+        self.dim = dim
+        self.max_seq_length = max_seq_length
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self,
+               sentences: Union[str, Sequence[str]],
+               normalize_embeddings: bool = False,
+               convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else sentences
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _words(text)[:self.max_seq_length]:
+                digest = zlib.crc32(word.encode('utf-8'))
+                embeddings[row, digest % self.dim] += 1.0 if digest >> 31 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings[0] if single else embeddings
+
+    def __repr__(self) -> str:
+        return f"HashingEmbeddingModel(dim={self.dim})"
+
+
+class OverlapCrossEncoder:
+    """
+    Заменитель CrossEncoder: оценка пары - доля общих слов (косинус множеств слов).
+    """
+    def predict(self, pairs: Sequence[Tuple[str, str]], **kwargs) -> np.ndarray:
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for i, (question, document) in enumerate(pairs):
+            question_words, document_words = set(_words(question)), set(_words(document))
+            common = len(question_words & document_words)
+            scores[i] = common / max(np.sqrt(len(question_words) * len(document_words)), 1.0)
+        return scores
+
+    def __repr__(self) -> str:
+        return "OverlapCrossEncoder()"
+
+
+def use_local_models(dim: int = 256) -> None:
+    """
+    Подменяет загрузчики моделей AdvancedRAG заменителями.
+
+    Вызывается до создания AdvancedRAG: модели загружаются в фоне при создании.
+    """
+    import src.rag as rag
+
+    rag.load_sentence_transformer = lambda: HashingEmbeddingModel(dim)
+    rag.load_cross_encoder = OverlapCrossEncoder
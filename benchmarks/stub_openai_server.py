@@ -0,0 +1,169 @@
+"""
+Локальная заглушка OpenAI-совместимого API для бенчмарков и проверки клиента LLM.
+
+Отвечает на POST /v1/chat/completions фиксированным ответом с задержкой,
+ограничивает запросы в минуту, как провайдеры, ведром с непрерывным пополнением
+(ответ 429 с Retry-After) и считает запросы,
+ответы 429, новые соединения и наибольшее число одновременных запросов
+(GET /stats). Запуск из корня репозитория:
+
+    python -m benchmarks.stub_openai_server --port 8400 --latency-ms 200 --rpm 120
+
+Клиент RAG направляется на заглушку через LLM_BASE_URL=http://127.0.0.1:8400/v1.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+import argparse
+import json
+import math
+import threading
+import time
+
+
+class StubStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'rate_limited': self.rate_limited,
+                'connections': self.connections,
+                'max_in_flight': self.max_in_flight,
+            }
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency: float, rpm: int, answer: str) -> None:
+        super().__init__(address, _StubHandler)
+        self.latency = latency
+        self.rpm = rpm
+        self.answer = answer
+        self.stats = StubStats()
+        self._allowance = float(rpm)
+        self._updated = time.monotonic()
+
+    def admit(self) -> Optional[float]:
+        """
+        Списывает запрос из ведра на rpm запросов; если ведро пусто, возвращает Retry-After.
+        """
+        with self.stats.lock:
+            if self.rpm:
+                now = time.monotonic()
+                self._allowance = min(self.rpm, self._allowance + (now - self._updated) * self.rpm / 60)
+                self._updated = now
+                if self._allowance < 1:
+                    self.stats.rate_limited += 1
+                    # Округление вверх: Retry-After отдается с точностью 0.1 с
+                    return math.ceil((1 - self._allowance) * 600 / self.rpm) / 10
+                self._allowance -= 1
+            self.stats.requests += 1
+            return None
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: StubOpenAIServer
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.stats.lock:
+            self.server.stats.connections += 1
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == '/stats':
+            self._send_json(200, self.server.stats.as_dict())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        retry_after = self.server.admit()
+        if retry_after is not None:
+            self._send_json(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}},
+                            {'Retry-After': f'{retry_after:.1f}'})
+            return
+        stats = self.server.stats
+        with stats.lock:
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            time.sleep(self.server.latency)
+        finally:
+            with stats.lock:
+                stats.in_flight -= 1
+        prompt = ''.join(str(message.get('content', '')) for message in request.get('messages', []))
+        prompt_tokens = max(1, len(prompt) // 3)
+        completion_tokens = max(1, len(self.server.answer) // 3)
+        self._send_json(200, {
+            'id': f'chatcmpl-stub-{stats.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.answer},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        })
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start_stub_server(port: int = 0,
+                      latency: float = 0.2,
+                      rpm: int = 0,
+                      answer: str = '<answer>Ответ заглушки</answer>') -> StubOpenAIServer:
+    """
+    Запускает заглушку в фоновом потоке; адрес - server.server_address (port=0 - свободный порт).
+    """
+    server = StubOpenAIServer(('127.0.0.1', port), latency, rpm, answer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого API")
+    parser.add_argument('--port', type=int, default=8400)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--rpm', type=int, default=0, help="Лимит запросов в минуту (0 - без лимита)")
+    parser.add_argument('--answer', default='<answer>Ответ заглушки</answer>')
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(('127.0.0.1', args.port), args.latency_ms / 1000, args.rpm, args.answer)
+    print(f"Заглушка OpenAI API: http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
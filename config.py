@@ -20,6 +20,42 @@ RAG_CONFIG = {
         'k': int(os.getenv("RAG_SEARCH_K", "20")),
         'score_threshold': float(os.getenv("RAG_SCORE_THRESHOLD", "0.5"))
     },
+    # Поиск файлов документов во всех корнях из LoadDocuments
+    'discovery': {
+        # Паттерны через запятую, сопоставляются с именем файла и путем относительно корня
+        'include': [p for p in os.getenv("RAG_DISCOVERY_INCLUDE", "*.pdf,*.txt,*.docx").split(",") if p],
+        'exclude': [p for p in os.getenv("RAG_DISCOVERY_EXCLUDE", ".*,~$*,__pycache__").split(",") if p],
+        'min_size': int(os.getenv("RAG_DISCOVERY_MIN_SIZE", "1")),
+        # Максимальный размер файла в мегабайтах (0 - без ограничения)
+        'max_size_mb': int(os.getenv("RAG_DISCOVERY_MAX_SIZE_MB", "0")),
+        'follow_symlinks': os.getenv("RAG_DISCOVERY_FOLLOW_SYMLINKS", "false").lower() == "true",
+        # Количество потоков для параллельного чтения директорий (важно для сетевых папок)
+        'workers': int(os.getenv("RAG_DISCOVERY_WORKERS", "8"))
+    },
+    # Дисковый кэш текста, извлеченного из PDF и DOCX (ключ - хеш содержимого файла)
+    'text_cache': {
+        'enabled': os.getenv("RAG_TEXT_CACHE", "true").lower() == "true",
+        'dir': os.getenv("RAG_TEXT_CACHE_DIR", os.path.join("cache", "extracted_text")),
+        # Максимальный размер кэша в мегабайтах, при превышении удаляются давно не использованные записи
+        'max_mb': int(os.getenv("RAG_TEXT_CACHE_MAX_MB", "1024"))
+    },
+    # Потоковая загрузка: страницы загружаются, обрабатываются и разбиваются по одной
+    # (не поддерживается сплиттером recursive)
+    'streaming_ingest': os.getenv("RAG_STREAMING_INGEST", "true").lower() == "true",
+    # Сплиттер: offset (линейный проход, чанки в виде смещений), tokens (длина чанка в токенах
+    # модели эмбеддингов) или recursive (RecursiveCharacterTextSplitter)
+    'splitter': os.getenv("RAG_SPLITTER", "offset"),
+    # Параметры разбиения по токенам: бюджет чанка равен max_seq_length модели
+    # за вычетом специальных токенов и запаса margin
+    'token_splitter': {
+        'chunk_overlap': int(os.getenv("RAG_TOKEN_CHUNK_OVERLAP", "64")),
+        'margin': int(os.getenv("RAG_TOKEN_MARGIN", "8")),
+        'batch_size': int(os.getenv("RAG_TOKENIZER_BATCH_SIZE", "64"))
+    },
+    # Модель эмбеддингов sentence-transformers
+    'embedding_model': os.getenv("RAG_EMBEDDING_MODEL", "sergeyzh/LaBSE-ru-turbo"),
+    # Размер пакета текстов при вычислении эмбеддингов чанков
+    'embedding_batch_size': int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "1024")),
     'text_splitter': {
         'chunk_size': int(os.getenv("RAG_CHUNK_SIZE", "512")),
         'chunk_overlap': int(os.getenv("RAG_CHUNK_OVERLAP", "128")),
@@ -27,5 +63,140 @@ RAG_CONFIG = {
         'is_separator_regex': False,
         'separators': ["\n\n", "\n", ". ", " ", ""]
     },
-    'max_context_length': int(os.getenv("RAG_MAX_CONTEXT_LENGTH", "16000"))
+    'max_context_length': int(os.getenv("RAG_MAX_CONTEXT_LENGTH", "16000")),
+    # Лимит контекста в токенах по длинам чанков из хранилища (0 - не ограничивать)
+    'max_context_tokens': int(os.getenv("RAG_MAX_CONTEXT_TOKENS", "0")),
+    # Директория для сохранения индекса FAISS и колоночного хранилища чанков
+    'index_dir': os.getenv("RAG_INDEX_DIR", "index"),
+    # Формат хранения векторов в индексе
+    'vector_storage': {
+        # float32 (без сжатия), float16, int8 (скалярное квантование) или binary
+        'precision': os.getenv("RAG_VECTOR_PRECISION", "float32"),
+        # Во сколько раз больше кандидатов отбирается для точного пересчета по float32
+        'rescore_factor': int(os.getenv("RAG_RESCORE_FACTOR", "4")),
+        # Строить ли отчет об экономии памяти и изменении recall@k при создании индекса
+        'report': os.getenv("RAG_QUANTIZATION_REPORT", "false").lower() == "true",
+        'report_k': int(os.getenv("RAG_QUANTIZATION_REPORT_K", "10"))
+    },
+    # Именованные коллекции документов (например, по отделам) с общими моделями
+    'collections': {
+        # Коллекции в формате "имя=директория документов;имя2=директория2"
+        'dirs': dict(
+            item.split("=", 1) for item in os.getenv("RAG_COLLECTIONS", "").split(";") if "=" in item
+        ),
+        # Директория индексов коллекций: индекс коллекции хранится в <root>/<имя>
+        'root': os.getenv("RAG_COLLECTIONS_DIR", "collections"),
+        # Ограничение памяти загруженных коллекций в мегабайтах (0 - без ограничения)
+        'memory_cap_mb': int(os.getenv("RAG_COLLECTIONS_MEMORY_MB", "4096"))
+    },
+    # Клиент LLM: общий пул соединений и лимиты провайдера (0 - без ограничения)
+    'llm_client': {
+        'max_concurrent': int(os.getenv("LLM_MAX_CONCURRENT", "8")),
+        'requests_per_minute': float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+        'tokens_per_minute': float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+        # Ожидаемая длина ответа в токенах, добавляемая к оценке промпта
+        'expected_completion_tokens': int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "512")),
+        # Повторы одного запроса после ответа 429
+        'max_rate_limit_retries': int(os.getenv("LLM_RATE_LIMIT_RETRIES", "5")),
+        'timeout': float(os.getenv("LLM_TIMEOUT", "60.0"))
+    },
+    # Допуск запросов: не более max_concurrent запросов обрабатываются одновременно,
+    # остальные ждут в очереди до max_queue запросов и не дольше queue_timeout секунд
+    'admission': {
+        'enabled': os.getenv("RAG_ADMISSION", "true").lower() == "true",
+        'max_concurrent': int(os.getenv("RAG_MAX_CONCURRENT_QUERIES", "8")),
+        'max_queue': int(os.getenv("RAG_MAX_QUEUED_QUERIES", "64")),
+        'queue_timeout': float(os.getenv("RAG_QUEUE_TIMEOUT", "10.0")),
+        # Одновременно выполняемые этапы запросов
+        'stages': {
+            'retrieve': int(os.getenv("RAG_STAGE_RETRIEVE_LIMIT", "4")),
+            'rerank': int(os.getenv("RAG_STAGE_RERANK_LIMIT", "2")),
+            'llm': int(os.getenv("RAG_STAGE_LLM_LIMIT", "8"))
+        }
+    },
+    # Распределение ядер между этапами запроса (эмбеддинг, реранжирование, поиск)
+    'cpu_scheduler': {
+        # latency - меньше задержка одного запроса, throughput - больше запросов в секунду,
+        # off - общий пул asyncio.to_thread и потоки torch/FAISS по умолчанию
+        'profile': os.getenv("RAG_CPU_PROFILE", "latency"),
+        # Количество распределяемых ядер (0 - все доступные процессу)
+        'cores': int(os.getenv("RAG_CPU_CORES", "0"))
+    },
+    # Многопроцессный HTTP-сервер (serve_rag.py): рабочие процессы создаются через fork
+    # после загрузки моделей и отображенного в память индекса и разделяют их страницы
+    'serving': {
+        'host': os.getenv("RAG_SERVE_HOST", "127.0.0.1"),
+        'port': int(os.getenv("RAG_SERVE_PORT", "8000")),
+        'workers': int(os.getenv("RAG_SERVE_WORKERS", "2")),
+        # Потоки torch и FAISS в рабочем процессе (0 - ядра / рабочие процессы)
+        'threads_per_worker': int(os.getenv("RAG_SERVE_THREADS_PER_WORKER", "0"))
+    },
+    # Логи пишутся в файл отдельным потоком; на уровне INFO запросы не логируют ответы и документы
+    'logging': {
+        'level': os.getenv("RAG_LOG_LEVEL", "INFO").upper(),
+        # Число хранимых файлов после ротации в полночь (0 - хранить все)
+        'backup_count': int(os.getenv("RAG_LOG_BACKUP_COUNT", "14"))
+    },
+    # Трассировка этапов загрузки и запросов: метрики Prometheus и трассы запросов в JSON
+    'tracing': {
+        'enabled': os.getenv("RAG_TRACING", "false").lower() == "true",
+        # Файл трасс в формате JSON Lines (пусто - трассы только в памяти)
+        'traces_file': os.getenv("RAG_TRACES_FILE", ""),
+        # Границы корзин гистограмм длительности этапов, с
+        'buckets': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0],
+        # Сколько последних трасс хранить в памяти
+        'max_traces': int(os.getenv("RAG_MAX_TRACES", "100"))
+    },
+    # Параллельная сборка индекса по шардам в рабочих процессах (0 или 1 - без шардов)
+    'sharding': {
+        'shards': int(os.getenv("RAG_SHARDS", "0")),
+        # Количество рабочих процессов (0 - по числу шардов)
+        'workers': int(os.getenv("RAG_SHARD_WORKERS", "0")),
+        # Директория шардов с манифестом shards.json
+        'dir': os.getenv("RAG_SHARDS_DIR", "index_shards"),
+        # Объединять шарды в один индекс (иначе поиск выполняется по шардам)
+        'merge': os.getenv("RAG_SHARDS_MERGE", "true").lower() == "true",
+        # Поиск по шардам: local (в текущем процессе) или process (каждый шард в своем процессе)
+        'serving': os.getenv("RAG_SHARD_SERVING", "local"),
+        # Таймаут ответа одного шарда в секундах
+        'timeout': float(os.getenv("RAG_SHARD_TIMEOUT", "5.0"))
+    },
+    # Сборка индекса вне памяти: эмбеддинги пишутся пакетами в файл на диске (np.memmap),
+    # индекс строится из него частями, прерванная сборка продолжается с последнего пакета
+    'out_of_core': {
+        'enabled': os.getenv("RAG_OUT_OF_CORE", "false").lower() == "true",
+        # Рабочая директория сборки (файл эмбеддингов и прогресс)
+        'dir': os.getenv("RAG_OUT_OF_CORE_DIR", os.path.join("cache", "index_build")),
+        # Количество векторов, добавляемых в индекс за один раз
+        'add_batch_size': int(os.getenv("RAG_OUT_OF_CORE_ADD_BATCH_SIZE", "65536")),
+        # Размер выборки для обучения квантователя int8/float16
+        'train_size': int(os.getenv("RAG_OUT_OF_CORE_TRAIN_SIZE", "100000"))
+    },
+    # Удаление дубликатов чанков перед вычислением эмбеддингов
+    'deduplication': {
+        'enabled': os.getenv("RAG_DEDUP", "true").lower() == "true",
+        # Поиск почти точных дубликатов через MinHash/LSH (иначе только точные по хешу)
+        'near_duplicates': os.getenv("RAG_DEDUP_NEAR", "true").lower() == "true",
+        'threshold': float(os.getenv("RAG_DEDUP_THRESHOLD", "0.8")),
+        'shingle_size': int(os.getenv("RAG_DEDUP_SHINGLE_SIZE", "5")),
+        'num_perm': int(os.getenv("RAG_DEDUP_NUM_PERM", "64")),
+        'bands': int(os.getenv("RAG_DEDUP_BANDS", "16"))
+    },
+    # Гибридный поиск: плотный (FAISS) + лексический (BM25) с объединением через RRF
+    'hybrid': {
+        'enabled': os.getenv("RAG_HYBRID", "false").lower() == "true",
+        'dense_k': int(os.getenv("RAG_HYBRID_DENSE_K", "20")),
+        'lexical_k': int(os.getenv("RAG_HYBRID_LEXICAL_K", "20")),
+        'rrf_k': int(os.getenv("RAG_HYBRID_RRF_K", "60")),
+        'bm25_k1': float(os.getenv("RAG_BM25_K1", "1.5")),
+        'bm25_b': float(os.getenv("RAG_BM25_B", "0.75"))
+    },
+    # Диверсификация результатов методом maximal marginal relevance
+    'mmr': {
+        'enabled': os.getenv("RAG_MMR", "false").lower() == "true",
+        # Количество кандидатов, из которых выбираются k разнообразных
+        'fetch_k': int(os.getenv("RAG_MMR_FETCH_K", "50")),
+        # 1.0 - только релевантность, 0.0 - только разнообразие
+        'lambda_mult': float(os.getenv("RAG_MMR_LAMBDA", "0.5"))
+    }
 }
@@ -0,0 +1,66 @@
+import os
+
+# Многопроцессный режим использует fork, который CUDA не поддерживает:
+# модели загружаются на CPU, если устройство не задано явно
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+# Пул потоков токенизаторов не переживает fork
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+import argparse
+import asyncio
+from src.rag import AdvancedRAG
+from src.date.quantized_index import RescoringIndex
+from src.date.vector_store import VectorStore
+from src.serving.prefork_server import PreforkServer
+from utils.mylogger import Logger
+from config import Config_LLM, RAG_CONFIG
+
+# Инициализация логгера для отслеживания работы сервера
+logger = Logger('Serve RAG', 'logs/rag.log')
+
+
+async def prepare_LLM(index_dir: str) -> AdvancedRAG:
+    """
+    Создает AdvancedRAG и загружает сохраненный индекс с отображением в память.
+
+    Индекс FAISS, колонки хранилища, индекс метаданных и BM25 отображаются
+    из файлов, поэтому рабочие процессы после fork читают их из общего
+    страничного кэша. Индекс строится заранее через start_rag.py.
+
+    Raises:
+        FileNotFoundError: Если сохраненный индекс не найден
+    """
+    if not (RescoringIndex.exists(index_dir) or os.path.exists(os.path.join(index_dir, VectorStore.INDEX_FILE))):
+        raise FileNotFoundError(f"Индекс не найден в {index_dir}: сначала постройте его через start_rag.py")
+    llm = AdvancedRAG(
+        Config_LLM.model_name,
+        Config_LLM.api_key,
+        Config_LLM.base_url,
+        Config_LLM.temperature
+    )
+    await llm.vector_store_manager.load_vector_store_async(index_dir, mmap=True)
+    await llm.retriever_manager.setup_retrievers_async()
+    llm.promts.setup_prompts()
+    return llm
+
+
+def main() -> None:
+    serving = RAG_CONFIG["serving"]
+    parser = argparse.ArgumentParser(description="Многопроцессный HTTP-сервер RAG с общим индексом")
+    parser.add_argument("--index-dir", default=RAG_CONFIG["index_dir"])
+    parser.add_argument("--host", default=serving["host"])
+    parser.add_argument("--port", type=int, default=serving["port"])
+    parser.add_argument("--workers", type=int, default=serving["workers"])
+    parser.add_argument("--threads-per-worker", type=int, default=serving["threads_per_worker"])
+    args = parser.parse_args()
+
+    # asyncio.run завершает пул потоков загрузки: к моменту fork в процессе нет лишних потоков
+    llm = asyncio.run(prepare_LLM(args.index_dir))
+    # Модели загружаются в фоне: fork выполняется после окончания загрузки
+    llm.wait_for_models()
+    PreforkServer(llm, args.host, args.port, args.workers, args.threads_per_worker).serve_forever()
+
+
+if __name__ == "__main__":
+    logger.info("Запуск сервера")
+    main()
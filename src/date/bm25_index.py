@@ -0,0 +1,298 @@
+from typing import Dict, List, Optional, Tuple
+from array import array
+import json
+import os
+import re
+
+import numpy as np
+
+from utils.mylogger import Logger
+from src.date.compact_docstore import CompactDocstore
+
+# Инициализация логгера для отслеживания работы лексического индекса
+logger = Logger('BM25Index', 'logs/rag.log')
+
+try:
+    import snowballstemmer
+except ImportError:  # pragma: no cover - стеммер Snowball необязателен
+    snowballstemmer = None
+
+# Слова, числа и идентификаторы вида "ст.12", "A-123", "1.2.3"
+TOKEN_PATTERN = re.compile(r"\w+(?:[./\-]\w+)*")
+CYRILLIC_PATTERN = re.compile(r"[а-я]")
+
+# Окончания для упрощенного стемминга русских слов, если Snowball недоступен
+RUSSIAN_ENDINGS = sorted([
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ую', 'юю', 'ию',
+    'ия', 'ть', 'ться', 'ется', 'ится', 'ешь', 'ишь', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят',
+    'ал', 'ял', 'ил', 'ла', 'ли', 'ло', 'ость', 'ости', 'ение', 'ения', 'ению', 'ением',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь'
+], key=len, reverse=True)
+
+
+class RussianTokenizer:
+    """
+    Токенизатор для русско- и англоязычных текстов со стеммингом.
+
+    Особенности:
+    - Приводит текст к нижнему регистру и заменяет "ё" на "е"
+    - Сохраняет составные идентификаторы (номера статей, артикулы) целиком
+      и дополнительно добавляет их части
+    - Использует стеммер Snowball при наличии пакета snowballstemmer,
+      иначе упрощенное отсечение русских окончаний
+    """
+    def __init__(self) -> None:
+        if snowballstemmer is not None:
+            self._russian = snowballstemmer.stemmer('russian')
+            self._english = snowballstemmer.stemmer('english')
+        else:
+            self._russian = None
+            self._english = None
+        self._cache: Dict[str, str] = {}
+
+    def _stem(self, word: str) -> str:
+        stem = self._cache.get(word)
+        if stem is not None:
+            return stem
+        if word.isdigit() or len(word) <= 3:
+            stem = word
+        elif CYRILLIC_PATTERN.search(word):
+            if self._russian is not None:
+                stem = self._russian.stemWord(word)
+            else:
+                stem = word
+                for ending in RUSSIAN_ENDINGS:
+                    if word.endswith(ending) and len(word) - len(ending) >= 3:
+                        stem = word[:-len(ending)]
+                        break
+        elif self._english is not None:
+            stem = self._english.stemWord(word)
+        else:
+            stem = word
+        if len(self._cache) < 500000:
+            self._cache[word] = stem
+        return stem
+
+    def tokenize(self, text: str) -> List[str]:
+        """
+        Разбивает текст на нормализованные термы.
+
+        Args:
+            text (str): Исходный текст
+
+        Returns:
+            List[str]: Список термов
+        """
+        tokens = []
+        for match in TOKEN_PATTERN.finditer(text.lower().replace('ё', 'е')):
+            token = match.group()
+            if token.isalpha():
+                tokens.append(self._stem(token))
+                continue
+            # Составной идентификатор индексируется целиком и по частям
+            tokens.append(token)
+            parts = re.split(r"[./\-_]", token)
+            if len(parts) > 1:
+                tokens.extend(self._stem(part) for part in parts if part)
+        return tokens
+
+
+class BM25Index:
+    """
+    Лексический инвертированный индекс с ранжированием BM25.
+
+    Постинги хранятся в компактных массивах numpy (CSR):
+    - term_ptr: границы постингов каждого терма
+    - doc_ids: номера чанков (совпадают с номерами в индексе FAISS)
+    - tfs: частоты терма в чанке
+    Индекс сохраняется рядом с индексом FAISS и загружается через memory map.
+
+    Attributes:
+        vocabulary (Dict[str, int]): Словарь терм -> номер терма
+        k1 (float): Параметр насыщения частоты терма
+        b (float): Параметр нормализации по длине чанка
+    """
+    VOCAB_FILE = 'vocabulary.json'
+    PTR_FILE = 'term_ptr.npy'
+    DOC_IDS_FILE = 'doc_ids.npy'
+    TFS_FILE = 'tfs.npy'
+    DOC_LENS_FILE = 'doc_lens.npy'
+
+    def __init__(self,
+                 vocabulary: Dict[str, int],
+                 term_ptr: np.ndarray,
+                 doc_ids: np.ndarray,
+                 tfs: np.ndarray,
+                 doc_lens: np.ndarray,
+                 k1: float = 1.5,
+                 b: float = 0.75) -> None:
+        self.vocabulary = vocabulary
+        self.term_ptr = term_ptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.ntotal = len(doc_lens)
+        self.avgdl = float(np.mean(doc_lens)) if self.ntotal else 0.0
+        self.tokenizer = RussianTokenizer()
+
+    @classmethod
+    def from_texts(cls, texts, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """
+        Строит индекс по последовательности текстов чанков.
+
+        Args:
+            texts: Итерируемая последовательность текстов в порядке номеров чанков
+            k1 (float): Параметр насыщения частоты терма
+            b (float): Параметр нормализации по длине чанка
+
+        Returns:
+            BM25Index: Построенный индекс
+        """
+        tokenizer = RussianTokenizer()
+        vocabulary: Dict[str, int] = {}
+        # Постинги накапливаются в компактных массивах, а не в списках объектов
+        term_column = array('i')
+        doc_column = array('i')
+        tf_column = array('H')
+        doc_lens = array('i')
+
+        for doc_id, text in enumerate(texts):
+            tokens = tokenizer.tokenize(text)
+            doc_lens.append(len(tokens))
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            for term_id, tf in counts.items():
+                term_column.append(term_id)
+                doc_column.append(doc_id)
+                tf_column.append(min(tf, 65535))
+
+        terms = np.frombuffer(term_column, dtype=np.int32) if len(term_column) else np.empty(0, dtype=np.int32)
+        order = np.argsort(terms, kind='stable')
+        term_ptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=term_ptr[1:])
+
+        index = cls(
+            vocabulary,
+            term_ptr,
+            np.asarray(doc_column, dtype=np.int32)[order],
+            np.asarray(tf_column, dtype=np.uint16)[order],
+            np.asarray(doc_lens, dtype=np.int32),
+            k1,
+            b
+        )
+        logger.info("Лексический индекс построен: %s чанков, "
+                    "%s термов, %s постингов", index.ntotal, len(vocabulary), len(index.doc_ids))
+        return index
+
+    @classmethod
+    def from_docstore(cls, docstore: CompactDocstore, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """
+        Строит индекс по текстам колоночного хранилища.
+        """
+        return cls.from_texts((docstore.get_text(i) for i in range(len(docstore))), k1, b)
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск k чанков с наибольшей оценкой BM25.
+
+        Args:
+            query (str): Текстовый запрос
+            k (int): Количество результатов
+            mask (Optional[np.ndarray]): Булева маска допустимых чанков (фильтр метаданных)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Номера чанков и их оценки BM25 в порядке убывания
+        """
+        term_ids = {self.vocabulary[token] for token in self.tokenizer.tokenize(query) if token in self.vocabulary}
+        if not term_ids or self.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = np.zeros(self.ntotal, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = int(self.term_ptr[term_id]), int(self.term_ptr[term_id + 1])
+            docs = np.asarray(self.doc_ids[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1.0 + (self.ntotal - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lens[docs] / max(self.avgdl, 1e-9))
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+        if mask is not None:
+            scores[~mask] = 0.0
+        candidates = np.flatnonzero(scores)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return ranked.astype(np.int64), scores[ranked]
+
+    def save(self, path: str) -> None:
+        """
+        Сохраняет индекс в директорию.
+
+        Args:
+            path (str): Путь к директории для сохранения
+        """
+        os.makedirs(path, exist_ok=True)
+        terms = [None] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        with open(os.path.join(path, self.VOCAB_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'terms': terms, 'k1': self.k1, 'b': self.b}, f, ensure_ascii=False)
+        np.save(os.path.join(path, self.PTR_FILE), np.asarray(self.term_ptr))
+        np.save(os.path.join(path, self.DOC_IDS_FILE), np.asarray(self.doc_ids))
+        np.save(os.path.join(path, self.TFS_FILE), np.asarray(self.tfs))
+        np.save(os.path.join(path, self.DOC_LENS_FILE), np.asarray(self.doc_lens))
+        logger.info("Лексический индекс сохранен в %s", path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "BM25Index":
+        """
+        Загружает индекс из директории.
+
+        Args:
+            path (str): Путь к директории с сохраненным индексом
+            mmap (bool): Отображать постинги в память вместо чтения целиком
+
+        Returns:
+            BM25Index: Загруженный индекс
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, cls.VOCAB_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(
+            {term: term_id for term_id, term in enumerate(meta['terms'])},
+            np.load(os.path.join(path, cls.PTR_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, cls.DOC_IDS_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, cls.TFS_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, cls.DOC_LENS_FILE), mmap_mode=mmap_mode),
+            meta['k1'],
+            meta['b']
+        )
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int, rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Объединяет несколько ранжированных списков методом reciprocal rank fusion.
+
+    Оценка чанка: сумма 1 / (rrf_k + ранг) по всем спискам, где он встречается.
+
+    Args:
+        rankings (List[np.ndarray]): Списки номеров чанков, упорядоченные по убыванию релевантности
+        k (int): Количество результатов
+        rrf_k (int): Сглаживающая константа RRF
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Номера чанков и их оценки RRF в порядке убывания
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (rrf_k + rank)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return (np.array([doc_id for doc_id, _ in ranked], dtype=np.int64),
+            np.array([score for _, score in ranked], dtype=np.float32))
@@ -0,0 +1,250 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import asyncio
+import gc
+import os
+import threading
+import time
+
+from utils.mylogger import Logger
+from src.date.quantized_index import RescoringIndex
+from src.date.vector_store import VectorStore
+from src.retrieval.retriever import Retriever
+from config import RAG_CONFIG
+
+# Инициализация логгера для отслеживания работы коллекций
+logger = Logger('CollectionManager', 'logs/rag.log')
+
+
+class Collection:
+    """
+    Именованная коллекция документов со своим индексом на диске.
+
+    Коллекция повторяет атрибуты AdvancedRAG, которые используют VectorStore
+    и Retriever (sentence_transformer, vectorstore, metadata_index, lexical_index,
+    retriever), поэтому для нее создаются свои VectorStore и Retriever,
+    а модели эмбеддингов берутся общие у AdvancedRAG.
+
+    Attributes:
+        name (str): Имя коллекции
+        docs_dir (Optional[str]): Директория документов (для сборки индекса, если его нет)
+        index_dir (str): Директория сохраненного индекса коллекции
+    """
+    def __init__(self, name: str, docs_dir: Optional[str], index_dir: str, sentence_transformer) -> None:
+        self.name = name
+        self.docs_dir = docs_dir
+        self.index_dir = index_dir
+        self.sentence_transformer = sentence_transformer
+        self.metadata_index = None
+        self.lexical_index = None
+        self.vector_store_manager = VectorStore(self)
+        # Как и в AdvancedRAG: до загрузки vectorstore указывает на менеджер хранилища
+        self.vectorstore = self.vector_store_manager
+        self.retriever_manager = Retriever(self)
+        self.retriever = self.retriever_manager
+        self.loaded = False
+        self.nbytes = 0
+        # Количество запросов, выполняемых с коллекцией прямо сейчас
+        self.active = 0
+        # Одновременные первые запросы к коллекции загружают ее один раз
+        self.load_lock = asyncio.Lock()
+
+    async def load_async(self) -> None:
+        """
+        Загружает индекс коллекции с диска; если индекса нет, строит его из docs_dir.
+
+        Raises:
+            FileNotFoundError: Если нет ни сохраненного индекса, ни директории документов
+        """
+        started = time.perf_counter()
+        index_exists = (RescoringIndex.exists(self.index_dir)
+                        or os.path.exists(os.path.join(self.index_dir, VectorStore.INDEX_FILE)))
+        if index_exists:
+            await self.vector_store_manager.load_vector_store_async(self.index_dir)
+        elif self.docs_dir:
+            from src.handle_dir_and_files.load_documents import LoadDocuments
+            from src.handle_dir_and_files.process_documents import ProcessDocuments
+
+            logger.info("Индекс коллекции %s не найден, строим из %s", self.name, self.docs_dir)
+            # Файлы сборки пишутся в директории коллекции, а не в общие index_dir и
+            # out_of_core.dir, которые может отображать в память основной индекс
+            work_dir = os.path.join(RAG_CONFIG["out_of_core"]["dir"], 'collections', self.name)
+            if RAG_CONFIG["streaming_ingest"] and RAG_CONFIG["splitter"] != "recursive":
+                pages = ProcessDocuments().iter_processed(LoadDocuments([self.docs_dir]).iter_documents())
+                await self.vector_store_manager.create_vector_store_from_stream_async(pages, self.index_dir, work_dir)
+            else:
+                documents = await LoadDocuments([self.docs_dir]).load_documents_async()
+                documents = await ProcessDocuments(documents).process_documents_async()
+                await self.vector_store_manager.create_vector_store_async(documents, self.index_dir, work_dir)
+            await self.vector_store_manager.save_vector_store_async(self.index_dir)
+        else:
+            raise FileNotFoundError(f"Для коллекции {self.name} нет ни индекса в {self.index_dir}, "
+                                    f"ни директории документов")
+        await self.retriever_manager.setup_retrievers_async()
+        self.loaded = True
+        self.nbytes = self.estimate_nbytes()
+        logger.info("Коллекция %s загружена за %.2f с, "
+                    "%s байт", self.name, time.perf_counter() - started, self.nbytes)
+
+    def estimate_nbytes(self) -> int:
+        """
+        Оценка памяти коллекции: компактные коды или векторы индекса, колонки хранилища,
+        индекс метаданных и BM25 (для отображенных в память файлов - их размер).
+        """
+        nbytes = 0
+        index = getattr(self.vectorstore, 'index', None)
+        if isinstance(index, RescoringIndex):
+            nbytes += index.code_nbytes
+        elif index is not None:
+            nbytes += index.ntotal * index.d * 4
+        docstore = getattr(self.vectorstore, 'docstore', None)
+        nbytes += getattr(docstore, 'nbytes', 0)
+        for owner, names in ((self.metadata_index, ('source_order', 'source_ptr')),
+                             (self.lexical_index, ('term_ptr', 'doc_ids', 'tfs', 'doc_lens'))):
+            if owner is not None:
+                nbytes += sum(getattr(owner, name).nbytes for name in names)
+        return int(nbytes)
+
+    def unload(self) -> None:
+        """
+        Освобождает индекс, хранилище и ретриверы коллекции.
+        """
+        self.retriever_manager.close_shards()
+        self.vectorstore = self.vector_store_manager
+        self.metadata_index = None
+        self.lexical_index = None
+        self.retriever = self.retriever_manager
+        self.base_retriever = None
+        self.loaded = False
+        self.nbytes = 0
+
+
+class CollectionManager:
+    """
+    Управление именованными коллекциями документов с общими моделями.
+
+    Вместо отдельного процесса (и отдельных копий моделей эмбеддингов и
+    cross-encoder) на каждый набор документов все коллекции обслуживаются
+    одним AdvancedRAG:
+    - коллекция загружается при первом запросе к ней
+    - общий объем загруженных коллекций ограничен memory_cap байт; при превышении
+      выгружаются коллекции, которые дольше всего не использовались (LRU),
+      кроме коллекций, с которыми сейчас выполняются запросы
+
+    Attributes:
+        memory_cap (int): Ограничение памяти загруженных коллекций в байтах (0 - без ограничения)
+    """
+    def __init__(self, llm, collections: Dict[str, str], root: str, memory_cap: int = 0) -> None:
+        """
+        Args:
+            llm: Экземпляр AdvancedRAG с общими моделями
+            collections (Dict[str, str]): Имя коллекции -> директория документов
+            root (str): Директория, в которой хранятся индексы коллекций (root/<имя>)
+            memory_cap (int): Ограничение памяти загруженных коллекций в байтах
+        """
+        self.llm = llm
+        self.root = root
+        self.memory_cap = memory_cap
+        self.collections: Dict[str, Collection] = {
+            name: Collection(name, docs_dir, os.path.join(root, name), llm.sentence_transformer)
+            for name, docs_dir in collections.items()
+        }
+        # Загруженные коллекции в порядке последнего использования
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.collections)
+
+    @property
+    def loaded_nbytes(self) -> int:
+        return sum(self.collections[name].nbytes for name in self._lru)
+
+    def add(self, name: str, docs_dir: Optional[str] = None, index_dir: Optional[str] = None) -> Collection:
+        """
+        Регистрирует коллекцию (индекс загружается или строится при первом запросе).
+        """
+        collection = Collection(name, docs_dir, index_dir or os.path.join(self.root, name),
+                                self.llm.sentence_transformer)
+        with self._lock:
+            self.collections[name] = collection
+        return collection
+
+    async def _acquire_async(self, name: str) -> Collection:
+        collection = self.collections.get(name)
+        if collection is None:
+            raise KeyError(f"Коллекция {name} не найдена. Доступные коллекции: {', '.join(self.collections)}")
+        with self._lock:
+            collection.active += 1
+        try:
+            async with collection.load_lock:
+                if not collection.loaded:
+                    await collection.load_async()
+        except Exception:
+            with self._lock:
+                collection.active -= 1
+            raise
+        with self._lock:
+            self._lru[name] = None
+            self._lru.move_to_end(name)
+        self._evict()
+        return collection
+
+    def _release(self, collection: Collection) -> None:
+        with self._lock:
+            collection.active -= 1
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Выгружает давно не использованные коллекции, пока общий объем превышает ограничение.
+        """
+        if not self.memory_cap:
+            return
+        evicted = []
+        with self._lock:
+            for name in list(self._lru):
+                if self.loaded_nbytes <= self.memory_cap or len(self._lru) <= 1:
+                    break
+                collection = self.collections[name]
+                if collection.active:
+                    continue
+                del self._lru[name]
+                collection.unload()
+                evicted.append(name)
+        if evicted:
+            gc.collect()
+            logger.info("Выгружены коллекции %s: загружено %s байт "
+                        "из %s", ', '.join(evicted), self.loaded_nbytes, self.memory_cap)
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """
+        Контекст запроса к коллекции: загружает ее при необходимости и не дает
+        выгрузить, пока запрос выполняется.
+
+        Args:
+            name (str): Имя коллекции
+
+        Yields:
+            Collection: Загруженная коллекция
+
+        Raises:
+            KeyError: Если коллекция не зарегистрирована
+        """
+        collection = await self._acquire_async(name)
+        try:
+            yield collection
+        finally:
+            self._release(collection)
+
+    def unload_all(self) -> None:
+        """
+        Выгружает все коллекции.
+        """
+        with self._lock:
+            for name in list(self._lru):
+                self.collections[name].unload()
+            self._lru.clear()
@@ -0,0 +1,437 @@
+from collections.abc import Mapping
+from array import array
+from typing import Dict, Iterable, List, Optional, Union
+import json
+import os
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from utils.mylogger import Logger
+
+# Инициализация логгера для отслеживания работы колоночного хранилища
+logger = Logger('CompactDocstore', 'logs/rag.log')
+
+
+class IdentityIndexMapping(Mapping):
+    """
+    Отображение позиции в индексе FAISS на идентификатор документа.
+
+    В CompactDocstore идентификатор чанка совпадает с его позицией в индексе,
+    поэтому вместо словаря на миллионы элементов используется отображение,
+    которое возвращает переданный номер.
+    """
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def __getitem__(self, key: int) -> int:
+        key = int(key)
+        if key < 0 or key >= self.size:
+            raise KeyError(key)
+        return key
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class CompactDocstore(Docstore):
+    """
+    Колоночное хранилище чанков для векторного индекса.
+
+    Вместо отдельного объекта Document со своим словарем metadata на каждый чанк
+    хранилище держит:
+    - все тексты чанков в одном UTF-8 буфере и массив смещений в нем
+    - путь к источнику и номер страницы как целочисленные колонки
+    - остальные метаданные как интернированные JSON-строки
+
+    Хранилище может быть сохранено на диск и загружено через memory map.
+    Объекты Document создаются только для чанков, которые действительно
+    возвращаются в результатах поиска.
+
+    Attributes:
+        blob: Буфер с текстами всех чанков в кодировке UTF-8
+        offsets: Смещения начала каждого чанка в буфере (длина n + 1)
+        source_ids: Номер источника в таблице sources для каждого чанка (-1 если нет)
+        pages: Номер страницы для каждого чанка (-1 если нет)
+        extra_ids: Номер набора дополнительных метаданных в таблице extras (-1 если нет)
+        sources: Таблица уникальных путей к источникам
+        extras: Таблица уникальных наборов дополнительных метаданных в виде JSON
+        token_counts: Длина каждого чанка в токенах модели эмбеддингов (None если не известна)
+    """
+    BLOB_FILE = 'texts.bin'
+    OFFSETS_FILE = 'offsets.npy'
+    SOURCE_IDS_FILE = 'source_ids.npy'
+    PAGES_FILE = 'pages.npy'
+    EXTRA_IDS_FILE = 'extra_ids.npy'
+    TABLES_FILE = 'tables.json'
+    TOKEN_COUNTS_FILE = 'token_counts.npy'
+
+    def __init__(self,
+                 blob: np.ndarray,
+                 offsets: np.ndarray,
+                 source_ids: np.ndarray,
+                 pages: np.ndarray,
+                 extra_ids: np.ndarray,
+                 sources: List[str],
+                 extras: List[str],
+                 token_counts: Optional[np.ndarray] = None) -> None:
+        """
+        Инициализация колоночного хранилища из готовых колонок.
+
+        Args:
+            blob (np.ndarray): Буфер текстов (uint8)
+            offsets (np.ndarray): Смещения чанков в буфере (int64, длина n + 1)
+            source_ids (np.ndarray): Колонка номеров источников (int32)
+            pages (np.ndarray): Колонка номеров страниц (int32)
+            extra_ids (np.ndarray): Колонка номеров дополнительных метаданных (int32)
+            sources (List[str]): Таблица путей к источникам
+            extras (List[str]): Таблица дополнительных метаданных в формате JSON
+            token_counts (Optional[np.ndarray]): Колонка длин чанков в токенах (int32)
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.source_ids = source_ids
+        self.pages = pages
+        self.extra_ids = extra_ids
+        self.sources = sources
+        self.extras = extras
+        self.token_counts = token_counts
+        # Разобранные наборы дополнительных метаданных, заполняется по мере обращения
+        self._extras_cache: Dict[int, dict] = {}
+        self.index_to_docstore_id = IdentityIndexMapping(len(self))
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> "CompactDocstore":
+        """
+        Создает хранилище из последовательности документов (чанков).
+
+        Args:
+            documents (Iterable[Document]): Чанки в порядке их добавления в индекс
+
+        Returns:
+            CompactDocstore: Заполненное хранилище
+        """
+        return cls.from_texts((doc.page_content, doc.metadata) for doc in documents)
+
+    @classmethod
+    def from_spans(cls, spans) -> "CompactDocstore":
+        """
+        Создает хранилище из чанков в виде смещений (ChunkSpans).
+
+        Строка каждого чанка создается только на время кодирования в буфер,
+        объекты Document не создаются. Длины чанков в токенах (если сплиттер
+        их вычислил) сохраняются в колонку token_counts.
+
+        Args:
+            spans (ChunkSpans): Смещения чанков в исходных документах
+
+        Returns:
+            CompactDocstore: Заполненное хранилище
+        """
+        return cls.from_texts(
+            ((spans.text(i), spans.metadata(i)) for i in range(len(spans))),
+            token_counts=spans.token_counts
+        )
+
+    @classmethod
+    def from_texts(cls, items: Iterable, token_counts=None) -> "CompactDocstore":
+        """
+        Создает хранилище из последовательности пар (текст чанка, метаданные).
+
+        Последовательность может быть ленивой (например, потоковое разбиение страниц):
+        каждый текст сразу кодируется в буфер и не хранится отдельно.
+
+        Args:
+            items (Iterable): Пары (str, dict) или тройки (str, dict, длина в токенах)
+                в порядке добавления чанков в индекс
+            token_counts: Длины чанков в токенах в том же порядке (необязательно)
+
+        Returns:
+            CompactDocstore: Заполненное хранилище
+        """
+        blob = bytearray()
+        offsets = array('q', [0])
+        source_ids = array('i')
+        pages = array('i')
+        extra_ids = array('i')
+        source_table: Dict[str, int] = {}
+        extra_table: Dict[str, int] = {}
+        # Чанки одного документа разделяют один словарь метаданных,
+        # поэтому разбор метаданных повторяется только при смене документа
+        last_metadata = None
+        last_columns = (-1, -1, -1)
+
+        item_token_counts = array('i')
+        for item in items:
+            text, metadata = item[0], item[1]
+            if len(item) > 2 and item[2] >= 0:
+                item_token_counts.append(item[2])
+            blob += text.encode('utf-8')
+            offsets.append(len(blob))
+
+            if metadata is not last_metadata or last_metadata is None:
+                last_metadata = metadata
+                last_columns = cls._intern_metadata(metadata, source_table, extra_table)
+            source_id, page, extra_id = last_columns
+            source_ids.append(source_id)
+            pages.append(page)
+            extra_ids.append(extra_id)
+
+        if token_counts is None and item_token_counts and len(item_token_counts) == len(source_ids):
+            token_counts = item_token_counts
+        docstore = cls(
+            blob=np.frombuffer(blob, dtype=np.uint8),
+            offsets=np.asarray(offsets, dtype=np.int64),
+            source_ids=np.asarray(source_ids, dtype=np.int32),
+            pages=np.asarray(pages, dtype=np.int32),
+            extra_ids=np.asarray(extra_ids, dtype=np.int32),
+            sources=list(source_table),
+            extras=list(extra_table),
+            token_counts=None if token_counts is None else np.asarray(token_counts, dtype=np.int32)
+        )
+        logger.info("Колоночное хранилище создано: %s чанков, "
+                    "%s байт, %s источников", len(docstore), docstore.nbytes, len(docstore.sources))
+        return docstore
+
+    @classmethod
+    def concatenate(cls, docstores: List["CompactDocstore"]) -> "CompactDocstore":
+        """
+        Объединяет хранилища в одно: чанки следуют в порядке хранилищ, поэтому номер
+        чанка в объединенном хранилище равен сумме размеров предыдущих хранилищ
+        плюс номер чанка в своем хранилище.
+
+        Таблицы источников и дополнительных метаданных объединяются без повторов,
+        номера в колонках переназначаются.
+
+        Args:
+            docstores (List[CompactDocstore]): Объединяемые хранилища
+
+        Returns:
+            CompactDocstore: Объединенное хранилище
+        """
+        source_table: Dict[str, int] = {}
+        extra_table: Dict[str, int] = {}
+
+        def remap(ids: np.ndarray, values: List[str], table: Dict[str, int]) -> np.ndarray:
+            mapping = np.fromiter((table.setdefault(value, len(table)) for value in values),
+                                  dtype=np.int32, count=len(values))
+            ids = np.asarray(ids, dtype=np.int32)
+            if not len(mapping):
+                return np.full(len(ids), -1, dtype=np.int32)
+            return np.where(ids >= 0, mapping[np.maximum(ids, 0)], -1).astype(np.int32)
+
+        blobs, offsets, source_ids, pages, extra_ids = [], [np.zeros(1, dtype=np.int64)], [], [], []
+        base = 0
+        for docstore in docstores:
+            blobs.append(np.asarray(docstore.blob, dtype=np.uint8))
+            offsets.append(np.asarray(docstore.offsets[1:], dtype=np.int64) + base)
+            base += int(docstore.offsets[-1])
+            source_ids.append(remap(docstore.source_ids, docstore.sources, source_table))
+            pages.append(np.asarray(docstore.pages, dtype=np.int32))
+            extra_ids.append(remap(docstore.extra_ids, docstore.extras, extra_table))
+        token_counts = None
+        if docstores and all(docstore.token_counts is not None for docstore in docstores):
+            token_counts = np.concatenate([np.asarray(d.token_counts, dtype=np.int32) for d in docstores])
+
+        docstore = cls(
+            blob=np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8),
+            offsets=np.concatenate(offsets),
+            source_ids=np.concatenate(source_ids) if source_ids else np.zeros(0, dtype=np.int32),
+            pages=np.concatenate(pages) if pages else np.zeros(0, dtype=np.int32),
+            extra_ids=np.concatenate(extra_ids) if extra_ids else np.zeros(0, dtype=np.int32),
+            sources=list(source_table),
+            extras=list(extra_table),
+            token_counts=token_counts
+        )
+        logger.info("Объединено %s хранилищ: %s чанков, "
+                    "%s источников", len(docstores), len(docstore), len(docstore.sources))
+        return docstore
+
+    @staticmethod
+    def _intern_metadata(metadata: Optional[dict], source_table: Dict[str, int], extra_table: Dict[str, int]):
+        """
+        Раскладывает метаданные чанка на номер источника, страницу и номер набора остальных полей.
+        """
+        metadata = dict(metadata or {})
+        source = metadata.pop('source', None)
+        page = metadata.pop('page', None)
+
+        source_id = -1 if source is None else source_table.setdefault(str(source), len(source_table))
+        try:
+            page_value = int(page) if page is not None else -1
+        except (TypeError, ValueError):
+            # Нечисловой номер страницы сохраняем среди дополнительных метаданных
+            metadata['page'] = page
+            page_value = -1
+
+        extra_id = -1
+        if metadata:
+            extra = json.dumps(metadata, ensure_ascii=False, sort_keys=True, default=str)
+            extra_id = extra_table.setdefault(extra, len(extra_table))
+        return source_id, page_value, extra_id
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Объем памяти, занимаемый колонками хранилища, в байтах.
+        """
+        nbytes = (self.blob.nbytes + self.offsets.nbytes + self.source_ids.nbytes
+                  + self.pages.nbytes + self.extra_ids.nbytes)
+        if self.token_counts is not None:
+            nbytes += self.token_counts.nbytes
+        return int(nbytes)
+
+    def get_text(self, i: int) -> str:
+        """
+        Возвращает текст чанка по его номеру.
+
+        Args:
+            i (int): Номер чанка
+
+        Returns:
+            str: Текст чанка
+        """
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def get_metadata(self, i: int) -> dict:
+        """
+        Восстанавливает словарь метаданных чанка по его номеру.
+
+        Args:
+            i (int): Номер чанка
+
+        Returns:
+            dict: Метаданные чанка (источник, страница и дополнительные поля)
+        """
+        metadata = {}
+        extra_id = int(self.extra_ids[i])
+        if extra_id >= 0:
+            if extra_id not in self._extras_cache:
+                self._extras_cache[extra_id] = json.loads(self.extras[extra_id])
+            metadata.update(self._extras_cache[extra_id])
+        source_id = int(self.source_ids[i])
+        if source_id >= 0:
+            metadata['source'] = self.sources[source_id]
+        page = int(self.pages[i])
+        if page >= 0:
+            metadata['page'] = page
+        if self.token_counts is not None:
+            metadata['token_count'] = int(self.token_counts[i])
+        return metadata
+
+    def get_document(self, i: int) -> Document:
+        """
+        Создает объект Document для одного чанка.
+
+        Args:
+            i (int): Номер чанка
+
+        Returns:
+            Document: Документ с текстом и метаданными чанка
+        """
+        return Document(page_content=self.get_text(i), metadata=self.get_metadata(i))
+
+    def get_documents(self, ids: Iterable[int]) -> List[Document]:
+        """
+        Создает объекты Document только для переданных номеров чанков.
+
+        Args:
+            ids (Iterable[int]): Номера чанков (например, top-k результаты поиска)
+
+        Returns:
+            List[Document]: Документы в порядке переданных номеров
+        """
+        return [self.get_document(int(i)) for i in ids]
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        """
+        Поиск документа по идентификатору (интерфейс Docstore для FAISS из LangChain).
+
+        Args:
+            search (Union[int, str]): Идентификатор чанка
+
+        Returns:
+            Union[str, Document]: Документ или сообщение об его отсутствии
+        """
+        try:
+            i = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if i < 0 or i >= len(self):
+            return f"ID {search} not found."
+        return self.get_document(i)
+
+    def save(self, path: str) -> None:
+        """
+        Сохраняет колонки хранилища в директорию.
+
+        Args:
+            path (str): Путь к директории для сохранения
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, self.BLOB_FILE), 'wb') as f:
+            f.write(self.blob.tobytes())
+        np.save(os.path.join(path, self.OFFSETS_FILE), np.asarray(self.offsets))
+        np.save(os.path.join(path, self.SOURCE_IDS_FILE), np.asarray(self.source_ids))
+        np.save(os.path.join(path, self.PAGES_FILE), np.asarray(self.pages))
+        np.save(os.path.join(path, self.EXTRA_IDS_FILE), np.asarray(self.extra_ids))
+        token_counts_path = os.path.join(path, self.TOKEN_COUNTS_FILE)
+        if self.token_counts is not None:
+            np.save(token_counts_path, np.asarray(self.token_counts))
+        elif os.path.exists(token_counts_path):
+            # Длины от предыдущего хранилища не относятся к текущим чанкам
+            os.remove(token_counts_path)
+        with open(os.path.join(path, self.TABLES_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'sources': self.sources, 'extras': self.extras}, f, ensure_ascii=False)
+        logger.info("Колоночное хранилище сохранено в %s", path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CompactDocstore":
+        """
+        Загружает хранилище из директории.
+
+        Args:
+            path (str): Путь к директории с сохраненным хранилищем
+            mmap (bool): Отображать колонки в память (memory map) вместо чтения целиком
+
+        Returns:
+            CompactDocstore: Загруженное хранилище
+
+        Raises:
+            FileNotFoundError: Если директория не содержит сохраненного хранилища
+        """
+        blob_path = os.path.join(path, cls.BLOB_FILE)
+        if not os.path.exists(blob_path):
+            raise FileNotFoundError(f"Колоночное хранилище не найдено: {path}")
+        mmap_mode: Optional[str] = 'r' if mmap else None
+
+        if mmap and os.path.getsize(blob_path) > 0:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        else:
+            blob = np.fromfile(blob_path, dtype=np.uint8)
+
+        with open(os.path.join(path, cls.TABLES_FILE), 'r', encoding='utf-8') as f:
+            tables = json.load(f)
+        token_counts_path = os.path.join(path, cls.TOKEN_COUNTS_FILE)
+        token_counts = np.load(token_counts_path, mmap_mode=mmap_mode) if os.path.exists(token_counts_path) else None
+
+        docstore = cls(
+            blob=blob,
+            offsets=np.load(os.path.join(path, cls.OFFSETS_FILE), mmap_mode=mmap_mode),
+            source_ids=np.load(os.path.join(path, cls.SOURCE_IDS_FILE), mmap_mode=mmap_mode),
+            pages=np.load(os.path.join(path, cls.PAGES_FILE), mmap_mode=mmap_mode),
+            extra_ids=np.load(os.path.join(path, cls.EXTRA_IDS_FILE), mmap_mode=mmap_mode),
+            sources=tables['sources'],
+            extras=tables['extras'],
+            token_counts=token_counts
+        )
+        logger.info("Колоночное хранилище загружено из %s: %s чанков (mmap=%s)", path, len(docstore), mmap)
+        return docstore
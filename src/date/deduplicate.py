@@ -0,0 +1,284 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import hashlib
+import zlib
+
+import numpy as np
+
+from utils.mylogger import Logger
+from src.date.compact_docstore import CompactDocstore
+
+# Инициализация логгера для отслеживания удаления дубликатов
+logger = Logger('ChunkDeduplicator', 'logs/rag.log')
+
+# Простое число Мерсенна 2^61 - 1 для универсального хеширования MinHash
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class ChunkDeduplicator:
+    """
+    Удаление точных и почти точных дубликатов чанков перед вычислением эмбеддингов.
+
+    В общих папках с документами часто лежат копии и редакции одних и тех же файлов.
+    Без удаления дубликатов каждая копия получает свой эмбеддинг, попадает в индекс
+    и вытесняет из выдачи другие результаты.
+
+    Этапы:
+    1. Точные дубликаты: хеш текста чанка с нормализованными пробелами и регистром
+    2. Почти точные дубликаты: MinHash по словесным шинглам и LSH по полосам
+       сигнатуры; кандидат считается дубликатом, если оценка сходства Жаккара
+       не меньше threshold
+
+    Каждый чанк сравнивается только с уже оставленными чанками, поэтому цепочки
+    похожих чанков не склеиваются транзитивно. Источники удаленных дубликатов
+    сохраняются в метаданных оставленного чанка (alternate_sources).
+
+    Attributes:
+        shingle_size (int): Длина шингла в словах
+        num_perm (int): Количество хеш-функций MinHash (длина сигнатуры)
+        bands (int): Количество полос LSH
+        threshold (float): Минимальная оценка сходства Жаккара для почти дубликатов
+    """
+    def __init__(self,
+                 shingle_size: int = 5,
+                 num_perm: int = 64,
+                 bands: int = 16,
+                 threshold: float = 0.8,
+                 near_duplicates: bool = True,
+                 seed: int = 1) -> None:
+        """
+        Инициализация дедупликатора.
+
+        Args:
+            shingle_size (int): Длина шингла в словах
+            num_perm (int): Количество хеш-функций MinHash
+            bands (int): Количество полос LSH (num_perm должно делиться на bands)
+            threshold (float): Порог сходства Жаккара для почти дубликатов
+            near_duplicates (bool): Искать ли почти дубликаты (иначе только точные)
+            seed (int): Зерно генератора параметров хеш-функций
+
+        Raises:
+            ValueError: Если num_perm не делится на bands
+        """
+        if num_perm % bands:
+            raise ValueError(f"Длина сигнатуры ({num_perm}) должна делиться на количество полос ({bands})")
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.near_duplicates = near_duplicates
+        rng = np.random.default_rng(seed)
+        # Параметры хеш-функций (a * x + b) mod p; значения меньше 2^32, чтобы произведение не переполнялось
+        self._a = rng.integers(1, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        # Нечетные веса для свертки полосы сигнатуры в ключ корзины LSH
+        self._band_weights = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+    @staticmethod
+    def _normalize(text: str) -> List[str]:
+        return text.lower().replace('ё', 'е').split()
+
+    def _shingle_hashes(self, words: List[str]) -> List[int]:
+        """
+        Хеши словесных шинглов чанка (короткий чанк - один шингл из всех слов).
+        """
+        size = self.shingle_size
+        if len(words) <= size:
+            return [zlib.crc32(' '.join(words).encode('utf-8'))]
+        return [zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)]
+
+    def _signatures(self, shingles: List[List[int]], block_size: int = 100000) -> np.ndarray:
+        """
+        Вычисляет сигнатуры MinHash блоками шинглов нескольких чанков сразу.
+
+        Returns:
+            np.ndarray: Сигнатуры (n x num_perm, uint32)
+        """
+        signatures = np.empty((len(shingles), self.num_perm), dtype=np.uint32)
+        start = 0
+        while start < len(shingles):
+            stop, total = start, 0
+            while stop < len(shingles) and (stop == start or total + len(shingles[stop]) <= block_size):
+                total += len(shingles[stop])
+                stop += 1
+            lengths = np.fromiter((len(s) for s in shingles[start:stop]), dtype=np.int64, count=stop - start)
+            values = np.fromiter((h for s in shingles[start:stop] for h in s), dtype=np.uint64, count=total)
+            hashed = ((self._a * values[None, :] + self._b) % MERSENNE_PRIME) & MAX_HASH
+            bounds = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            signatures[start:stop] = np.minimum.reduceat(hashed, bounds, axis=1).T
+            start = stop
+        return signatures
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Ключи корзин LSH: полоса сигнатуры сворачивается в одно 64-битное число.
+
+        Совпадение ключей у разных полос дает лишнего кандидата, который
+        отсеивается сравнением сигнатур, поэтому коллизии не влияют на результат.
+
+        Returns:
+            np.ndarray: Ключи корзин (n x bands, uint64)
+        """
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        # Переполнение uint64 при умножении и сложении ожидаемо (арифметика по модулю 2^64)
+        return (bands * self._band_weights).sum(axis=2, dtype=np.uint64)
+
+    def find_duplicates(self,
+                        texts: Iterable[str],
+                        n: Optional[int] = None,
+                        block_size: int = 100000) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Находит для каждого текста номер оставляемого текста (себя или более раннего дубликата).
+
+        Тексты читаются по одному, сигнатуры MinHash вычисляются блоками примерно
+        по block_size шинглов. Между блоками в памяти остаются только хеши
+        текстов, сигнатуры оставленных чанков и корзины LSH, а не тексты, слова
+        и шинглы всех чанков.
+
+        Args:
+            texts (Iterable[str]): Тексты чанков в порядке номеров
+            n (Optional[int]): Количество текстов (по умолчанию len(texts))
+            block_size (int): Количество шинглов в блоке вычисления сигнатур
+
+        Returns:
+            Tuple[np.ndarray, Dict[str, int]]: Номер канонического чанка для каждого чанка
+                и количество точных и почти точных дубликатов
+        """
+        n = len(texts) if n is None else n
+        canonical = np.arange(n, dtype=np.int64)
+        counts = {'exact_duplicates': 0, 'near_duplicates': 0}
+        seen: Dict[bytes, int] = {}
+        # Номера и сигнатуры оставленных чанков; строки массивов выделяются по мере записи
+        kept_ids = np.empty(n, dtype=np.int64)
+        kept_signatures = np.empty((n if self.near_duplicates else 0, self.num_perm), dtype=np.uint32)
+        kept = 0
+        # Корзина хранит номер оставленного чанка, а при нескольких чанках - список номеров
+        buckets: List[Dict[int, Union[int, List[int]]]] = [{} for _ in range(self.bands)]
+        block_ids: List[int] = []
+        block_shingles: List[List[int]] = []
+
+        def match_block() -> None:
+            nonlocal kept
+            signatures = self._signatures(block_shingles)
+            keys = self._band_keys(signatures)
+            for row, i in enumerate(block_ids):
+                signature = signatures[row]
+                row_keys = keys[row].tolist()
+                candidates = set()
+                for band, key in enumerate(row_keys):
+                    bucket = buckets[band].get(key)
+                    if isinstance(bucket, list):
+                        candidates.update(bucket)
+                    elif bucket is not None:
+                        candidates.add(bucket)
+                match = -1
+                # Сравниваем с оставленными чанками в порядке их появления
+                for candidate in sorted(candidates):
+                    similarity = float(np.mean(kept_signatures[candidate] == signature))
+                    if similarity >= self.threshold:
+                        match = candidate
+                        break
+                if match >= 0:
+                    canonical[i] = kept_ids[match]
+                    counts['near_duplicates'] += 1
+                    continue
+                kept_ids[kept] = i
+                kept_signatures[kept] = signature
+                for band, key in enumerate(row_keys):
+                    bucket = buckets[band].get(key)
+                    if bucket is None:
+                        buckets[band][key] = kept
+                    elif isinstance(bucket, list):
+                        bucket.append(kept)
+                    else:
+                        buckets[band][key] = [bucket, kept]
+                kept += 1
+            block_ids.clear()
+            block_shingles.clear()
+
+        block_total = 0
+        for i, text in enumerate(texts):
+            words = self._normalize(text)
+            digest = hashlib.blake2b(' '.join(words).encode('utf-8'), digest_size=16).digest()
+            first = seen.setdefault(digest, i)
+            if first != i:
+                canonical[i] = first
+                counts['exact_duplicates'] += 1
+                continue
+            if not self.near_duplicates:
+                continue
+            shingles = self._shingle_hashes(words)
+            block_ids.append(i)
+            block_shingles.append(shingles)
+            block_total += len(shingles)
+            if block_total >= block_size:
+                match_block()
+                block_total = 0
+        if block_ids:
+            match_block()
+
+        return canonical, counts
+
+    def deduplicate(self,
+                    docstore: CompactDocstore,
+                    bytes_per_vector: int = 0) -> Tuple[CompactDocstore, Dict]:
+        """
+        Удаляет дубликаты чанков из колоночного хранилища.
+
+        Args:
+            docstore (CompactDocstore): Хранилище чанков до вычисления эмбеддингов
+            bytes_per_vector (int): Размер вектора в индексе в байтах (для отчета об экономии)
+
+        Returns:
+            Tuple[CompactDocstore, Dict]: Хранилище без дубликатов и отчет:
+                количество точных и почти точных дубликатов, сэкономленные эмбеддинги,
+                байты индекса и хранилища
+        """
+        n = len(docstore)
+        canonical, counts = self.find_duplicates((docstore.get_text(i) for i in range(n)), n)
+        kept = np.flatnonzero(canonical == np.arange(n))
+        removed = n - len(kept)
+        if removed == 0:
+            report = {'total_chunks': n, 'kept_chunks': n, **counts,
+                      'embeddings_saved': 0, 'index_bytes_saved': 0, 'docstore_bytes_saved': 0}
+            logger.info("Дубликаты чанков не найдены (%s чанков)", n)
+            return docstore, report
+
+        # Источники удаленных дубликатов для каждого оставленного чанка
+        alternates: Dict[int, List[Dict]] = {}
+        for i in np.flatnonzero(canonical != np.arange(n)):
+            owner = int(canonical[i])
+            metadata = docstore.get_metadata(int(i))
+            alternate = {key: metadata[key] for key in ('source', 'page') if key in metadata}
+            own = docstore.get_metadata(owner)
+            if alternate and (alternate.get('source'), alternate.get('page')) != (own.get('source'), own.get('page')):
+                entries = alternates.setdefault(owner, [])
+                if alternate not in entries:
+                    entries.append(alternate)
+
+        def items():
+            for i in kept:
+                i = int(i)
+                metadata = docstore.get_metadata(i)
+                metadata.pop('token_count', None)
+                if i in alternates:
+                    metadata['alternate_sources'] = alternates[i]
+                yield docstore.get_text(i), metadata
+
+        token_counts = None if docstore.token_counts is None else np.asarray(docstore.token_counts)[kept]
+        deduplicated = CompactDocstore.from_texts(items(), token_counts=token_counts)
+        report = {
+            'total_chunks': n,
+            'kept_chunks': len(kept),
+            **counts,
+            'embeddings_saved': removed,
+            'index_bytes_saved': removed * bytes_per_vector,
+            'docstore_bytes_saved': docstore.nbytes - deduplicated.nbytes,
+        }
+        logger.info("Удалено дубликатов чанков: %s из %s (точных %s, "
+                    "почти точных %s), сэкономлено эмбеддингов: %s, "
+                    "памяти индекса: %s байт, "
+                    "хранилища: %s байт",
+                    removed, n, counts['exact_duplicates'], counts['near_duplicates'], removed, report['index_bytes_saved'], report['docstore_bytes_saved'])
+        return deduplicated, report
@@ -0,0 +1,315 @@
+from typing import Dict, List, Optional
+import json
+import os
+
+import faiss
+import numpy as np
+
+from utils.mylogger import Logger
+from src.date.compact_docstore import CompactDocstore
+
+# Инициализация логгера для отслеживания работы индекса метаданных
+logger = Logger('MetadataIndex', 'logs/rag.log')
+
+
+class MetadataIndex:
+    """
+    Индекс метаданных чанков для фильтрации внутри поиска FAISS.
+
+    Строится один раз при индексации по колонкам CompactDocstore и хранит:
+    - для каждого источника список номеров его чанков (CSR: order + ptr)
+    - диапазон страниц каждого источника
+    - тип файла (расширение) каждого источника
+
+    По фильтру строится битовая карта номеров чанков, которая передается
+    в поиск FAISS как IDSelectorBitmap, поэтому отбор происходит во время
+    сканирования индекса, а не после получения результатов.
+
+    Поддерживаемые фильтры (словарь, все условия объединяются через И):
+    - sources: список путей к файлам
+    - directories: список директорий (включая вложенные)
+    - file_types: список расширений, например ['.pdf', '.docx']
+    - pages: диапазон страниц (min, max) включительно, None для открытой границы
+
+    Чанк, оставленный вместо дубликатов из других файлов (alternate_sources,
+    см. ChunkDeduplicator), находится и по фильтрам этих файлов: для каждого
+    источника дополнительно хранится список таких чанков со страницей копии.
+    """
+    ORDER_FILE = 'source_order.npy'
+    PTR_FILE = 'source_ptr.npy'
+    ALTERNATE_ORDER_FILE = 'alternate_order.npy'
+    ALTERNATE_PTR_FILE = 'alternate_ptr.npy'
+    ALTERNATE_PAGES_FILE = 'alternate_pages.npy'
+    META_FILE = 'metadata_index.json'
+
+    def __init__(self,
+                 docstore: CompactDocstore,
+                 source_order: np.ndarray,
+                 source_ptr: np.ndarray,
+                 page_ranges: List[List[int]],
+                 file_types: List[str],
+                 sources: Optional[List[str]] = None,
+                 alternate_order: Optional[np.ndarray] = None,
+                 alternate_ptr: Optional[np.ndarray] = None,
+                 alternate_pages: Optional[np.ndarray] = None) -> None:
+        """
+        Инициализация индекса метаданных из готовых структур.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+            source_order (np.ndarray): Номера чанков, упорядоченные по источнику
+            source_ptr (np.ndarray): Границы источников в source_order (длина sources + 1)
+            page_ranges (List[List[int]]): Минимальная и максимальная страница каждого источника
+            file_types (List[str]): Расширение файла каждого источника
+            sources (Optional[List[str]]): Пути источников: таблица docstore.sources и за ней
+                файлы, все чанки которых удалены как дубликаты (по умолчанию docstore.sources)
+            alternate_order (Optional[np.ndarray]): Номера чанков, оставленных вместо
+                дубликатов из источника, упорядоченные по источнику
+            alternate_ptr (Optional[np.ndarray]): Границы источников в alternate_order
+            alternate_pages (Optional[np.ndarray]): Страница дубликата для каждой позиции alternate_order
+        """
+        self.docstore = docstore
+        self.source_order = source_order
+        self.source_ptr = source_ptr
+        self.page_ranges = page_ranges
+        self.file_types = file_types
+        self.sources = list(docstore.sources) if sources is None else sources
+        self.alternate_order = alternate_order
+        self.alternate_ptr = alternate_ptr
+        self.alternate_pages = alternate_pages
+        self.ntotal = len(docstore)
+
+    @classmethod
+    def from_docstore(cls, docstore: CompactDocstore) -> "MetadataIndex":
+        """
+        Строит индекс метаданных по колонкам хранилища.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+
+        Returns:
+            MetadataIndex: Построенный индекс
+        """
+        source_ids = np.asarray(docstore.source_ids)
+        pages = np.asarray(docstore.pages)
+        sources = list(docstore.sources)
+        alternate_sources, alternate_chunks, alternate_pages = cls._collect_alternates(docstore, sources)
+        n_sources = len(sources)
+
+        with_source = np.flatnonzero(source_ids >= 0)
+        order, ptr = cls._group_by_source(source_ids[with_source], with_source, n_sources)
+        alternate_order, alternate_ptr = cls._group_by_source(alternate_sources, alternate_chunks, n_sources)
+        alternate_pages = alternate_pages[np.argsort(alternate_sources, kind='stable')]
+
+        page_ranges = []
+        for source_id in range(n_sources):
+            source_pages = np.concatenate((pages[order[ptr[source_id]:ptr[source_id + 1]]],
+                                           alternate_pages[alternate_ptr[source_id]:alternate_ptr[source_id + 1]]))
+            source_pages = source_pages[source_pages >= 0]
+            if source_pages.size:
+                page_ranges.append([int(source_pages.min()), int(source_pages.max())])
+            else:
+                page_ranges.append([-1, -1])
+        file_types = [os.path.splitext(source)[1].lower() for source in sources]
+
+        index = cls(docstore, order, ptr, page_ranges, file_types,
+                    sources, alternate_order, alternate_ptr, alternate_pages)
+        logger.info("Индекс метаданных построен: %s источников, %s чанков, "
+                    "%s ссылок на дубликаты", n_sources, index.ntotal, len(alternate_order))
+        return index
+
+    @staticmethod
+    def _group_by_source(source_ids: np.ndarray, chunks: np.ndarray, n_sources: int):
+        """
+        Группирует номера чанков по источникам (CSR: order + ptr).
+        """
+        order = np.asarray(chunks, dtype=np.int64)[np.argsort(source_ids, kind='stable')]
+        counts = np.bincount(source_ids, minlength=n_sources)
+        ptr = np.zeros(n_sources + 1, dtype=np.int64)
+        np.cumsum(counts, out=ptr[1:])
+        return order, ptr
+
+    @staticmethod
+    def _collect_alternates(docstore: CompactDocstore, sources: List[str]):
+        """
+        Собирает источники удаленных дубликатов (alternate_sources) оставленных чанков.
+
+        Файлы, которых нет в таблице docstore.sources (все их чанки оказались
+        дубликатами), добавляются в конец sources.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Номер источника, номер чанка
+                и страница для каждой ссылки на дубликат
+        """
+        # Разбираются только наборы метаданных, в которых есть ссылки на дубликаты
+        extra_alternates = {}
+        for extra_id, extra in enumerate(docstore.extras):
+            if '"alternate_sources"' in extra:
+                extra_alternates[extra_id] = json.loads(extra).get('alternate_sources') or []
+        alternate_sources, alternate_chunks, alternate_pages = [], [], []
+        if extra_alternates:
+            source_table = {source: source_id for source_id, source in enumerate(sources)}
+            extra_ids = np.asarray(docstore.extra_ids)
+            chunks = np.flatnonzero(np.isin(extra_ids, np.fromiter(extra_alternates, dtype=np.int64)))
+            for chunk in chunks:
+                for alternate in extra_alternates[int(extra_ids[chunk])]:
+                    if not alternate.get('source'):
+                        continue
+                    source = str(alternate['source'])
+                    if source not in source_table:
+                        source_table[source] = len(sources)
+                        sources.append(source)
+                    page = alternate.get('page')
+                    alternate_sources.append(source_table[source])
+                    alternate_chunks.append(int(chunk))
+                    alternate_pages.append(int(page) if isinstance(page, int) else -1)
+        return (np.asarray(alternate_sources, dtype=np.int64),
+                np.asarray(alternate_chunks, dtype=np.int64),
+                np.asarray(alternate_pages, dtype=np.int32))
+
+    def _match_sources(self, filters: Dict) -> Optional[np.ndarray]:
+        """
+        Возвращает номера источников, подходящих под фильтры по пути и типу файла.
+        """
+        if not any(filters.get(key) for key in ('sources', 'directories', 'file_types')):
+            return None
+        sources = [os.path.normpath(source) for source in self.sources]
+        selected = np.ones(len(sources), dtype=bool)
+
+        if filters.get('sources'):
+            wanted = {os.path.normpath(path) for path in filters['sources']}
+            selected &= np.array([source in wanted for source in sources], dtype=bool)
+        if filters.get('directories'):
+            prefixes = tuple(os.path.join(os.path.normpath(path), '') for path in filters['directories'])
+            selected &= np.array([source.startswith(prefixes) for source in sources], dtype=bool)
+        if filters.get('file_types'):
+            wanted_types = {ext.lower() if ext.startswith('.') else f".{ext.lower()}" for ext in filters['file_types']}
+            selected &= np.array([file_type in wanted_types for file_type in self.file_types], dtype=bool)
+
+        pages = filters.get('pages')
+        if pages:
+            low, high = pages
+            for source_id in np.flatnonzero(selected):
+                first, last = self.page_ranges[source_id]
+                # Отбрасываем источники, диапазон страниц которых не пересекается с фильтром
+                if (low is not None and last < low) or (high is not None and first > high):
+                    selected[source_id] = False
+        return np.flatnonzero(selected)
+
+    def select(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        Строит маску чанков, удовлетворяющих фильтрам.
+
+        Args:
+            filters (Optional[Dict]): Фильтры по метаданным
+
+        Returns:
+            Optional[np.ndarray]: Булева маска длины ntotal или None, если фильтров нет
+        """
+        if not filters:
+            return None
+        mask = None
+
+        source_ids = self._match_sources(filters)
+        if source_ids is not None:
+            mask = np.zeros(self.ntotal, dtype=bool)
+            for source_id in source_ids:
+                mask[self.source_order[self.source_ptr[source_id]:self.source_ptr[source_id + 1]]] = True
+
+        pages = filters.get('pages')
+        if pages:
+            page_mask = self._page_mask(np.asarray(self.docstore.pages), pages)
+            mask = page_mask if mask is None else mask & page_mask
+
+        if source_ids is not None and self.alternate_order is not None:
+            # Чанки, оставленные вместо дубликатов из выбранных файлов; страница
+            # проверяется по странице дубликата, а не оставленного чанка
+            for source_id in source_ids:
+                start, stop = int(self.alternate_ptr[source_id]), int(self.alternate_ptr[source_id + 1])
+                if start == stop:
+                    continue
+                chunks = np.asarray(self.alternate_order[start:stop])
+                if pages:
+                    chunks = chunks[self._page_mask(np.asarray(self.alternate_pages[start:stop]), pages)]
+                mask[chunks] = True
+
+        return mask
+
+    @staticmethod
+    def _page_mask(chunk_pages: np.ndarray, pages) -> np.ndarray:
+        low, high = pages
+        page_mask = chunk_pages >= 0
+        if low is not None:
+            page_mask &= chunk_pages >= low
+        if high is not None:
+            page_mask &= chunk_pages <= high
+        return page_mask
+
+    @staticmethod
+    def to_selector(mask: np.ndarray):
+        """
+        Преобразует маску чанков в селектор FAISS.
+
+        Args:
+            mask (np.ndarray): Булева маска чанков
+
+        Returns:
+            Tuple: Селектор IDSelectorBitmap и битовая карта, которую нужно
+                держать в памяти, пока селектор используется
+        """
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        return selector, bitmap
+
+    def save(self, path: str) -> None:
+        """
+        Сохраняет индекс метаданных в директорию.
+
+        Args:
+            path (str): Путь к директории для сохранения
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self.ORDER_FILE), self.source_order)
+        np.save(os.path.join(path, self.PTR_FILE), self.source_ptr)
+        if self.alternate_order is not None:
+            np.save(os.path.join(path, self.ALTERNATE_ORDER_FILE), self.alternate_order)
+            np.save(os.path.join(path, self.ALTERNATE_PTR_FILE), self.alternate_ptr)
+            np.save(os.path.join(path, self.ALTERNATE_PAGES_FILE), self.alternate_pages)
+        with open(os.path.join(path, self.META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'page_ranges': self.page_ranges,
+                'file_types': self.file_types,
+                # Файлы, которых нет в таблице источников хранилища
+                'extra_sources': self.sources[len(self.docstore.sources):],
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, docstore: CompactDocstore, mmap: bool = True) -> "MetadataIndex":
+        """
+        Загружает индекс метаданных из директории.
+
+        Args:
+            path (str): Путь к директории с сохраненным индексом
+            docstore (CompactDocstore): Колоночное хранилище, для которого построен индекс
+            mmap (bool): Отображать массивы в память вместо чтения целиком
+
+        Returns:
+            MetadataIndex: Загруженный индекс
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, cls.META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        alternates = [None, None, None]
+        # Индексы, сохраненные до учета дубликатов, файлов ссылок не содержат
+        if os.path.exists(os.path.join(path, cls.ALTERNATE_ORDER_FILE)):
+            alternates = [np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+                          for name in (cls.ALTERNATE_ORDER_FILE, cls.ALTERNATE_PTR_FILE, cls.ALTERNATE_PAGES_FILE)]
+        return cls(
+            docstore,
+            np.load(os.path.join(path, cls.ORDER_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, cls.PTR_FILE), mmap_mode=mmap_mode),
+            meta['page_ranges'],
+            meta['file_types'],
+            list(docstore.sources) + meta.get('extra_sources', []),
+            *alternates
+        )
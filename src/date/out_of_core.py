@@ -0,0 +1,312 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+import hashlib
+import json
+import os
+import struct
+
+import faiss
+import numpy as np
+
+from utils.mylogger import Logger
+from src.date.compact_docstore import CompactDocstore
+from src.date.quantized_index import RescoringIndex, binarize, code_size, load_flat_index
+
+# Инициализация логгера для отслеживания внекорневой сборки индекса
+logger = Logger('OutOfCoreBuilder', 'logs/rag.log')
+
+# Смещение поля ntotal в заголовке файла IndexFlatL2 (после fourcc и d)
+FLAT_NTOTAL_OFFSET = 8
+
+
+def docstore_fingerprint(docstore: CompactDocstore, model_id: str = '') -> str:
+    """
+    Отпечаток набора чанков и модели: по нему определяется, можно ли продолжить сборку.
+
+    Args:
+        docstore (CompactDocstore): Колоночное хранилище чанков
+        model_id (str): Идентификатор модели эмбеддингов
+
+    Returns:
+        str: SHA-256 текстов, смещений чанков и идентификатора модели
+    """
+    digest = hashlib.sha256(model_id.encode('utf-8'))
+    digest.update(np.ascontiguousarray(docstore.offsets, dtype=np.int64).tobytes())
+    blob = docstore.blob
+    block = 64 * 1024 * 1024
+    for start in range(0, len(blob), block):
+        digest.update(np.ascontiguousarray(blob[start:start + block]).tobytes())
+    return digest.hexdigest()
+
+
+def iter_blocks(vectors: np.ndarray, block_size: int):
+    """
+    Последовательно читает матрицу (например, memmap) блоками строк float32.
+    """
+    for start in range(0, len(vectors), block_size):
+        yield np.ascontiguousarray(vectors[start:start + block_size], dtype=np.float32)
+
+
+def write_flat_index(blocks: Iterable[np.ndarray], n: int, dim: int, path: str) -> None:
+    """
+    Записывает файл IndexFlatL2 из блоков векторов, не собирая их в памяти.
+
+    Заголовок берется из сериализации пустого индекса той же размерности,
+    в нем заменяется количество векторов; за ним следуют длина и данные векторов.
+
+    Args:
+        blocks (Iterable[np.ndarray]): Блоки векторов (float32) в порядке номеров
+        n (int): Общее количество векторов
+        dim (int): Размерность векторов
+        path (str): Путь к файлу индекса
+    """
+    header = bytearray(faiss.serialize_index(faiss.IndexFlatL2(dim)).tobytes())
+    # Последние 8 байт пустого индекса - длина массива кодов (в float32)
+    header = header[:-8]
+    struct.pack_into('<q', header, FLAT_NTOTAL_OFFSET, n)
+    written = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(struct.pack('<Q', n * dim))
+        for block in blocks:
+            f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+            written += len(block)
+    if written != n:
+        os.remove(tmp_path)
+        raise ValueError(f"Записано {written} векторов вместо {n}")
+    os.replace(tmp_path, path)
+
+
+def build_coarse_index(vectors: np.ndarray, precision: str, add_batch_size: int = 65536, train_size: int = 100000):
+    """
+    Строит индекс компактных кодов (float16, int8 или binary) из матрицы частями.
+
+    Скалярный квантователь обучается на случайной выборке векторов, отсортированной
+    по номеру для последовательного чтения memmap.
+
+    Args:
+        vectors (np.ndarray): Полноточные векторы (float32, n x d), обычно memmap
+        precision (str): Формат компактных кодов
+        add_batch_size (int): Количество векторов, добавляемых за один раз
+        train_size (int): Размер выборки для обучения квантователя
+
+    Returns:
+        Индекс FAISS с компактными кодами
+
+    Raises:
+        ValueError: Если формат не поддерживается или размерность не подходит для бинарных кодов
+    """
+    n, dim = vectors.shape
+    code_size(precision, dim)
+    if precision == 'float32':
+        raise ValueError("Для float32 компактные коды не строятся")
+    if precision == 'binary':
+        if dim % 8:
+            raise ValueError(f"Бинарные коды требуют размерность, кратную 8, получено {dim}")
+        coarse_index = faiss.IndexBinaryFlat(dim)
+        for block in iter_blocks(vectors, add_batch_size):
+            coarse_index.add(binarize(block))
+        return coarse_index
+    qtype = faiss.ScalarQuantizer.QT_fp16 if precision == 'float16' else faiss.ScalarQuantizer.QT_8bit
+    coarse_index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    sample = np.sort(np.random.default_rng(0).choice(n, size=min(max(1, train_size), n), replace=False))
+    coarse_index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    for block in iter_blocks(vectors, add_batch_size):
+        coarse_index.add(block)
+    return coarse_index
+
+
+class OutOfCoreIndexBuilder:
+    """
+    Сборка индекса FAISS для корпусов, эмбеддинги которых не помещаются в память.
+
+    Этапы:
+    1. Эмбеддинги вычисляются пакетами и записываются в файл .npy, отображенный
+       в память (np.memmap); после каждого пакета прогресс фиксируется в progress.json
+    2. Компактные коды (float16, int8) обучаются на случайной выборке векторов
+       и добавляются в индекс частями из memmap
+    3. Для float32 файл IndexFlatL2 записывается напрямую из memmap частями,
+       без копии всех векторов в памяти, и затем отображается в память
+       (load_flat_index, faiss >= 1.10; в более старых версиях читается целиком)
+
+    Прерванная сборка продолжается с последнего завершенного пакета, если
+    совпадают отпечаток чанков и модели (docstore_fingerprint), размерность
+    и размер пакета. Иначе рабочая директория очищается и сборка начинается заново.
+
+    Файл эмбеддингов одновременно служит файлом полноточных векторов
+    для RescoringIndex, поэтому векторы не копируются.
+
+    Attributes:
+        work_dir (str): Рабочая директория сборки
+        precision (str): Формат хранения векторов (float32, float16, int8, binary)
+        rescore_factor (int): Во сколько раз больше кандидатов отбирается для пересчета
+        batch_size (int): Размер пакета при вычислении эмбеддингов
+        add_batch_size (int): Количество векторов, добавляемых в индекс за один раз
+        train_size (int): Размер выборки для обучения скалярного квантователя
+    """
+    EMBEDDINGS_FILE = 'embeddings.npy'
+    PROGRESS_FILE = 'progress.json'
+    FLAT_INDEX_FILE = 'index.faiss'
+
+    def __init__(self,
+                 work_dir: str,
+                 precision: str = 'float32',
+                 rescore_factor: int = 4,
+                 batch_size: int = 1024,
+                 add_batch_size: int = 65536,
+                 train_size: int = 100000) -> None:
+        self.work_dir = work_dir
+        self.precision = precision
+        self.rescore_factor = rescore_factor
+        self.batch_size = max(1, batch_size)
+        self.add_batch_size = max(1, add_batch_size)
+        self.train_size = max(1, train_size)
+        self.embeddings_path = os.path.join(work_dir, self.EMBEDDINGS_FILE)
+        self.progress_path = os.path.join(work_dir, self.PROGRESS_FILE)
+
+    def _read_progress(self) -> Optional[Dict]:
+        if not os.path.exists(self.progress_path):
+            return None
+        try:
+            with open(self.progress_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Файл прогресса сборки поврежден, сборка начнется заново: %s", e)
+            return None
+
+    def _write_progress(self, progress: Dict) -> None:
+        tmp_path = self.progress_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, self.progress_path)
+
+    def _open_embeddings(self, n: int, dim: int, fingerprint: str):
+        """
+        Открывает файл эмбеддингов для продолжения сборки или создает новый.
+
+        Returns:
+            Tuple[np.memmap, Dict]: Отображенная в память матрица (n x dim) и прогресс сборки
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        expected = {'fingerprint': fingerprint, 'n': n, 'dim': dim, 'batch_size': self.batch_size}
+        progress = self._read_progress()
+        if (progress is not None and os.path.exists(self.embeddings_path)
+                and all(progress.get(key) == value for key, value in expected.items())):
+            embeddings = np.lib.format.open_memmap(self.embeddings_path, mode='r+')
+            if embeddings.shape == (n, dim):
+                logger.info("Продолжаем сборку индекса: готово пакетов "
+                            "%s из %s", progress['completed_batches'], -(-n // self.batch_size))
+                return embeddings, progress
+            del embeddings
+        if progress is not None:
+            logger.info("Параметры сборки изменились, начинаем сборку индекса заново")
+        for name in (self.FLAT_INDEX_FILE, RescoringIndex.CODES_FILE):
+            stale = os.path.join(self.work_dir, name)
+            if os.path.exists(stale):
+                os.remove(stale)
+        # Прежний файл эмбеддингов может быть отображен в память индексом, собранным
+        # из него ранее (RescoringIndex): файл удаляется, а не обрезается на месте,
+        # и отображение сохраняет прежние данные
+        if os.path.exists(self.embeddings_path):
+            os.remove(self.embeddings_path)
+        progress = dict(expected, completed_batches=0, index_built=None)
+        embeddings = np.lib.format.open_memmap(self.embeddings_path, mode='w+', dtype=np.float32, shape=(n, dim))
+        self._write_progress(progress)
+        return embeddings, progress
+
+    async def embed_async(self,
+                          docstore: CompactDocstore,
+                          dim: int,
+                          embed_batch: Callable[[List[str]], Awaitable[np.ndarray]],
+                          model_id: str = '') -> Dict:
+        """
+        Вычисляет эмбеддинги всех чанков в файл на диске, пропуская готовые пакеты.
+
+        Порядок пакетов детерминирован: если известны длины чанков в токенах,
+        пакеты составляются из чанков близкой длины (как в VectorStore),
+        поэтому номер завершенного пакета однозначно определяет готовые строки.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+            dim (int): Размерность эмбеддингов
+            embed_batch (Callable): Асинхронная функция, возвращающая матрицу эмбеддингов текстов
+            model_id (str): Идентификатор модели эмбеддингов для отпечатка сборки
+
+        Returns:
+            Dict: Прогресс сборки
+        """
+        n = len(docstore)
+        if n == 0:
+            raise ValueError("Нет чанков для вычисления эмбеддингов")
+        fingerprint = docstore_fingerprint(docstore, model_id)
+        embeddings, progress = self._open_embeddings(n, dim, fingerprint)
+        order = None
+        if docstore.token_counts is not None:
+            order = np.argsort(docstore.token_counts, kind='stable')
+        total_batches = -(-n // self.batch_size)
+        try:
+            for batch_number in range(progress['completed_batches'], total_batches):
+                start = batch_number * self.batch_size
+                stop = min(start + self.batch_size, n)
+                ids = range(start, stop) if order is None else order[start:stop]
+                texts = [docstore.get_text(int(i)) for i in ids]
+                batch = await embed_batch(texts)
+                if batch.shape[1] != dim:
+                    raise ValueError(f"Размерность эмбеддингов {batch.shape[1]} не совпадает с ожидаемой {dim}")
+                if order is None:
+                    embeddings[start:stop] = batch
+                else:
+                    embeddings[order[start:stop]] = batch
+                # Пакет считается завершенным только после записи на диск
+                embeddings.flush()
+                progress['completed_batches'] = batch_number + 1
+                self._write_progress(progress)
+                logger.debug("Пакет эмбеддингов %s из %s записан", batch_number + 1, total_batches)
+        finally:
+            del embeddings
+        return progress
+
+    def build_index(self):
+        """
+        Строит индекс из файла эмбеддингов частями.
+
+        Returns:
+            Индекс FAISS (IndexFlatL2, отображенный в память) или RescoringIndex
+
+        Raises:
+            ValueError: Если эмбеддинги вычислены не полностью
+        """
+        progress = self._read_progress()
+        if progress is None or progress['completed_batches'] * self.batch_size < progress['n']:
+            raise ValueError("Эмбеддинги вычислены не полностью, продолжите сборку индекса")
+        vectors = np.load(self.embeddings_path, mmap_mode='r')
+        n, dim = vectors.shape
+        code_size(self.precision, dim)
+
+        if self.precision == 'float32':
+            index_path = os.path.join(self.work_dir, self.FLAT_INDEX_FILE)
+            if not (progress.get('index_built') == self.precision and os.path.exists(index_path)):
+                write_flat_index(iter_blocks(vectors, self.add_batch_size), n, dim, index_path)
+                progress['index_built'] = self.precision
+                self._write_progress(progress)
+            logger.info("Индекс float32 собран вне памяти: %s векторов", n)
+            return load_flat_index(index_path)
+
+        codes_path = os.path.join(self.work_dir, RescoringIndex.CODES_FILE)
+        if progress.get('index_built') == self.precision and os.path.exists(codes_path):
+            if self.precision == 'binary':
+                coarse_index = faiss.read_index_binary(codes_path)
+            else:
+                coarse_index = faiss.read_index(codes_path)
+        else:
+            coarse_index = build_coarse_index(vectors, self.precision, self.add_batch_size, self.train_size)
+            if self.precision == 'binary':
+                faiss.write_index_binary(coarse_index, codes_path)
+            else:
+                faiss.write_index(coarse_index, codes_path)
+            progress['index_built'] = self.precision
+            self._write_progress(progress)
+        logger.info("Индекс %s собран вне памяти: %s векторов, "
+                    "коды %s байт",
+                    self.precision, coarse_index.ntotal, coarse_index.ntotal * code_size(self.precision, dim))
+        return RescoringIndex(coarse_index, self.embeddings_path, self.precision, self.rescore_factor)
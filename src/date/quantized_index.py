@@ -0,0 +1,397 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import faiss
+import numpy as np
+
+from utils.mylogger import Logger
+
+# Инициализация логгера для отслеживания работы квантованного индекса
+logger = Logger('QuantizedIndex', 'logs/rag.log')
+
+# Поддерживаемые форматы хранения векторов в индексе
+PRECISIONS = ('float32', 'float16', 'int8', 'binary')
+
+# Отображение векторов IndexFlatL2 в память (флаг IO_FLAG_MMAP_IFC появился в faiss 1.10)
+MMAP_FLAT_SUPPORTED = hasattr(faiss, 'IO_FLAG_MMAP_IFC')
+
+
+class RescoringIndex:
+    """
+    Индекс с компактными кодами векторов и точным пересчетом расстояний.
+
+    Поиск выполняется в два этапа:
+    1. Грубый поиск k * rescore_factor кандидатов по компактным кодам
+       (float16, int8 скалярное квантование или бинарные коды)
+    2. Точный пересчет L2-расстояний кандидатов по полноточным векторам float32,
+       которые лениво отображаются в память (memory map) из файла
+
+    Класс повторяет интерфейс индекса FAISS, используемый LangChain
+    (search, ntotal, d), поэтому может передаваться в FAISS из LangChain напрямую.
+
+    Attributes:
+        coarse_index: Индекс FAISS с компактными кодами
+        vectors_path (str): Путь к файлу .npy с полноточными векторами
+        precision (str): Формат компактных кодов
+        rescore_factor (int): Во сколько раз больше кандидатов отбирается для пересчета
+    """
+    META_FILE = 'quantization.json'
+    CODES_FILE = 'codes.faiss'
+    VECTORS_FILE = 'vectors.npy'
+
+    def __init__(self, coarse_index, vectors_path: str, precision: str, rescore_factor: int = 4) -> None:
+        self.coarse_index = coarse_index
+        self.vectors_path = vectors_path
+        self.precision = precision
+        self.rescore_factor = max(1, int(rescore_factor))
+        self._vectors: Optional[np.ndarray] = None
+
+    @property
+    def ntotal(self) -> int:
+        return self.coarse_index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.coarse_index.d
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        Полноточные векторы, отображенные в память при первом обращении.
+        """
+        if self._vectors is None:
+            self._vectors = np.load(self.vectors_path, mmap_mode='r')
+        return self._vectors
+
+    @property
+    def code_nbytes(self) -> int:
+        """
+        Объем памяти, занимаемый компактными кодами, в байтах.
+        """
+        return self.ntotal * code_size(self.precision, self.d)
+
+    def _encode_queries(self, x: np.ndarray) -> np.ndarray:
+        if self.precision == 'binary':
+            return binarize(x)
+        return x
+
+    def search(self, x: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск k ближайших векторов с точным пересчетом расстояний.
+
+        Args:
+            x (np.ndarray): Матрица запросов (float32, nq x d)
+            k (int): Количество результатов на запрос
+            params: Параметры поиска FAISS (например, селектор номеров).
+                Бинарные индексы FAISS селекторы не поддерживают, для них
+                используется search_subset
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Квадраты L2-расстояний и номера векторов
+                (nq x k), недостающие позиции заполнены значениями inf и -1
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        k_fetch = min(k * self.rescore_factor, self.ntotal)
+        if params is None:
+            _, candidates = self.coarse_index.search(self._encode_queries(x), k_fetch)
+        else:
+            _, candidates = self.coarse_index.search(self._encode_queries(x), k_fetch, params=params)
+        return self.rescore(x, candidates, k)
+
+    def search_subset(self, x: np.ndarray, k: int, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Точный поиск k ближайших векторов среди заданного подмножества номеров.
+
+        Args:
+            x (np.ndarray): Матрица запросов (float32, nq x d)
+            k (int): Количество результатов на запрос
+            ids (np.ndarray): Номера векторов, среди которых выполняется поиск
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Квадраты L2-расстояний и номера векторов (nq x k)
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        candidates = np.broadcast_to(np.asarray(ids, dtype=np.int64), (x.shape[0], len(ids)))
+        return self.rescore(x, candidates, k)
+
+    def rescore(self, x: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Точно пересчитывает расстояния до кандидатов и оставляет k лучших.
+
+        Args:
+            x (np.ndarray): Матрица запросов (float32, nq x d)
+            candidates (np.ndarray): Номера кандидатов (nq x m), -1 для пустых позиций
+            k (int): Количество результатов на запрос
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Квадраты L2-расстояний и номера векторов (nq x k)
+        """
+        nq = x.shape[0]
+        distances = np.full((nq, k), np.inf, dtype=np.float32)
+        labels = np.full((nq, k), -1, dtype=np.int64)
+        vectors = self.vectors
+        for row in range(nq):
+            ids = candidates[row][candidates[row] >= 0]
+            if ids.size == 0:
+                continue
+            # Обращение к memmap по отсортированным номерам читает только нужные страницы
+            ids = np.sort(ids)
+            diff = np.asarray(vectors[ids], dtype=np.float32) - x[row]
+            exact = np.einsum('ij,ij->i', diff, diff)
+            top = np.argsort(exact, kind='stable')[:k]
+            distances[row, :top.size] = exact[top]
+            labels[row, :top.size] = ids[top]
+        return distances, labels
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        """
+        Возвращает полноточный вектор по его номеру.
+        """
+        return np.asarray(self.vectors[int(i)], dtype=np.float32)
+
+    def save(self, path: str) -> None:
+        """
+        Сохраняет компактные коды, полноточные векторы и параметры в директорию.
+
+        Args:
+            path (str): Путь к директории для сохранения
+        """
+        os.makedirs(path, exist_ok=True)
+        codes_path = os.path.join(path, self.CODES_FILE)
+        if self.precision == 'binary':
+            faiss.write_index_binary(self.coarse_index, codes_path)
+        else:
+            faiss.write_index(self.coarse_index, codes_path)
+        vectors_path = os.path.join(path, self.VECTORS_FILE)
+        if os.path.abspath(vectors_path) != os.path.abspath(self.vectors_path):
+            replace_file(vectors_path, lambda tmp_path: shutil.copyfile(self.vectors_path, tmp_path))
+        with open(os.path.join(path, self.META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'precision': self.precision, 'rescore_factor': self.rescore_factor}, f)
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(os.path.join(path, cls.META_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> "RescoringIndex":
+        """
+        Загружает индекс из директории. Полноточные векторы отображаются в память лениво.
+
+        Args:
+            path (str): Путь к директории с сохраненным индексом
+
+        Returns:
+            RescoringIndex: Загруженный индекс
+        """
+        with open(os.path.join(path, cls.META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        codes_path = os.path.join(path, cls.CODES_FILE)
+        if meta['precision'] == 'binary':
+            coarse_index = faiss.read_index_binary(codes_path)
+        else:
+            coarse_index = faiss.read_index(codes_path)
+        return cls(coarse_index, os.path.join(path, cls.VECTORS_FILE),
+                   meta['precision'], meta['rescore_factor'])
+
+
+def replace_file(path: str, write: Callable[[str], None]) -> None:
+    """
+    Записывает файл рядом с path во временный файл и подменяет им path.
+
+    Прежний файл может быть отображен в память загруженным индексом: запись
+    на месте обрезала бы его, и чтение отображения вернуло бы чужие векторы
+    или завершилось SIGBUS. После os.replace отображение продолжает ссылаться
+    на прежние данные, пока индекс не закроет его.
+
+    Args:
+        path (str): Путь к итоговому файлу
+        write (Callable[[str], None]): Функция, записывающая файл по переданному пути
+    """
+    stem, ext = os.path.splitext(path)
+    # Расширение сохраняется: np.save дописывает .npy к путям без него
+    tmp_path = f"{stem}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_flat_index(path: str, mmap: bool = True):
+    """
+    Читает индекс FAISS float32 из файла, при mmap векторы отображаются в память.
+
+    Флаг IO_FLAG_MMAP отображает только инвертированные списки индексов IVF:
+    IndexFlatL2 с ним все равно копируется в память целиком. Векторы плоского
+    индекса отображает флаг IO_FLAG_MMAP_IFC (faiss >= 1.10), и процессы,
+    открывшие один файл, делят его страницы через страничный кэш. В более
+    старых версиях faiss индекс читается в память.
+
+    Отображенный индекс только для чтения: добавление в него векторов
+    завершает процесс.
+
+    Args:
+        path (str): Путь к файлу индекса
+        mmap (bool): Отображать векторы в память вместо чтения целиком
+
+    Returns:
+        Индекс FAISS
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    if not MMAP_FLAT_SUPPORTED:
+        logger.info("faiss %s не отображает IndexFlatL2 в память (нужна версия 1.10+), "
+                    "индекс %s читается целиком", faiss.__version__, path)
+        return faiss.read_index(path)
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+
+
+def binarize(x: np.ndarray) -> np.ndarray:
+    """
+    Преобразует векторы в бинарные коды по знаку компонент (d / 8 байт на вектор).
+    """
+    return np.packbits(np.asarray(x) > 0, axis=1)
+
+
+def code_size(precision: str, dim: int) -> int:
+    """
+    Размер кода одного вектора в байтах для заданного формата хранения.
+    """
+    sizes = {'float32': dim * 4, 'float16': dim * 2, 'int8': dim, 'binary': (dim + 7) // 8}
+    if precision not in sizes:
+        raise ValueError(f"Неподдерживаемый формат хранения векторов: {precision}. "
+                         f"Допустимые значения: {', '.join(PRECISIONS)}")
+    return sizes[precision]
+
+
+def build_index(embeddings: np.ndarray,
+                precision: str = 'float32',
+                vectors_dir: Optional[str] = None,
+                rescore_factor: int = 4):
+    """
+    Создает индекс для векторов в заданном формате хранения.
+
+    Для float32 создается обычный IndexFlatL2. Для остальных форматов
+    полноточные векторы сохраняются в vectors_dir, а в памяти остаются
+    только компактные коды (RescoringIndex).
+
+    Args:
+        embeddings (np.ndarray): Нормализованные эмбеддинги (float32, n x d)
+        precision (str): Формат хранения: float32, float16, int8 или binary
+        vectors_dir (Optional[str]): Директория для файла полноточных векторов
+        rescore_factor (int): Во сколько раз больше кандидатов отбирается для пересчета
+
+    Returns:
+        Индекс FAISS или RescoringIndex
+
+    Raises:
+        ValueError: Если формат не поддерживается или не указана директория для векторов
+    """
+    code_size(precision, embeddings.shape[1])
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    dim = embeddings.shape[1]
+
+    if precision == 'float32':
+        index = faiss.IndexFlatL2(dim)
+        index.add(embeddings)
+        return index
+
+    if not vectors_dir:
+        raise ValueError("Для сжатого хранения векторов требуется директория для полноточных векторов")
+
+    if precision == 'binary':
+        if dim % 8:
+            raise ValueError(f"Бинарные коды требуют размерность, кратную 8, получено {dim}")
+        coarse_index = faiss.IndexBinaryFlat(dim)
+        coarse_index.add(binarize(embeddings))
+    else:
+        qtype = faiss.ScalarQuantizer.QT_fp16 if precision == 'float16' else faiss.ScalarQuantizer.QT_8bit
+        coarse_index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+        coarse_index.train(embeddings)
+        coarse_index.add(embeddings)
+
+    os.makedirs(vectors_dir, exist_ok=True)
+    vectors_path = os.path.join(vectors_dir, RescoringIndex.VECTORS_FILE)
+    replace_file(vectors_path, lambda tmp_path: np.save(tmp_path, embeddings))
+    logger.info("Создан индекс %s: %s векторов, "
+                "коды %s байт "
+                "вместо %s байт float32",
+                precision, coarse_index.ntotal, coarse_index.ntotal * code_size(precision, dim), embeddings.nbytes)
+    return RescoringIndex(coarse_index, vectors_path, precision, rescore_factor)
+
+
+def quantization_report(embeddings: np.ndarray,
+                        queries: Optional[np.ndarray] = None,
+                        k: int = 10,
+                        precisions: Sequence[str] = ('float16', 'int8', 'binary'),
+                        rescore_factor: int = 4,
+                        sample_size: int = 1000,
+                        seed: int = 0) -> List[Dict]:
+    """
+    Сравнивает форматы хранения векторов с точным поиском по float32.
+
+    Для каждого формата считается объем памяти под коды, экономия относительно
+    float32 и recall@k относительно плоского индекса float32 как без пересчета,
+    так и с точным пересчетом кандидатов.
+
+    Args:
+        embeddings (np.ndarray): Нормализованные эмбеддинги (float32, n x d)
+        queries (Optional[np.ndarray]): Эмбеддинги запросов. Если не заданы,
+            в качестве запросов берется случайная выборка из embeddings
+        k (int): Глубина поиска для recall@k
+        precisions (Sequence[str]): Сравниваемые форматы
+        rescore_factor (int): Во сколько раз больше кандидатов отбирается для пересчета
+        sample_size (int): Размер выборки запросов, если queries не заданы
+        seed (int): Зерно генератора для выборки запросов
+
+    Returns:
+        List[Dict]: Строки отчета для каждого формата
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, dim = embeddings.shape
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        queries = embeddings[rng.choice(n, size=min(sample_size, n), replace=False)]
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, n)
+
+    baseline = faiss.IndexFlatL2(dim)
+    baseline.add(embeddings)
+    _, truth = baseline.search(queries, k)
+    baseline_bytes = n * code_size('float32', dim)
+
+    def recall(labels: np.ndarray) -> float:
+        hits = sum(len(np.intersect1d(labels[i, :k], truth[i])) for i in range(len(truth)))
+        return hits / float(truth.size)
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for precision in precisions:
+            index = build_index(embeddings, precision, os.path.join(tmp_dir, precision), rescore_factor)
+            _, coarse_labels = index.coarse_index.search(index._encode_queries(queries), k)
+            _, rescored_labels = index.search(queries, k)
+            code_bytes = index.code_nbytes
+            report.append({
+                'precision': precision,
+                'code_bytes': code_bytes,
+                'memory_saved_bytes': baseline_bytes - code_bytes,
+                'memory_saved_ratio': 1.0 - code_bytes / float(baseline_bytes),
+                f'recall@{k}_coarse': recall(coarse_labels),
+                f'recall@{k}_rescored': recall(rescored_labels),
+                f'recall@{k}_change': recall(rescored_labels) - 1.0,
+            })
+            # Закрываем memmap до удаления временной директории
+            index._vectors = None
+
+    for row in report:
+        logger.info("Квантование %s: коды %s байт, экономия %.1f%%, "
+                    "recall@%s без пересчета %.4f, с пересчетом %.4f",
+                    row['precision'], row['code_bytes'], row['memory_saved_ratio'] * 100,
+                    k, row[f'recall@{k}_coarse'], row[f'recall@{k}_rescored'])
+    return report
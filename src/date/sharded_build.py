@@ -0,0 +1,281 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Sequence
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+
+from utils.mylogger import Logger
+from src.date.bm25_index import BM25Index
+from src.date.compact_docstore import CompactDocstore
+from src.date.metadata_index import MetadataIndex
+from src.date.out_of_core import build_coarse_index, iter_blocks, write_flat_index
+from src.date.quantized_index import RescoringIndex, load_flat_index
+from config import RAG_CONFIG
+
+# Инициализация логгера для отслеживания параллельной сборки шардов
+logger = Logger('ShardedIndexBuilder', 'logs/rag.log')
+
+MANIFEST_FILE = 'shards.json'
+# Имена файлов сохраненного хранилища (совпадают с VectorStore)
+INDEX_FILE = 'index.faiss'
+DOCSTORE_DIR = 'docstore'
+METADATA_DIR = 'metadata'
+LEXICAL_DIR = 'bm25'
+
+
+def assign_shards(files: Sequence, num_shards: int) -> List[List[str]]:
+    """
+    Распределяет файлы по шардам с выравниванием суммарного размера.
+
+    Файлы перебираются от больших к меньшим и добавляются в самый легкий шард;
+    внутри шарда сохраняется порядок путей, поэтому распределение детерминировано.
+
+    Args:
+        files (Sequence): Найденные файлы (DiscoveredFile)
+        num_shards (int): Количество шардов
+
+    Returns:
+        List[List[str]]: Пути файлов каждого шарда (пустые шарды отбрасываются)
+    """
+    num_shards = max(1, min(num_shards, len(files)))
+    heap = [(0, shard) for shard in range(num_shards)]
+    shards: List[List[str]] = [[] for _ in range(num_shards)]
+    for file in sorted(files, key=lambda file: (-file.size, file.path)):
+        size, shard = heapq.heappop(heap)
+        shards[shard].append(file.path)
+        heapq.heappush(heap, (size + file.size, shard))
+    return [sorted(paths) for paths in shards if paths]
+
+
+def _build_shard(shard_id: int, paths: List[str], shard_dir: str, model_name: str, threads: int) -> Dict:
+    """
+    Строит индекс и хранилище одного шарда в рабочем процессе.
+
+    Процесс загружает свою копию модели эмбеддингов и использует тот же путь
+    создания хранилища, что и однопроцессная сборка (VectorStore).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from src.date.vector_store import VectorStore
+    from src.handle_dir_and_files.load_documents import LoadDocuments
+    from src.handle_dir_and_files.process_documents import ProcessDocuments
+
+    started = time.perf_counter()
+    # Потоки ядер делятся между рабочими процессами
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+    # Файлы сборки шарда не должны пересекаться с другими шардами
+    work_dir = os.path.join(RAG_CONFIG['out_of_core']['dir'], f'shard_{shard_id:03d}')
+
+    llm = SimpleNamespace(sentence_transformer=SentenceTransformer(model_name, device='cpu'))
+    manager = VectorStore(llm)
+    if RAG_CONFIG['streaming_ingest'] and RAG_CONFIG['splitter'] != 'recursive':
+        pages = ProcessDocuments().iter_processed(LoadDocuments(paths).iter_documents())
+        manager.create_vector_store_from_stream(pages, shard_dir, work_dir)
+    else:
+        documents = LoadDocuments(paths).load_documents()
+        manager.create_vector_store(ProcessDocuments(documents).process_documents(), shard_dir, work_dir)
+    manager.save_vector_store(shard_dir)
+    return {
+        'shard': shard_id,
+        'path': os.path.basename(shard_dir),
+        'files': len(paths),
+        'chunks': int(llm.vectorstore.index.ntotal),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+class ShardedIndexBuilder:
+    """
+    Параллельная сборка индекса по шардам в рабочих процессах.
+
+    Файлы корпуса делятся на шарды с близким суммарным размером; каждый шард
+    (загрузка, разбиение, эмбеддинги, индекс FAISS и колоночное хранилище)
+    строится в отдельном процессе, поэтому обучение и добавление векторов FAISS
+    занимают все ядра. Результат - директория шардов с манифестом shards.json,
+    в котором для каждого шарда указано смещение его номеров чанков:
+    глобальный номер = offset + номер в шарде.
+
+    Шарды можно объединить в один индекс (merge) с теми же глобальными номерами
+    или оставить раздельными для шардированного поиска.
+
+    Дубликаты чанков удаляются внутри каждого шарда; BM25 при объединении
+    строится заново, так как IDF зависит от всего корпуса.
+
+    Attributes:
+        output_dir (str): Директория шардов
+        num_shards (int): Количество шардов
+        max_workers (int): Количество рабочих процессов
+        model_name (str): Модель эмбеддингов, загружаемая в каждом процессе
+    """
+    def __init__(self,
+                 output_dir: str,
+                 num_shards: int,
+                 max_workers: Optional[int] = None,
+                 model_name: Optional[str] = None) -> None:
+        self.output_dir = output_dir
+        self.num_shards = max(1, num_shards)
+        self.max_workers = max(1, min(max_workers or self.num_shards, self.num_shards))
+        self.model_name = model_name or RAG_CONFIG['embedding_model']
+
+    def build(self, roots: List[str]) -> Dict:
+        """
+        Находит файлы во всех корнях и строит шарды параллельно.
+
+        Args:
+            roots (List[str]): Директории, пути к файлам или glob-паттерны
+
+        Returns:
+            Dict: Манифест шардов (сохраняется в output_dir/shards.json)
+
+        Raises:
+            FileNotFoundError: Если не найдено ни одного поддерживаемого файла
+        """
+        from src.handle_dir_and_files.load_documents import LoadDocuments
+
+        started = time.perf_counter()
+        loader = LoadDocuments(roots)
+        paths, _ = loader._select_files(loader.discovery.discover(roots))
+        selected = set(paths)
+        files = [file for file in loader.discovered_files if file.path in selected]
+        shards = assign_shards(files, self.num_shards)
+        os.makedirs(self.output_dir, exist_ok=True)
+        threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+        logger.info("Сборка %s шардов из %s файлов в %s процессах "
+                    "по %s потоков", len(shards), len(files), self.max_workers, threads)
+
+        results = []
+        # spawn: рабочие процессы не наследуют потоки и состояние torch родительского процесса
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context) as executor:
+            futures = {
+                executor.submit(_build_shard, shard_id, shard_paths,
+                                os.path.join(self.output_dir, f'shard_{shard_id:03d}'),
+                                self.model_name, threads): shard_id
+                for shard_id, shard_paths in enumerate(shards)
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                logger.info("Шард %s собран за %s с: "
+                            "%s файлов, %s чанков",
+                            result['shard'], result['seconds'], result['files'], result['chunks'])
+                results.append(result)
+
+        results.sort(key=lambda result: result['shard'])
+        offset = 0
+        for result in results:
+            result['offset'] = offset
+            offset += result['chunks']
+        manifest = {
+            'shards': results,
+            'total_chunks': offset,
+            'precision': RAG_CONFIG['vector_storage']['precision'],
+        }
+        with open(os.path.join(self.output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        logger.info("Шарды собраны за %.2f с: %s чанков", time.perf_counter() - started, offset)
+        return manifest
+
+
+def load_manifest(shards_dir: str) -> Dict:
+    """
+    Читает манифест шардов.
+
+    Raises:
+        FileNotFoundError: Если манифест не найден
+    """
+    path = os.path.join(shards_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Манифест шардов не найден: {path}")
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _iter_shard_vectors(shard_dir: str, block_size: int):
+    """
+    Читает полноточные векторы шарда блоками, не загружая их целиком.
+    """
+    if RescoringIndex.exists(shard_dir):
+        yield from iter_blocks(np.load(os.path.join(shard_dir, RescoringIndex.VECTORS_FILE), mmap_mode='r'),
+                               block_size)
+        return
+    index = load_flat_index(os.path.join(shard_dir, INDEX_FILE))
+    for start in range(0, index.ntotal, block_size):
+        yield index.reconstruct_n(start, min(block_size, index.ntotal - start))
+
+
+def merge_shards(shards_dir: str, target_dir: str, add_batch_size: int = 65536, train_size: int = 100000) -> Dict:
+    """
+    Объединяет шарды в одно хранилище в формате VectorStore.save_vector_store.
+
+    Чанки и векторы следуют в порядке шардов, поэтому номер чанка совпадает с
+    глобальным номером из манифеста. Векторы копируются блоками: для float32
+    файл индекса записывается напрямую, для сжатых форматов компактные коды
+    обучаются и строятся заново по всем векторам (квантователи шардов обучены
+    на разных данных, их коды несовместимы).
+
+    Args:
+        shards_dir (str): Директория шардов с манифестом
+        target_dir (str): Директория объединенного хранилища
+        add_batch_size (int): Количество векторов, копируемых за один раз
+        train_size (int): Размер выборки для обучения квантователя
+
+    Returns:
+        Dict: Манифест объединенных шардов
+    """
+    started = time.perf_counter()
+    manifest = load_manifest(shards_dir)
+    shard_dirs = [os.path.join(shards_dir, shard['path']) for shard in manifest['shards']]
+    precision = manifest['precision']
+    os.makedirs(target_dir, exist_ok=True)
+
+    docstore = CompactDocstore.concatenate(
+        [CompactDocstore.load(os.path.join(path, DOCSTORE_DIR)) for path in shard_dirs]
+    )
+    n = len(docstore)
+    if n != manifest['total_chunks']:
+        raise ValueError(f"Количество чанков в шардах ({n}) не совпадает с манифестом ({manifest['total_chunks']})")
+
+    def blocks():
+        for path in shard_dirs:
+            yield from _iter_shard_vectors(path, add_batch_size)
+
+    first = next(_iter_shard_vectors(shard_dirs[0], 1))
+    dim = first.shape[1]
+    if precision == 'float32':
+        write_flat_index(blocks(), n, dim, os.path.join(target_dir, INDEX_FILE))
+        quantization_meta = os.path.join(target_dir, RescoringIndex.META_FILE)
+        if os.path.exists(quantization_meta):
+            os.remove(quantization_meta)
+    else:
+        vectors_path = os.path.join(target_dir, RescoringIndex.VECTORS_FILE)
+        vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=np.float32, shape=(n, dim))
+        position = 0
+        for block in blocks():
+            vectors[position:position + len(block)] = block
+            position += len(block)
+        vectors.flush()
+        coarse_index = build_coarse_index(vectors, precision, add_batch_size, train_size)
+        del vectors
+        RescoringIndex(coarse_index, vectors_path, precision,
+                       RAG_CONFIG['vector_storage']['rescore_factor']).save(target_dir)
+
+    docstore_dir = os.path.join(target_dir, DOCSTORE_DIR)
+    docstore.save(docstore_dir)
+    MetadataIndex.from_docstore(docstore).save(os.path.join(target_dir, METADATA_DIR))
+    lexical_dir = os.path.join(target_dir, LEXICAL_DIR)
+    if any(os.path.exists(os.path.join(path, LEXICAL_DIR)) for path in shard_dirs):
+        BM25Index.from_docstore(docstore, RAG_CONFIG['hybrid']['bm25_k1'],
+                                RAG_CONFIG['hybrid']['bm25_b']).save(lexical_dir)
+    elif os.path.exists(lexical_dir):
+        shutil.rmtree(lexical_dir)
+    logger.info("Объединено %s шардов в %s за "
+                "%.2f с: %s чанков", len(shard_dirs), target_dir, time.perf_counter() - started, n)
+    return manifest
@@ -0,0 +1,437 @@
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
+
+from langchain_core.documents import Document
+
+from utils.mylogger import Logger
+
+# Инициализация логгера для отслеживания работы сплиттера
+logger = Logger('OffsetTextSplitter', 'logs/rag.log')
+
+
+class ChunkSpans:
+    """
+    Чанки документов в виде смещений в исходном тексте.
+
+    Каждый чанк хранится как тройка (номер документа, начало, конец) в компактных
+    массивах, а строка чанка создается только при обращении к ней (при вычислении
+    эмбеддингов или при возврате результата).
+
+    Attributes:
+        documents (List[Document]): Исходные документы
+        doc_ids (array): Номер документа для каждого чанка
+        starts (array): Смещение начала чанка в тексте документа
+        ends (array): Смещение конца чанка в тексте документа
+        token_counts (Optional[array]): Длина чанка в токенах модели эмбеддингов
+            (только при разбиении с учетом токенов)
+    """
+    def __init__(self, documents: List[Document], with_token_counts: bool = False) -> None:
+        self.documents = documents
+        self.doc_ids = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.token_counts: Optional[array] = array('i') if with_token_counts else None
+
+    def append(self, doc_id: int, start: int, end: int, token_count: int = -1) -> None:
+        self.doc_ids.append(doc_id)
+        self.starts.append(start)
+        self.ends.append(end)
+        if self.token_counts is not None:
+            self.token_counts.append(token_count)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def text(self, i: int) -> str:
+        """
+        Создает строку чанка по его номеру.
+        """
+        return self.documents[self.doc_ids[i]].page_content[self.starts[i]:self.ends[i]]
+
+    def metadata(self, i: int) -> dict:
+        """
+        Возвращает метаданные документа, которому принадлежит чанк.
+        """
+        return self.documents[self.doc_ids[i]].metadata
+
+    def document(self, i: int) -> Document:
+        """
+        Создает объект Document для одного чанка.
+        """
+        return Document(page_content=self.text(i), metadata=dict(self.metadata(i)))
+
+    def iter_texts(self, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+        """
+        Лениво перебирает строки чанков в диапазоне номеров.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self.text(i)
+
+    def to_documents(self) -> List[Document]:
+        """
+        Создает объекты Document для всех чанков (для совместимости с LangChain).
+        """
+        return [self.document(i) for i in range(len(self))]
+
+
+class OffsetTextSplitter:
+    """
+    Сплиттер текста за один линейный проход с чанками в виде смещений.
+
+    Работает с теми же параметрами, что и RecursiveCharacterTextSplitter:
+    - длина чанка не превышает chunk_size символов
+    - соседние чанки перекрываются не более чем на chunk_overlap символов
+    - граница чанка выбирается по первому из separators, который встречается
+      в окне chunk_size, начиная с самого приоритетного ("\\n\\n", "\\n", ". ", " ", "")
+
+    В отличие от RecursiveCharacterTextSplitter, текст не копируется на каждом
+    уровне рекурсии: для каждого окна выполняется поиск разделителя справа налево
+    (str.rfind), а результат - только смещения начала и конца чанка.
+    Перекрытие начинается с границы слова, пробельные символы по краям чанка
+    отбрасываются.
+    """
+    def __init__(self,
+                 chunk_size: int = 512,
+                 chunk_overlap: int = 128,
+                 separators: Optional[Sequence[str]] = None) -> None:
+        """
+        Инициализация сплиттера.
+
+        Args:
+            chunk_size (int): Максимальная длина чанка в символах
+            chunk_overlap (int): Максимальное перекрытие соседних чанков в символах
+            separators (Optional[Sequence[str]]): Разделители в порядке приоритета
+
+        Raises:
+            ValueError: Если перекрытие не меньше размера чанка
+        """
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"Перекрытие ({chunk_overlap}) должно быть меньше размера чанка ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators) if separators is not None else ["\n\n", "\n", ". ", " ", ""]
+
+    def _find_break(self, text: str, lower: int, limit: int) -> int:
+        """
+        Находит конец чанка в окне (lower, limit] по самому приоритетному разделителю.
+
+        Нижняя граница окна не меньше конца предыдущего чанка, поэтому каждый
+        следующий чанк продвигается вперед и не повторяет предыдущий.
+        """
+        for separator in self.separators:
+            if not separator:
+                return limit
+            # Видимая часть разделителя (например, точка в ". ") остается в текущем чанке
+            keep = len(separator.rstrip())
+            pos = text.rfind(separator, lower + 1, limit - keep + len(separator))
+            if pos > lower:
+                return pos + keep
+        return limit
+
+    @staticmethod
+    def _skip_space(text: str, pos: int, end: int) -> int:
+        while pos < end and text[pos].isspace():
+            pos += 1
+        return pos
+
+    @staticmethod
+    def _word_start(text: str, pos: int, end: int) -> int:
+        """
+        Возвращает начало первого слова не раньше pos (или end, если слова нет).
+        """
+        if pos == 0 or text[pos - 1].isspace():
+            return pos
+        while pos < end and not text[pos].isspace():
+            pos += 1
+        return pos
+
+    def split_text_offsets(self, text: str) -> Iterator[Tuple[int, int]]:
+        """
+        Разбивает текст на чанки за один проход.
+
+        Args:
+            text (str): Исходный текст
+
+        Yields:
+            Tuple[int, int]: Смещения начала и конца очередного чанка
+        """
+        for start, end, _ in self._split_buffer(text):
+            yield start, end
+
+    def _iter_offsets(self,
+                      text: str,
+                      window_limit: Callable[[int], int],
+                      overlap_floor: Callable[[int, int, int], int],
+                      overlap: bool,
+                      previous_end: int = 0) -> Iterator[Tuple[int, int]]:
+        """
+        Общий цикл разбиения, не зависящий от единицы измерения длины чанка.
+
+        Args:
+            text (str): Исходный текст
+            window_limit: Правая граница окна чанка по смещению его начала
+            overlap_floor: Самое левое допустимое начало следующего чанка
+                по (началу, концу текущего чанка, началу непокрытого текста)
+            overlap (bool): Перекрываются ли соседние чанки
+            previous_end (int): Левая граница поиска конца первого чанка
+                (при продолжении разбиения с середины текста)
+        """
+        n = len(text)
+        start = self._skip_space(text, 0, n)
+        while start < n:
+            limit = window_limit(start)
+            end = n if limit >= n else self._find_break(text, max(start, previous_end), limit)
+
+            chunk_end = end
+            while chunk_end > start and text[chunk_end - 1].isspace():
+                chunk_end -= 1
+            if chunk_end > start:
+                yield start, chunk_end
+            rest = self._skip_space(text, end, n)
+            if rest >= n:
+                break
+            # Следующий чанк должен закончиться правее начала непробельного текста после текущего
+            previous_end = rest
+
+            next_start = end
+            if overlap:
+                # Начало перекрытия не может быть настолько левым, чтобы окно следующего
+                # чанка не дотягивалось до еще не покрытого текста
+                next_start = self._word_start(text, overlap_floor(start, end, rest), end)
+            next_start = self._skip_space(text, next_start, n)
+            # Гарантируем продвижение вперед при любом расположении разделителей
+            start = next_start if next_start > start else rest
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Разбивает текст на строки чанков (для совместимости с интерфейсом сплиттеров LangChain).
+        """
+        return [text[start:end] for start, end in self.split_text_offsets(text)]
+
+    def _split_buffer(self, text: str, previous_end: int = 0) -> Iterator[Tuple[int, int, int]]:
+        """
+        Разбивает текст буфера потокового разбиения: начало, конец и длина чанка
+        в токенах (-1, если длина измеряется в символах).
+        """
+        size, overlap = self.chunk_size, self.chunk_overlap
+        offsets = self._iter_offsets(
+            text,
+            lambda start: start + size,
+            lambda start, end, rest: max(end - overlap, start + 1, rest - size + 1),
+            overlap > 0,
+            previous_end
+        )
+        for start, end in offsets:
+            yield start, end, -1
+
+    def iter_chunks(self, documents: Iterable[Document]) -> Iterator[Tuple[str, dict, int]]:
+        """
+        Потоково разбивает последовательность страниц на чанки.
+
+        Страницы одного источника идут подряд и объединяются в скользящий буфер:
+        все чанки буфера, кроме последнего, окончательные, а текст последнего
+        (незавершенного) чанка переносится на следующую страницу. Поэтому абзац,
+        разорванный границей страниц, попадает в один чанк, а в памяти находятся
+        только текущая страница и хвост не длиннее одного чанка.
+        Метаданные чанка берутся со страницы, на которой он начинается.
+
+        Args:
+            documents (Iterable[Document]): Страницы, сгруппированные по источнику
+
+        Yields:
+            Tuple[str, dict, int]: Текст чанка, метаданные и длина в токенах (-1, если не измерялась)
+        """
+        buffer = ''
+        # Смещения начала страниц в буфере и их метаданные
+        segments: List[Tuple[int, dict]] = []
+        source = None
+        # Левая граница конца перенесенного чанка, как при разбиении всего текста сразу
+        previous_end = 0
+
+        def metadata_at(pos: int) -> dict:
+            metadata = segments[0][1]
+            for offset, page_metadata in segments:
+                if offset > pos:
+                    break
+                metadata = page_metadata
+            return metadata
+
+        for doc in documents:
+            doc_source = doc.metadata.get('source')
+            if segments and doc_source != source:
+                for start, end, count in self._split_buffer(buffer, previous_end):
+                    yield buffer[start:end], metadata_at(start), count
+                buffer, segments, previous_end = '', [], 0
+            source = doc_source
+
+            if buffer:
+                buffer += '\n'
+            segments.append((len(buffer), doc.metadata))
+            buffer += doc.page_content
+
+            chunks = list(self._split_buffer(buffer, previous_end))
+            if not chunks:
+                buffer, segments, previous_end = '', [], 0
+                continue
+            for start, end, count in chunks[:-1]:
+                yield buffer[start:end], metadata_at(start), count
+            # Последний чанк может продолжиться на следующей странице
+            tail = chunks[-1][0]
+            if len(chunks) > 1:
+                previous_end = self._skip_space(buffer, chunks[-2][1], len(buffer))
+            previous_end = max(previous_end - tail, 0)
+            segments = [(max(offset - tail, 0), metadata) for offset, metadata in segments
+                        if offset > tail or metadata is metadata_at(tail)]
+            buffer = buffer[tail:]
+
+        if segments:
+            for start, end, count in self._split_buffer(buffer, previous_end):
+                yield buffer[start:end], metadata_at(start), count
+
+    def split_documents(self, documents: List[Document]) -> ChunkSpans:
+        """
+        Разбивает документы на чанки в виде смещений.
+
+        Args:
+            documents (List[Document]): Список документов
+
+        Returns:
+            ChunkSpans: Смещения чанков во всех документах
+        """
+        spans = ChunkSpans(documents)
+        for doc_id, doc in enumerate(documents):
+            for start, end in self.split_text_offsets(doc.page_content):
+                spans.append(doc_id, start, end)
+        logger.info("Документы (%s) разбиты на %s чанков", len(documents), len(spans))
+        return spans
+
+
+class TokenTextSplitter(OffsetTextSplitter):
+    """
+    Сплиттер, измеряющий длину чанков в токенах модели эмбеддингов.
+
+    Чанки, размер которых задан в символах, либо обрезаются токенизатором модели
+    (текст сверх max_seq_length не попадает в эмбеддинг), либо занимают
+    малую часть окна и тратят вычисления на паддинг. Этот сплиттер:
+    - токенизирует документы быстрым (fast) токенизатором модели пакетами
+      и получает смещения каждого токена в тексте (offset mapping)
+    - подбирает границы чанков по тем же разделителям, что и OffsetTextSplitter,
+      но окно чанка ограничено бюджетом токенов чуть меньше max_seq_length
+    - сохраняет длину каждого чанка в токенах (ChunkSpans.token_counts)
+
+    Длина чанка вычисляется по токенизации всего документа, поэтому на границах
+    чанков она может отличаться от повторной токенизации на несколько токенов;
+    этот случай покрывает запас margin.
+    """
+    def __init__(self,
+                 tokenizer,
+                 max_seq_length: int,
+                 chunk_overlap: int = 64,
+                 margin: int = 8,
+                 batch_size: int = 64,
+                 separators: Optional[Sequence[str]] = None) -> None:
+        """
+        Инициализация сплиттера.
+
+        Args:
+            tokenizer: Быстрый токенизатор HuggingFace модели эмбеддингов
+                (например, SentenceTransformer.tokenizer)
+            max_seq_length (int): Максимальная длина входа модели в токенах
+            chunk_overlap (int): Максимальное перекрытие соседних чанков в токенах
+            margin (int): Запас токенов до max_seq_length
+            batch_size (int): Количество документов в одном вызове токенизатора
+            separators (Optional[Sequence[str]]): Разделители в порядке приоритета
+
+        Raises:
+            ValueError: Если токенизатор не поддерживает смещения токенов
+                или бюджет токенов не больше перекрытия
+        """
+        if not getattr(tokenizer, 'is_fast', False):
+            raise ValueError("Для разбиения по токенам нужен быстрый (fast) токенизатор")
+        special_tokens = tokenizer.num_special_tokens_to_add(pair=False)
+        super().__init__(max_seq_length - special_tokens - margin, chunk_overlap, separators)
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+
+    def _token_offsets(self, texts: List[str]) -> List[Tuple[List[int], List[int]]]:
+        """
+        Токенизирует пакет текстов и возвращает смещения начала и конца каждого токена.
+        """
+        encoding = self.tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False
+        )
+        result = []
+        for offsets in encoding['offset_mapping']:
+            result.append(([start for start, _ in offsets], [end for _, end in offsets]))
+        return result
+
+    def _split_with_tokens(self,
+                           text: str,
+                           token_starts: List[int],
+                           token_ends: List[int],
+                           previous_end: int = 0) -> Iterator[Tuple[int, int, int]]:
+        """
+        Разбивает текст на чанки по смещениям его токенов.
+
+        Yields:
+            Tuple[int, int, int]: Начало, конец чанка и его длина в токенах
+        """
+        n_tokens = len(token_starts)
+        budget, overlap = self.chunk_size, self.chunk_overlap
+
+        def first_token(pos: int) -> int:
+            # Номер первого токена, который заканчивается правее pos
+            return bisect_right(token_ends, pos)
+
+        def window_limit(start: int) -> int:
+            last = first_token(start) + budget
+            return len(text) if last >= n_tokens else token_starts[last]
+
+        def overlap_floor(start: int, end: int, rest: int) -> int:
+            floor = max(bisect_left(token_starts, end) - overlap, first_token(rest) - budget + 1, 0)
+            if floor >= n_tokens:
+                return end
+            return max(token_starts[floor], start + 1)
+
+        for start, end in self._iter_offsets(text, window_limit, overlap_floor, overlap > 0, previous_end):
+            yield start, end, bisect_left(token_starts, end) - first_token(start)
+
+    def split_text_offsets(self, text: str) -> Iterator[Tuple[int, int]]:
+        token_starts, token_ends = self._token_offsets([text])[0]
+        for start, end, _ in self._split_with_tokens(text, token_starts, token_ends):
+            yield start, end
+
+    def _split_buffer(self, text: str, previous_end: int = 0) -> Iterator[Tuple[int, int, int]]:
+        token_starts, token_ends = self._token_offsets([text])[0]
+        return self._split_with_tokens(text, token_starts, token_ends, previous_end)
+
+    def split_documents(self, documents: List[Document]) -> ChunkSpans:
+        """
+        Разбивает документы на чанки с длиной в токенах.
+
+        Args:
+            documents (List[Document]): Список документов
+
+        Returns:
+            ChunkSpans: Смещения чанков и их длины в токенах (token_counts)
+        """
+        spans = ChunkSpans(documents, with_token_counts=True)
+        total_tokens = 0
+        for batch_start in range(0, len(documents), self.batch_size):
+            batch = documents[batch_start:batch_start + self.batch_size]
+            offsets = self._token_offsets([doc.page_content for doc in batch])
+            for doc_id, doc, (token_starts, token_ends) in zip(range(batch_start, len(documents)), batch, offsets):
+                for start, end, count in self._split_with_tokens(doc.page_content, token_starts, token_ends):
+                    spans.append(doc_id, start, end, count)
+                    total_tokens += count
+        logger.info("Документы (%s) разбиты на %s чанков по токенам: "
+                    "бюджет %s токенов, в среднем %.1f",
+                    len(documents), len(spans), self.chunk_size, total_tokens / max(len(spans), 1))
+        return spans
@@ -1,32 +1,60 @@
 from langchain_core.documents import Document
-from typing import List
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from functools import cached_property
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+import faiss
 import numpy as np
+import os
+import shutil
 import asyncio
 
 from utils.mylogger import Logger
 from src.embedded.custom_embeddings import CustomEmbeddings
+from src.date.compact_docstore import CompactDocstore
+from src.date.quantized_index import (
+    RescoringIndex, build_index, code_size, load_flat_index, quantization_report, replace_file
+)
+from src.date.deduplicate import ChunkDeduplicator
+from src.date.out_of_core import OutOfCoreIndexBuilder
+from src.date.metadata_index import MetadataIndex
+from src.date.bm25_index import BM25Index
+from src.date.text_splitter import OffsetTextSplitter, TokenTextSplitter
+from src.monitoring.tracing import span
 from config import RAG_CONFIG
 
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
 # Инициализация логгера для отслеживания работы векторного хранилища
 logger = Logger('VectorStore', 'logs/rag.log')
 
 class VectorStore:
     """
     Класс для создания и управления векторным хранилищем на основе FAISS.
-    
+
     Основные функции:
-    1. Разбиение документов на чанки с помощью RecursiveCharacterTextSplitter
+    1. Разбиение документов на чанки с помощью OffsetTextSplitter (линейный проход,
+       чанки в виде смещений), TokenTextSplitter (длина чанка в токенах модели)
+       или RecursiveCharacterTextSplitter
     2. Создание векторных представлений документов
     3. Индексация документов в FAISS для быстрого поиска
-    
+    4. Сохранение и загрузка индекса вместе с колоночным хранилищем чанков
+
     Особенности:
     - Использует кастомную модель эмбеддингов
-    - Поддерживает метаданные документов
+    - Хранит чанки в компактном колоночном хранилище (CompactDocstore)
+    - Поддерживает сжатое хранение векторов (float16, int8, binary) с точным пересчетом
+    - Строит индекс метаданных для фильтрации по файлам, директориям и страницам
+    - Строит лексический индекс BM25 для гибридного поиска
+    - Удаляет точные и почти точные дубликаты чанков до вычисления эмбеддингов
+    - Может строить индекс вне памяти с продолжением прерванной сборки (OutOfCoreIndexBuilder)
     - Имеет механизм fallback при ошибках создания хранилища
     - Оптимизирован для работы с русскоязычными текстами
     """
+    INDEX_FILE = 'index.faiss'
+    DOCSTORE_DIR = 'docstore'
+    METADATA_DIR = 'metadata'
+    LEXICAL_DIR = 'bm25'
+
     def __init__(self, llm) -> None:
         """
         Инициализация векторного хранилища.
@@ -35,30 +63,53 @@ class VectorStore:
             llm: Экземпляр класса AdvancedRAG, содержащий модель для эмбеддингов
         """
         self.llm = llm
-        # Инициализация сплиттера для разбиения документов на чанки
-        # Параметры сплиттера берутся из конфигурации RAG_CONFIG
-        self.text_splitter = RecursiveCharacterTextSplitter(**RAG_CONFIG["text_splitter"])
+        # Быстрый сплиттер с теми же размером чанка, перекрытием и разделителями
+        self.offset_splitter = OffsetTextSplitter(
+            chunk_size=RAG_CONFIG["text_splitter"]["chunk_size"],
+            chunk_overlap=RAG_CONFIG["text_splitter"]["chunk_overlap"],
+            separators=RAG_CONFIG["text_splitter"]["separators"]
+        )
         # Создание модели для генерации эмбеддингов
         self.embedding_model = CustomEmbeddings(llm.sentence_transformer)
 
-    async def create_vector_store_async(self, documents: List[Document]) -> None:
+    @cached_property
+    def text_splitter(self):
+        """
+        Сплиттер LangChain для разбиения документов на чанки (RAG_CONFIG['splitter'] == 'recursive'
+        и запасной путь FAISS.from_documents); создается при первом обращении.
+        """
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        # Параметры сплиттера берутся из конфигурации RAG_CONFIG
+        return RecursiveCharacterTextSplitter(**RAG_CONFIG["text_splitter"])
+
+    async def create_vector_store_async(self,
+                                        documents: List[Document],
+                                        index_dir: Optional[str] = None,
+                                        work_dir: Optional[str] = None) -> None:
         """
         Асинхронное создание векторного хранилища из документов.
 
         Процесс создания:
-        1. Разбиение документов на чанки с помощью text_splitter
-        2. Попытка создания хранилища стандартным методом FAISS
-        3. При неудаче - создание хранилища вручную:
-           - Извлечение текстов и метаданных
-           - Генерация эмбеддингов
-           - Создание индекса FAISS
-           - Инициализация векторного хранилища
+        1. Разбиение документов на чанки сплиттером из RAG_CONFIG['splitter']
+        2. Упаковка чанков в колоночное хранилище CompactDocstore, удаление
+           дубликатов (RAG_CONFIG['deduplication']) и построение индекса
+           метаданных (llm.metadata_index)
+        3. Построение лексического индекса BM25 (llm.lexical_index), если
+           включен гибридный поиск (RAG_CONFIG['hybrid'])
+        4. Генерация эмбеддингов пакетами и создание индекса FAISS в формате из
+           RAG_CONFIG['vector_storage'] (при необходимости с отчетом о квантовании)
+        5. При неудаче - создание хранилища стандартным методом FAISS.from_documents
 
         Args:
             documents (List[Document]): Список документов для индексации
                 Каждый документ должен содержать:
                 - page_content: текст документа
                 - metadata: метаданные (источник, страница и т.д.)
+            index_dir (Optional[str]): Директория индекса, в которую пишутся полноточные
+                векторы сжатого индекса (по умолчанию RAG_CONFIG['index_dir'])
+            work_dir (Optional[str]): Рабочая директория сборки вне памяти
+                (по умолчанию RAG_CONFIG['out_of_core']['dir'])
 
         Raises:
             ValueError: Если список документов пуст
@@ -67,59 +118,429 @@ class VectorStore:
         if not documents:
             raise ValueError("Список документов не может быть пустым")
         try:
-            # Разбиваем документы на чанки для оптимизации поиска
-            try:
-                chunks = self.text_splitter.split_documents(documents)
-                logger.info(f"Документы разбиты на {len(chunks)} чанков")
-            except Exception as e:
-                logger.error(f"Ошибка при разбиении документов на чанки: {str(e)}")
-                raise
-                
             # Создаем векторное хранилище
             try:
-                # Пробуем стандартный метод создания FAISS
-                self.llm.vectorstore = await asyncio.to_thread(
-                    FAISS.from_documents,
-                    documents=chunks,
-                    embedding=self.embedding_model
-                )
-                logger.info("Векторное хранилище успешно создано стандартным методом")
+                # Разбиваем документы на чанки и упаковываем их в колоночное хранилище
+                # вместо отдельных объектов Document
+                with span('split', documents=len(documents)) as split_span:
+                    docstore = await asyncio.to_thread(self._split_to_docstore, documents)
+                    split_span.set(chunks=len(docstore))
+                await self._build_from_docstore_async(docstore, index_dir, work_dir)
+                logger.info("Векторное хранилище успешно создано с колоночным хранилищем чанков")
             except Exception as e:
-                logger.warning(f"Не удалось создать векторное хранилище стандартным методом: {str(e)}")
-                logger.info("Пробуем создать векторное хранилище вручную")
+                logger.warning("Не удалось создать векторное хранилище с колоночным хранилищем: %s", e)
+                logger.info("Пробуем создать векторное хранилище стандартным методом")
+                # Без колоночного хранилища фильтрация по метаданным недоступна
+                self.llm.metadata_index = None
+                self.llm.lexical_index = None
                 try:
-                    # Извлекаем тексты и метаданные из чанков
-                    texts = [doc.page_content for doc in chunks]
-                    metadatas = [doc.metadata for doc in chunks]
-                    
-                    # Получаем векторные представления для всех текстов
-                    embeddings = await asyncio.to_thread(
-                        self.embedding_model.embed_documents,
-                        texts
-                    )
-                    
-                    # Создаем индекс FAISS с размерностью векторов
-                    dimension = len(embeddings[0])
-                    index = FAISS.IndexFlatL2(dimension)
-                    index.add(np.array(embeddings).astype('float32'))
-                    
-                    # Создаем векторное хранилище с кастомной моделью эмбеддингов
-                    self.llm.vectorstore = FAISS(
-                        self.embedding_model.embed_query,
-                        index,
-                        texts,
-                        metadatas
+                    from langchain_community.vectorstores import FAISS
+
+                    self.llm.vectorstore = await asyncio.to_thread(
+                        FAISS.from_documents,
+                        documents=self.text_splitter.split_documents(documents),
+                        embedding=self.embedding_model
                     )
-                    logger.info("Векторное хранилище успешно создано вручную")
+                    logger.info("Векторное хранилище успешно создано стандартным методом")
                 except Exception as e:
-                    logger.error(f"Ошибка при создании векторного хранилища вручную: {str(e)}")
+                    logger.error("Ошибка при создании векторного хранилища стандартным методом: %s", e)
                     raise
         except Exception as e:
-            logger.error(f"Критическая ошибка при создании векторного хранилища: {str(e)}")
+            logger.error("Критическая ошибка при создании векторного хранилища: %s", e)
             raise
 
-    def create_vector_store(self, documents: List[Document]) -> None:
+    def create_vector_store(self,
+                            documents: List[Document],
+                            index_dir: Optional[str] = None,
+                            work_dir: Optional[str] = None) -> None:
         """
         Синхронное создание векторного хранилища из документов.
         """
-        asyncio.run(self.create_vector_store_async(documents))
\ No newline at end of file
+        asyncio.run(self.create_vector_store_async(documents, index_dir, work_dir))
+
+    def _split_to_docstore(self, documents: List[Document]) -> CompactDocstore:
+        """
+        Разбивает документы на чанки и упаковывает их в колоночное хранилище.
+
+        Args:
+            documents (List[Document]): Список документов
+
+        Returns:
+            CompactDocstore: Колоночное хранилище чанков
+        """
+        try:
+            if RAG_CONFIG["splitter"] == "tokens":
+                # Длина чанков измеряется токенизатором модели эмбеддингов,
+                # длины в токенах сохраняются в хранилище
+                spans = self._token_splitter().split_documents(documents)
+                return CompactDocstore.from_spans(spans)
+            if RAG_CONFIG["splitter"] == "recursive":
+                chunks = self.text_splitter.split_documents(documents)
+                logger.info("Документы разбиты на %s чанков", len(chunks))
+                return CompactDocstore.from_documents(chunks)
+            # Чанки в виде смещений: строки создаются только при упаковке в буфер
+            spans = self.offset_splitter.split_documents(documents)
+            return CompactDocstore.from_spans(spans)
+        except Exception as e:
+            logger.error("Ошибка при разбиении документов на чанки: %s", e)
+            raise
+
+    async def _build_from_docstore_async(self,
+                                         docstore: CompactDocstore,
+                                         index_dir: Optional[str] = None,
+                                         work_dir: Optional[str] = None) -> None:
+        """
+        Строит индексы по колоночному хранилищу чанков и подключает их к llm.
+
+        Этапы: удаление дубликатов, эмбеддинги пакетами, индекс FAISS в формате
+        из RAG_CONFIG['vector_storage'], индекс метаданных и лексический индекс BM25.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+            index_dir (Optional[str]): Директория полноточных векторов сжатого индекса
+                (по умолчанию RAG_CONFIG['index_dir'])
+            work_dir (Optional[str]): Рабочая директория сборки вне памяти
+                (по умолчанию RAG_CONFIG['out_of_core']['dir'])
+        """
+        if RAG_CONFIG["deduplication"]["enabled"]:
+            with span('clean', chunks=len(docstore)) as clean_span:
+                docstore = await asyncio.to_thread(self._deduplicate, docstore)
+                clean_span.set(kept_chunks=len(docstore))
+
+        storage_config = RAG_CONFIG["vector_storage"]
+        if RAG_CONFIG["out_of_core"]["enabled"]:
+            # Эмбеддинги и индекс строятся вместе пакетами из файла на диске
+            with span('embed', chunks=len(docstore)):
+                index = await self._build_index_out_of_core_async(docstore, work_dir)
+            with span('index', chunks=len(docstore)):
+                metadata_index, lexical_index = await self._build_side_indexes_async(docstore)
+            self.llm.vectorstore = self._wrap_index(index, docstore)
+            self.llm.metadata_index = metadata_index
+            self.llm.lexical_index = lexical_index
+            return
+
+        # Получаем векторные представления для всех чанков
+        with span('embed', chunks=len(docstore)) as embed_span:
+            embeddings = await self._embed_docstore_async(docstore)
+            if embed_span and docstore.token_counts is not None:
+                embed_span.set(tokens=int(docstore.token_counts.sum()))
+
+        with span('index', chunks=len(docstore)):
+            # Создаем индекс FAISS в заданном формате хранения векторов
+            if storage_config["report"]:
+                self.quantization_report = await asyncio.to_thread(
+                    quantization_report,
+                    embeddings,
+                    k=storage_config["report_k"],
+                    rescore_factor=storage_config["rescore_factor"]
+                )
+            index = await asyncio.to_thread(
+                build_index,
+                embeddings,
+                storage_config["precision"],
+                index_dir or RAG_CONFIG["index_dir"],
+                storage_config["rescore_factor"]
+            )
+            del embeddings
+            metadata_index, lexical_index = await self._build_side_indexes_async(docstore)
+
+        self.llm.vectorstore = self._wrap_index(index, docstore)
+        self.llm.metadata_index = metadata_index
+        self.llm.lexical_index = lexical_index
+
+    async def _build_side_indexes_async(self, docstore: CompactDocstore) -> Tuple[MetadataIndex, Optional[BM25Index]]:
+        """
+        Строит индекс метаданных и, если включен гибридный поиск, лексический индекс BM25.
+        """
+        metadata_index = await asyncio.to_thread(MetadataIndex.from_docstore, docstore)
+        lexical_index = None
+        if RAG_CONFIG["hybrid"]["enabled"]:
+            lexical_index = await asyncio.to_thread(
+                BM25Index.from_docstore,
+                docstore,
+                RAG_CONFIG["hybrid"]["bm25_k1"],
+                RAG_CONFIG["hybrid"]["bm25_b"]
+            )
+        return metadata_index, lexical_index
+
+    async def create_vector_store_from_stream_async(self,
+                                                    pages: Iterable[Document],
+                                                    index_dir: Optional[str] = None,
+                                                    work_dir: Optional[str] = None) -> None:
+        """
+        Создание векторного хранилища из потока страниц.
+
+        Страницы разбиваются на чанки по мере поступления (OffsetTextSplitter.iter_chunks
+        или TokenTextSplitter.iter_chunks) и сразу упаковываются в колоночное хранилище,
+        поэтому исходные документы целиком в памяти не держатся. Чанк может начинаться
+        на одной странице и заканчиваться на следующей.
+
+        Поток расходуется один раз, поэтому запасного создания хранилища через
+        FAISS.from_documents в этом режиме нет.
+
+        Args:
+            pages (Iterable[Document]): Поток страниц (например, ProcessDocuments.iter_processed)
+            index_dir (Optional[str]): Директория полноточных векторов сжатого индекса
+                (по умолчанию RAG_CONFIG['index_dir'])
+            work_dir (Optional[str]): Рабочая директория сборки вне памяти
+                (по умолчанию RAG_CONFIG['out_of_core']['dir'])
+
+        Raises:
+            ValueError: Если поток не содержит текста или выбран сплиттер recursive
+        """
+        if RAG_CONFIG["splitter"] == "recursive":
+            raise ValueError("Потоковое создание хранилища не поддерживает сплиттер recursive")
+        try:
+            splitter = self._token_splitter() if RAG_CONFIG["splitter"] == "tokens" else self.offset_splitter
+            # Загрузка, обработка и разбиение страниц выполняются в отдельном потоке,
+            # поэтому в потоковом режиме этап split включает загрузку и очистку
+            with span('split') as split_span:
+                docstore = await asyncio.to_thread(CompactDocstore.from_texts, splitter.iter_chunks(pages))
+                split_span.set(chunks=len(docstore))
+            if len(docstore) == 0:
+                raise ValueError("Поток документов не содержит текста")
+            await self._build_from_docstore_async(docstore, index_dir, work_dir)
+            logger.info("Векторное хранилище успешно создано из потока страниц")
+        except Exception as e:
+            logger.error("Критическая ошибка при потоковом создании векторного хранилища: %s", e)
+            raise
+
+    def create_vector_store_from_stream(self,
+                                        pages: Iterable[Document],
+                                        index_dir: Optional[str] = None,
+                                        work_dir: Optional[str] = None) -> None:
+        """
+        Синхронное создание векторного хранилища из потока страниц.
+        """
+        asyncio.run(self.create_vector_store_from_stream_async(pages, index_dir, work_dir))
+
+    def _deduplicate(self, docstore: CompactDocstore) -> CompactDocstore:
+        """
+        Удаляет дубликаты чанков, отчет сохраняется в self.deduplication_report.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+
+        Returns:
+            CompactDocstore: Хранилище без дубликатов
+        """
+        config = RAG_CONFIG["deduplication"]
+        deduplicator = ChunkDeduplicator(
+            shingle_size=config["shingle_size"],
+            num_perm=config["num_perm"],
+            bands=config["bands"],
+            threshold=config["threshold"],
+            near_duplicates=config["near_duplicates"]
+        )
+        dim = self.llm.sentence_transformer.get_sentence_embedding_dimension()
+        bytes_per_vector = code_size(RAG_CONFIG["vector_storage"]["precision"], dim)
+        docstore, self.deduplication_report = deduplicator.deduplicate(docstore, bytes_per_vector)
+        return docstore
+
+    def _token_splitter(self) -> TokenTextSplitter:
+        """
+        Создает сплиттер по токенам для токенизатора и max_seq_length модели эмбеддингов.
+        """
+        model = self.llm.sentence_transformer
+        config = RAG_CONFIG["token_splitter"]
+        return TokenTextSplitter(
+            model.tokenizer,
+            model.max_seq_length,
+            chunk_overlap=config["chunk_overlap"],
+            margin=config["margin"],
+            batch_size=config["batch_size"],
+            separators=RAG_CONFIG["text_splitter"]["separators"]
+        )
+
+    async def _embed_docstore_async(self, docstore: CompactDocstore) -> np.ndarray:
+        """
+        Вычисляет эмбеддинги всех чанков хранилища пакетами.
+
+        Строки чанков создаются только для текущего пакета, поэтому в памяти
+        одновременно находятся не более embedding_batch_size текстов.
+        Если в хранилище известны длины чанков в токенах, пакеты составляются
+        из чанков близкой длины, чтобы не тратить вычисления на паддинг.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+
+        Returns:
+            np.ndarray: Матрица эмбеддингов (float32, n x dim)
+        """
+        batch_size = RAG_CONFIG["embedding_batch_size"]
+        embeddings = None
+        order = None
+        if docstore.token_counts is not None:
+            order = np.argsort(docstore.token_counts, kind='stable')
+        for start in range(0, len(docstore), batch_size):
+            stop = min(start + batch_size, len(docstore))
+            ids = range(start, stop) if order is None else order[start:stop]
+            texts = [docstore.get_text(int(i)) for i in ids]
+            batch = await self.embedding_model.embed_documents_array_async(texts)
+            if embeddings is None:
+                embeddings = np.empty((len(docstore), batch.shape[1]), dtype=np.float32)
+            if order is None:
+                embeddings[start:stop] = batch
+            else:
+                embeddings[order[start:stop]] = batch
+        if embeddings is None:
+            raise ValueError("Нет чанков для вычисления эмбеддингов")
+        return embeddings
+
+    async def _build_index_out_of_core_async(self, docstore: CompactDocstore, work_dir: Optional[str] = None):
+        """
+        Строит индекс вне памяти: эмбеддинги пишутся пакетами в файл на диске,
+        индекс строится из него частями.
+
+        Если предыдущая сборка тех же чанков той же моделью была прервана,
+        эмбеддинги вычисляются только для незавершенных пакетов.
+        Отчет о квантовании в этом режиме не строится: он требует всех векторов в памяти.
+
+        Args:
+            docstore (CompactDocstore): Колоночное хранилище чанков
+            work_dir (Optional[str]): Рабочая директория сборки
+                (по умолчанию RAG_CONFIG['out_of_core']['dir'])
+
+        Returns:
+            Индекс FAISS (IndexFlatL2, отображенный в память) или RescoringIndex
+        """
+        config = RAG_CONFIG["out_of_core"]
+        storage_config = RAG_CONFIG["vector_storage"]
+        builder = OutOfCoreIndexBuilder(
+            work_dir or config["dir"],
+            precision=storage_config["precision"],
+            rescore_factor=storage_config["rescore_factor"],
+            batch_size=RAG_CONFIG["embedding_batch_size"],
+            add_batch_size=config["add_batch_size"],
+            train_size=config["train_size"]
+        )
+        model = self.llm.sentence_transformer
+        model_id = f"{getattr(model.tokenizer, 'name_or_path', '')}:{model.max_seq_length}"
+        if storage_config["report"]:
+            logger.info("Отчет о квантовании не строится при сборке индекса вне памяти")
+        await builder.embed_async(
+            docstore,
+            model.get_sentence_embedding_dimension(),
+            self.embedding_model.embed_documents_array_async,
+            model_id
+        )
+        return await asyncio.to_thread(builder.build_index)
+
+    def _wrap_index(self, index, docstore: CompactDocstore) -> 'FAISS':
+        """
+        Оборачивает индекс FAISS и колоночное хранилище в векторное хранилище LangChain.
+
+        Args:
+            index: Индекс FAISS
+            docstore (CompactDocstore): Колоночное хранилище чанков
+
+        Returns:
+            FAISS: Векторное хранилище LangChain
+        """
+        from langchain_community.vectorstores import FAISS
+
+        return FAISS(
+            embedding_function=self.embedding_model,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=docstore.index_to_docstore_id
+        )
+
+    async def save_vector_store_async(self, path: str = None) -> None:
+        """
+        Асинхронно сохраняет индекс FAISS и колоночное хранилище на диск.
+
+        Args:
+            path (str): Директория для сохранения (по умолчанию RAG_CONFIG['index_dir'])
+
+        Raises:
+            ValueError: Если векторное хранилище не создано или создано без CompactDocstore
+        """
+        path = path or RAG_CONFIG["index_dir"]
+        vectorstore = self.llm.vectorstore
+        if not isinstance(getattr(vectorstore, 'docstore', None), CompactDocstore):
+            raise ValueError("Векторное хранилище не создано или не использует колоночное хранилище")
+        try:
+            await asyncio.to_thread(os.makedirs, path, exist_ok=True)
+            if isinstance(vectorstore.index, RescoringIndex):
+                await asyncio.to_thread(vectorstore.index.save, path)
+            else:
+                index_path = os.path.join(path, self.INDEX_FILE)
+                await asyncio.to_thread(
+                    replace_file, index_path, lambda tmp_path: faiss.write_index(vectorstore.index, tmp_path)
+                )
+                # Удаляем сжатый индекс предыдущей сборки: загружался бы он, а не текущий,
+                # и полноточные векторы занимали бы место на диске
+                for name in (RescoringIndex.META_FILE, RescoringIndex.CODES_FILE, RescoringIndex.VECTORS_FILE):
+                    stale_path = os.path.join(path, name)
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+            await asyncio.to_thread(vectorstore.docstore.save, os.path.join(path, self.DOCSTORE_DIR))
+            if getattr(self.llm, 'metadata_index', None) is not None:
+                await asyncio.to_thread(self.llm.metadata_index.save, os.path.join(path, self.METADATA_DIR))
+            lexical_path = os.path.join(path, self.LEXICAL_DIR)
+            if getattr(self.llm, 'lexical_index', None) is not None:
+                await asyncio.to_thread(self.llm.lexical_index.save, lexical_path)
+            elif os.path.exists(lexical_path):
+                # BM25 предыдущей сборки ссылается на номера чанков другого хранилища
+                await asyncio.to_thread(shutil.rmtree, lexical_path)
+            logger.info("Векторное хранилище сохранено в %s", path)
+        except Exception as e:
+            logger.error("Ошибка при сохранении векторного хранилища: %s", e)
+            raise
+
+    def save_vector_store(self, path: str = None) -> None:
+        """
+        Синхронная обертка для сохранения векторного хранилища
+        """
+        asyncio.run(self.save_vector_store_async(path))
+
+    async def load_vector_store_async(self, path: str = None, mmap: bool = True) -> None:
+        """
+        Асинхронно загружает индекс FAISS и колоночное хранилище с диска.
+
+        Args:
+            path (str): Директория с сохраненным хранилищем (по умолчанию RAG_CONFIG['index_dir'])
+            mmap (bool): Отображать индекс и колонки в память вместо чтения целиком
+
+        Raises:
+            FileNotFoundError: Если сохраненное хранилище не найдено
+        """
+        path = path or RAG_CONFIG["index_dir"]
+        index_path = os.path.join(path, self.INDEX_FILE)
+        quantized = RescoringIndex.exists(path)
+        if not quantized and not os.path.exists(index_path):
+            raise FileNotFoundError(f"Индекс FAISS не найден: {index_path}")
+        try:
+            if quantized:
+                # Компактные коды читаются в память, полноточные векторы отображаются лениво
+                index = await asyncio.to_thread(RescoringIndex.load, path)
+            else:
+                index = await asyncio.to_thread(load_flat_index, index_path, mmap)
+            docstore = await asyncio.to_thread(CompactDocstore.load, os.path.join(path, self.DOCSTORE_DIR), mmap)
+            metadata_path = os.path.join(path, self.METADATA_DIR)
+            if os.path.exists(metadata_path):
+                self.llm.metadata_index = await asyncio.to_thread(MetadataIndex.load, metadata_path, docstore, mmap)
+            else:
+                self.llm.metadata_index = await asyncio.to_thread(MetadataIndex.from_docstore, docstore)
+            lexical_path = os.path.join(path, self.LEXICAL_DIR)
+            self.llm.lexical_index = None
+            if os.path.exists(lexical_path):
+                lexical_index = await asyncio.to_thread(BM25Index.load, lexical_path, mmap)
+                if lexical_index.ntotal == len(docstore):
+                    self.llm.lexical_index = lexical_index
+                else:
+                    logger.warning("Лексический индекс %s построен по %s чанкам, в хранилище %s: "
+                                   "индекс пропущен, гибридный поиск недоступен до перестроения",
+                                   lexical_path, lexical_index.ntotal, len(docstore))
+            self.llm.vectorstore = self._wrap_index(index, docstore)
+            logger.info("Векторное хранилище загружено из %s: %s векторов", path, index.ntotal)
+        except Exception as e:
+            logger.error("Ошибка при загрузке векторного хранилища: %s", e)
+            raise
+
+    def load_vector_store(self, path: str = None, mmap: bool = True) -> None:
+        """
+        Синхронная обертка для загрузки векторного хранилища
+        """
+        asyncio.run(self.load_vector_store_async(path, mmap))
@@ -0,0 +1,63 @@
+from concurrent.futures import Future
+from typing import Any, Callable
+import threading
+
+from utils.mylogger import Logger
+from utils.startup_timer import startup_timer
+
+# Инициализация логгера для отслеживания загрузки моделей
+logger = Logger('BackgroundModel', 'logs/rag.log')
+
+
+class BackgroundModel:
+    """
+    Модель, загружаемая в фоновом потоке.
+
+    Загрузка (импорт torch и sentence_transformers, чтение весов) начинается
+    сразу при создании объекта, а программа тем временем продолжает работу,
+    например отображает индекс в память. Обращение к любому атрибуту модели
+    (encode, predict, tokenizer...) ждет окончания загрузки, поэтому объект
+    передается вместо модели в VectorStore, Retriever и Promts.
+
+    Поток загрузки завершается после загрузки, поэтому к моменту fork
+    (многопроцессный сервер) лишних потоков не остается.
+
+    Attributes:
+        name (str): Имя модели для логов и профиля запуска
+    """
+    def __init__(self, name: str, loader: Callable[[], Any]) -> None:
+        self.name = name
+        self._future: Future = Future()
+        thread = threading.Thread(target=self._load, args=(loader,), name=f'load-{name}', daemon=True)
+        thread.start()
+
+    def _load(self, loader: Callable[[], Any]) -> None:
+        try:
+            with startup_timer.phase(f'загрузка {self.name}'):
+                model = loader()
+            self._future.set_result(model)
+            logger.info("Модель %s загружена", self.name)
+        except BaseException as e:
+            logger.error("Ошибка при загрузке модели %s: %s", self.name, e)
+            self._future.set_exception(e)
+
+    @property
+    def loaded(self) -> bool:
+        return self._future.done()
+
+    def result(self) -> Any:
+        """
+        Загруженная модель (ждет окончания загрузки).
+
+        Raises:
+            Exception: Ошибка загрузки модели
+        """
+        return self._future.result()
+
+    def __repr__(self) -> str:
+        return f"BackgroundModel({self.name}, {'загружена' if self.loaded else 'загружается'})"
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.result(), name)
@@ -1,6 +1,10 @@
-from langchain.embeddings.base import Embeddings
+from langchain_core.embeddings import Embeddings
+from typing import Optional
 from utils.mylogger import Logger
+from src.serving.cpu_scheduler import run_in_stage
+import numpy as np
 import asyncio
+import functools
 
 # Инициализация логгера для отслеживания работы с эмбеддингами
 logger = Logger('CustomEmbeddings', 'logs/rag.log')
@@ -38,7 +42,7 @@ class CustomEmbeddings(Embeddings):
                 и поддерживать русскоязычные тексты
         """
         self.model = model
-        logger.info(f"Инициализация класса CustomEmbeddings. Модель: {model}")
+        logger.info("Инициализация класса CustomEmbeddings. Модель: %s", model)
         
     async def embed_documents_async(self, texts):
         """
@@ -60,17 +64,17 @@ class CustomEmbeddings(Embeddings):
                 Все векторы нормализованы (длина = 1)
         """
         try:
-            logger.debug(f"Асинхронное создание эмбеддингов для {len(texts)} документов")
+            logger.debug("Асинхронное создание эмбеддингов для %s документов", len(texts))
             # Нормализуем эмбеддинги для улучшения качества сравнения
             embeddings = await asyncio.to_thread(
                 self.model.encode,
                 texts,
                 normalize_embeddings=True
             )
-            logger.info(f"Успешно созданы эмбеддинги для {len(texts)} документов")
+            logger.debug("Успешно созданы эмбеддинги для %s документов", len(texts))
             return embeddings.tolist()
         except Exception as e:
-            logger.error(f"Ошибка при создании эмбеддингов: {str(e)}")
+            logger.error("Ошибка при создании эмбеддингов: %s", e)
             raise
 
     def embed_documents(self, texts):
@@ -78,6 +82,42 @@ class CustomEmbeddings(Embeddings):
         Синхронная обертка для создания эмбеддингов документов
         """
         return asyncio.run(self.embed_documents_async(texts))
+
+    async def embed_documents_array_async(self, texts, stage: Optional[str] = None) -> np.ndarray:
+        """
+        Асинхронно создает эмбеддинги для списка документов в виде матрицы numpy.
+
+        В отличие от embed_documents_async не преобразует результат в списки Python,
+        что важно при индексации большого количества чанков.
+
+        Args:
+            texts (List[str]): Список текстовых документов
+            stage (Optional[str]): Этап запроса для планировщика ядер (CPUScheduler).
+                None - сборка индекса: общий пул потоков и все потоки torch
+
+        Returns:
+            np.ndarray: Матрица нормализованных эмбеддингов (float32, n x dim)
+        """
+        try:
+            logger.debug("Асинхронное создание матрицы эмбеддингов для %s документов", len(texts))
+            run = asyncio.to_thread if stage is None else functools.partial(run_in_stage, stage)
+            embeddings = await run(
+                self.model.encode,
+                texts,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            )
+            logger.debug("Успешно созданы эмбеддинги для %s документов", len(texts))
+            return np.ascontiguousarray(embeddings, dtype=np.float32)
+        except Exception as e:
+            logger.error("Ошибка при создании эмбеддингов: %s", e)
+            raise
+
+    def embed_documents_array(self, texts) -> np.ndarray:
+        """
+        Синхронная обертка для создания матрицы эмбеддингов документов
+        """
+        return asyncio.run(self.embed_documents_array_async(texts))
         
     async def embed_query_async(self, text):
         """
@@ -99,17 +139,17 @@ class CustomEmbeddings(Embeddings):
                 Вектор нормализован (длина = 1)
         """
         try:
-            logger.debug(f"Асинхронное создание эмбеддинга для запроса: {text[:100]}...")
+            logger.debug("Асинхронное создание эмбеддинга для запроса: %s...", text[:100])
             # Нормализуем эмбеддинг для согласованности с embed_documents
             embedding = await asyncio.to_thread(
                 self.model.encode,
                 text,
                 normalize_embeddings=True
             )
-            logger.info("Успешно создан эмбеддинг для запроса")
+            logger.debug("Успешно создан эмбеддинг для запроса")
             return embedding.tolist()
         except Exception as e:
-            logger.error(f"Ошибка при создании эмбеддинга для запроса: {str(e)}")
+            logger.error("Ошибка при создании эмбеддинга для запроса: %s", e)
             raise
 
     def embed_query(self, text):
@@ -1,5 +1,5 @@
 from typing import List
-from langchain.schema import Document
+from langchain_core.documents import Document
 from utils.mylogger import Logger
 from config import RAG_CONFIG
 import asyncio
@@ -12,15 +12,16 @@ class FormatContext:
     Класс для форматирования контекста для LLM.
     
     Основные функции:
-    1. Обработка и очистка текста документов
-    2. Добавление метаданных к документам
-    3. Контроль длины контекста
+    1. Добавление метаданных к документам
+    2. Нумерация документов
+    3. Контроль длины контекста (в символах и, если известны длины чанков, в токенах)
     4. Форматирование контекста в удобный для LLM формат
     
     Особенности:
     - Поддерживает ограничение длины контекста
     - Сохраняет информацию об источниках
-    - Очищает текст от лишних пробелов и переносов
+    - Не очищает текст повторно: тексты чанков нормализуются один раз
+      при загрузке (см. TextNormalizer)
     - Нумерует документы для лучшей структуры
     """
     def __init__(self, llm) -> None:
@@ -34,13 +35,26 @@ class FormatContext:
         # Максимальная длина контекста в символах (примерно 4000 токенов)
         # Значение берется из конфигурации или используется значение по умолчанию
         self.max_context_length = int(RAG_CONFIG.get("max_context_length", 16000))
+        # Лимит контекста в токенах по длинам чанков (metadata['token_count']), 0 - без лимита
+        self.max_context_tokens = int(RAG_CONFIG.get("max_context_tokens", 0))
+
+    def _exceeds_token_budget(self, doc: Document, total_tokens: int) -> bool:
+        """
+        Проверяет, превысит ли документ лимит контекста в токенах.
+
+        Длина чанка в токенах известна, если он создан сплиттером по токенам.
+        """
+        token_count = doc.metadata.get("token_count")
+        if not self.max_context_tokens or token_count is None:
+            return False
+        return total_tokens + int(token_count) > self.max_context_tokens
 
     async def format_context_async(self, documents: List[Document]) -> str:
         """
         Асинхронное форматирование контекста из списка документов.
 
         Процесс форматирования:
-        1. Проверка и очистка текста документов
+        1. Проверка входных данных
         2. Добавление метаданных (источник, страница)
         3. Контроль общей длины контекста
         4. Форматирование в удобный для LLM формат
@@ -65,10 +79,11 @@ class FormatContext:
             # Очищаем и подготавливаем тексты документов
             formatted_docs = []
             total_length = 0
+            total_tokens = 0
             
             for i, doc in enumerate(documents, 1):
-                # Очищаем текст от лишних пробелов и переносов
-                text = await asyncio.to_thread(self._clean_text, doc.page_content)
+                # Текст уже нормализован при загрузке документов
+                text = doc.page_content
                 
                 # Добавляем метаданные
                 source = doc.metadata.get("source", "Неизвестный источник")
@@ -79,19 +94,23 @@ class FormatContext:
                 
                 # Проверяем, не превысим ли лимит длины
                 if total_length + len(formatted_doc) > self.max_context_length:
-                    logger.warning(f"Достигнут лимит длины контекста ({self.max_context_length} символов)")
+                    logger.warning("Достигнут лимит длины контекста (%s символов)", self.max_context_length)
+                    break
+                if self._exceeds_token_budget(doc, total_tokens):
+                    logger.warning("Достигнут лимит длины контекста (%s токенов)", self.max_context_tokens)
                     break
                     
                 formatted_docs.append(formatted_doc)
                 total_length += len(formatted_doc)
+                total_tokens += int(doc.metadata.get("token_count", 0))
             
             # Объединяем все документы
             context = "\n".join(formatted_docs)
-            logger.info(f"Контекст успешно отформатирован, длина: {len(context)} символов")
+            logger.debug("Контекст успешно отформатирован, длина: %s символов", len(context))
             return context
             
         except Exception as e:
-            logger.error(f"Ошибка при форматировании контекста: {str(e)}")
+            logger.error("Ошибка при форматировании контекста: %s", e)
             raise
 
     def format_context(self, documents: List[Document]) -> str:
@@ -100,32 +119,17 @@ class FormatContext:
         """
         return asyncio.run(self.format_context_async(documents))
 
-    async def _clean_text_async(self, text: str) -> str:
-        """
-        Асинхронная очистка текста от лишних пробелов и переносов.
-        """
-        # Очищаем текст от лишних пробелов и переносов
-        cleaned_text = await asyncio.to_thread(
-            lambda: " ".join(text.split())
-        )
-        return cleaned_text
-
-    def _clean_text(self, text: str) -> str:
-        """
-        Синхронная обертка для очистки текста
-        """
-        return asyncio.run(self._clean_text_async(text))
-
     def format_context(self, docs: List[Document]) -> str:
         """
         Форматирование контекста из документов для LLM.
 
         Процесс форматирования:
         1. Проверка входных данных
-        2. Очистка текста документов
-        3. Добавление метаданных (источник, страница)
-        4. Контроль общей длины контекста
-        5. Объединение документов в единый контекст
+        2. Добавление метаданных (источник, страница)
+        3. Контроль общей длины контекста
+        4. Объединение документов в единый контекст
+
+        Тексты документов не очищаются повторно: они нормализованы при загрузке.
 
         Формат вывода:
         Документ 1 [Источник: имя_файла, Страница: номер]:
@@ -157,10 +161,8 @@ class FormatContext:
             try:
                 context_parts = []
                 total_length = 0
+                total_tokens = 0
                 for i, doc in enumerate(docs, 1):
-                    # Очищаем текст от лишних пробелов и переносов строк
-                    cleaned_text = ' '.join(doc.page_content.split())
-                    
                     # Добавляем метаданные, если они есть
                     metadata_str = ""
                     if doc.metadata:
@@ -172,23 +174,27 @@ class FormatContext:
                         metadata_str += "]"
                         
                     # Форматируем часть контекста с номером и метаданными
-                    context_part = f"Документ {i}{metadata_str}:\n{cleaned_text}\n"
+                    context_part = f"Документ {i}{metadata_str}:\n{doc.page_content}\n"
                     
                     # Проверяем, не превысит ли добавление этой части максимальную длину
                     if total_length + len(context_part) > self.max_context_length:
-                        logger.warning(f"Достигнута максимальная длина контекста ({self.max_context_length} символов)")
+                        logger.warning("Достигнута максимальная длина контекста (%s символов)", self.max_context_length)
+                        break
+                    if self._exceeds_token_budget(doc, total_tokens):
+                        logger.warning("Достигнута максимальная длина контекста (%s токенов)", self.max_context_tokens)
                         break
                         
                     context_parts.append(context_part)
                     total_length += len(context_part)
+                    total_tokens += int(doc.metadata.get("token_count", 0))
                     
                 # Объединяем все части в единый контекст
                 context = "\n".join(context_parts)
-                logger.info(f"Контекст успешно отформатирован, длина: {len(context)} символов")
+                logger.debug("Контекст успешно отформатирован, длина: %s символов", len(context))
                 return context
             except Exception as e:
-                logger.error(f"Ошибка при форматировании контекста: {str(e)}")
+                logger.error("Ошибка при форматировании контекста: %s", e)
                 raise
         except Exception as e:
-            logger.error(f"Критическая ошибка при форматировании контекста: {str(e)}")
+            logger.error("Критическая ошибка при форматировании контекста: %s", e)
             raise
\ No newline at end of file
@@ -32,15 +32,15 @@ class CheckDirExists:
             bool: True если директория существует, False в противном случае
         """
         try:
-            logger.debug(f"Проверка существования директории: {dir_path}")
+            logger.debug("Проверка существования директории: %s", dir_path)
             exists = await asyncio.to_thread(os.path.exists, dir_path)
             if not exists:
-                logger.error(f"Директория не существует: {dir_path}")
+                logger.error("Директория не существует: %s", dir_path)
                 return False
-            logger.info(f"Директория существует: {dir_path}")
+            logger.info("Директория существует: %s", dir_path)
             return True
         except Exception as e:
-            logger.error(f"Ошибка при проверке директории {dir_path}: {str(e)}")
+            logger.error("Ошибка при проверке директории %s: %s", dir_path, e)
             return False
 
     def check_dir_exists(self, dir_path: str) -> bool:
@@ -60,15 +60,15 @@ class CheckDirExists:
             bool: True если есть права на чтение, False в противном случае
         """
         try:
-            logger.debug(f"Проверка прав доступа к директории: {dir_path}")
+            logger.debug("Проверка прав доступа к директории: %s", dir_path)
             has_access = await asyncio.to_thread(os.access, dir_path, os.R_OK)
             if not has_access:
-                logger.error(f"Нет прав на чтение директории: {dir_path}")
+                logger.error("Нет прав на чтение директории: %s", dir_path)
                 return False
-            logger.info(f"Есть права на чтение директории: {dir_path}")
+            logger.info("Есть права на чтение директории: %s", dir_path)
             return True
         except Exception as e:
-            logger.error(f"Ошибка при проверке прав доступа к директории {dir_path}: {str(e)}")
+            logger.error("Ошибка при проверке прав доступа к директории %s: %s", dir_path, e)
             return False
 
     def check_dir_access(self, dir_path: str) -> bool:
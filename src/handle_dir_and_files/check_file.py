@@ -32,15 +32,15 @@ class CheckFile:
             bool: True если файл существует, False в противном случае
         """
         try:
-            logger.debug(f"Проверка существования файла: {file_path}")
+            logger.debug("Проверка существования файла: %s", file_path)
             exists = await asyncio.to_thread(os.path.exists, file_path)
             if not exists:
-                logger.error(f"Файл не существует: {file_path}")
+                logger.error("Файл не существует: %s", file_path)
                 return False
-            logger.info(f"Файл существует: {file_path}")
+            logger.info("Файл существует: %s", file_path)
             return True
         except Exception as e:
-            logger.error(f"Ошибка при проверке файла {file_path}: {str(e)}")
+            logger.error("Ошибка при проверке файла %s: %s", file_path, e)
             return False
 
     def check_file_exists(self, file_path: str) -> bool:
@@ -60,15 +60,15 @@ class CheckFile:
             bool: True если есть права на чтение, False в противном случае
         """
         try:
-            logger.debug(f"Проверка прав доступа к файлу: {file_path}")
+            logger.debug("Проверка прав доступа к файлу: %s", file_path)
             has_access = await asyncio.to_thread(os.access, file_path, os.R_OK)
             if not has_access:
-                logger.error(f"Нет прав на чтение файла: {file_path}")
+                logger.error("Нет прав на чтение файла: %s", file_path)
                 return False
-            logger.info(f"Есть права на чтение файла: {file_path}")
+            logger.info("Есть права на чтение файла: %s", file_path)
             return True
         except Exception as e:
-            logger.error(f"Ошибка при проверке прав доступа к файлу {file_path}: {str(e)}")
+            logger.error("Ошибка при проверке прав доступа к файлу %s: %s", file_path, e)
             return False
 
     def check_file_access(self, file_path: str) -> bool:
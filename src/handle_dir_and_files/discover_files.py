@@ -0,0 +1,309 @@
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import fnmatch
+import glob
+import os
+import re
+import time
+
+from utils.mylogger import Logger
+
+logger = Logger('FileDiscovery', 'logs/rag.log')
+
+
+class DiscoveredFile(NamedTuple):
+    """
+    Найденный файл и результат stat, полученный при обходе директории.
+    """
+    path: str
+    stat: os.stat_result
+
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+
+    @property
+    def mtime_ns(self) -> int:
+        return self.stat.st_mtime_ns
+
+
+def _compile_patterns(patterns: Iterable[str]) -> Optional[re.Pattern]:
+    """
+    Объединяет glob-паттерны в одно регулярное выражение без учета регистра.
+    """
+    patterns = [p.replace('\\', '/') for p in patterns if p]
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(p)})' for p in patterns), re.IGNORECASE)
+
+
+def _translate_path_glob(pattern: str) -> str:
+    """
+    Переводит glob-паттерн пути в регулярное выражение.
+
+    В отличие от fnmatch.translate, * и ? не пересекают '/', а '**/' означает
+    любое количество директорий, в том числе ни одной ('**' в конце - любой путь).
+    """
+    result = []
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern.startswith('**/', i):
+            result.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            result.append('.*')
+            i += 2
+            continue
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            result.append('[^/]*')
+        elif c == '?':
+            result.append('[^/]')
+        elif c == '[':
+            # ']' сразу после '[' или '[!' входит в класс символов
+            j = i + 1 if pattern[i:i + 1] == '!' else i
+            j = pattern.find(']', j + 1)
+            if j < 0:
+                result.append('\\[')
+                continue
+            chars = pattern[i:j].replace('\\', '\\\\')
+            i = j + 1
+            result.append(f"[^{chars[1:]}]" if chars.startswith('!') else f"[{chars}]")
+        else:
+            result.append(re.escape(c))
+    return f"(?s:{''.join(result)})\\Z"
+
+
+class _Root(NamedTuple):
+    """
+    Корень обхода: ключ для путей найденных файлов, паттерн файлов и состояние обхода.
+
+    Attributes:
+        key (str): Абсолютный путь директории обхода
+        include (Optional[re.Pattern]): Паттерн файлов корня
+        path_only (bool): Сопоставлять паттерн только с путем относительно корня (glob-корни)
+        max_depth (Optional[int]): Глубина вложенных директорий для обхода (None - без ограничения)
+        visited (Set[Tuple[int, int]]): Пройденные директории (st_dev, st_ino) при переходе по ссылкам
+    """
+    key: str
+    include: Optional[re.Pattern]
+    path_only: bool
+    max_depth: Optional[int]
+    visited: Set[Tuple[int, int]]
+
+
+class FileDiscovery:
+    """
+    Поиск файлов для загрузки за один проход os.scandir по всем корням.
+
+    В отличие от os.walk с отдельными проверками доступа для каждого файла:
+    - обходятся все переданные корни (директории, файлы или glob-паттерны)
+    - директории читаются параллельно в пуле потоков, что важно для сетевых папок,
+      где каждое чтение директории - это сетевой запрос
+    - тип записи берется из результата scandir, stat выполняется только для файлов,
+      прошедших фильтр по имени, и возвращается вместе с путем
+    - паттерны include/exclude сопоставляются с именем файла и с путем относительно корня;
+      исключенные директории не обходятся
+    - glob-корни ("docs/*.pdf", "docs/**/*.pdf") сопоставляются только с путем
+      относительно своей директории: * не пересекает '/', вложенные директории
+      обходятся только для '**' или паттерна с директориями
+    - при переходе по символическим ссылкам каждая директория обходится один раз,
+      поэтому циклы ссылок не приводят к бесконечному обходу
+    - файлы вне диапазона размеров [min_size, max_size] пропускаются
+    Недоступные директории и файлы пропускаются с предупреждением в логе.
+
+    Attributes:
+        include (Tuple[str]): Паттерны файлов для загрузки
+        exclude (Tuple[str]): Паттерны исключаемых файлов и директорий
+        min_size (int): Минимальный размер файла в байтах
+        max_size (Optional[int]): Максимальный размер файла в байтах (None - без ограничения)
+        follow_symlinks (bool): Переходить ли по символическим ссылкам
+        max_workers (int): Количество потоков для чтения директорий
+    """
+    def __init__(self,
+                 include: Sequence[str] = ('*.pdf', '*.txt', '*.docx'),
+                 exclude: Sequence[str] = (),
+                 min_size: int = 1,
+                 max_size: Optional[int] = None,
+                 follow_symlinks: bool = False,
+                 max_workers: int = 8) -> None:
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.follow_symlinks = follow_symlinks
+        self.max_workers = max(1, max_workers)
+        self._include = _compile_patterns(self.include)
+        self._exclude = _compile_patterns(self.exclude)
+
+    @staticmethod
+    def _matches(pattern: Optional[re.Pattern], name: str, relative: str, path_only: bool = False) -> bool:
+        if pattern is None:
+            return False
+        if path_only:
+            return pattern.match(f'{relative}/{name}' if relative else name) is not None
+        if pattern.match(name) is not None:
+            return True
+        # Относительный путь нужен только для паттернов с директориями
+        return bool(relative) and pattern.match(f'{relative}/{name}') is not None
+
+    def _accept_size(self, size: int) -> bool:
+        return size >= self.min_size and (self.max_size is None or size <= self.max_size)
+
+    def _dir_id(self, path: str) -> Optional[Tuple[int, int]]:
+        """
+        Идентификатор директории для обнаружения циклов ссылок (только при follow_symlinks).
+        """
+        if not self.follow_symlinks:
+            return None
+        stat = os.stat(path)
+        return stat.st_dev, stat.st_ino
+
+    def _scan_dir(self, path: str, relative: str, root: _Root):
+        """
+        Читает одну директорию.
+
+        Returns:
+            Tuple[List[Tuple[str, DiscoveredFile]], List[Tuple[str, str, Optional[Tuple[int, int]]]], int]:
+                Найденные файлы с относительными путями, поддиректории (путь,
+                относительный путь, идентификатор директории) и количество пропущенных файлов
+        """
+        files: List[Tuple[str, DiscoveredFile]] = []
+        subdirs: List[Tuple[str, str, Optional[Tuple[int, int]]]] = []
+        skipped = 0
+        # Глубина поддиректорий этой директории
+        depth = relative.count('/') + 1 if relative else 1
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                            if root.max_depth is not None and depth > root.max_depth:
+                                continue
+                            if not self._matches(self._exclude, name, relative):
+                                subdirs.append((entry.path, f'{relative}/{name}' if relative else name,
+                                                self._dir_id(entry.path)))
+                            continue
+                        if not entry.is_file(follow_symlinks=self.follow_symlinks):
+                            continue
+                        if not self._matches(root.include, name, relative, root.path_only):
+                            continue
+                        if self._matches(self._exclude, name, relative):
+                            skipped += 1
+                            continue
+                        stat = entry.stat(follow_symlinks=self.follow_symlinks)
+                    except OSError as e:
+                        logger.warning("Пропускаем недоступный путь %s: %s", entry.path, e)
+                        skipped += 1
+                        continue
+                    if self._accept_size(stat.st_size):
+                        files.append((f'{relative}/{name}' if relative else name, DiscoveredFile(entry.path, stat)))
+                    else:
+                        skipped += 1
+        except OSError as e:
+            logger.warning("Пропускаем недоступную директорию %s: %s", path, e)
+        return files, subdirs, skipped
+
+    def _resolve_root(self, root: str) -> Tuple[str, Optional[re.Pattern], bool, Optional[int]]:
+        """
+        Разделяет корень на директорию обхода и паттерн файлов.
+
+        Для glob-паттерна ("docs/**/*.pdf") обход начинается с его части без
+        спецсимволов, а сам паттерн заменяет include и сопоставляется с путем
+        относительно этой части. Без '**' глубина обхода ограничена
+        количеством директорий в паттерне.
+
+        Returns:
+            Tuple[str, Optional[re.Pattern], bool, Optional[int]]: Директория обхода,
+                паттерн файлов, признак glob-корня и глубина обхода
+        """
+        if not glob.has_magic(root):
+            return root, self._include, False, None
+        parts = root.replace('\\', '/').split('/')
+        prefix = []
+        for part in parts:
+            if glob.has_magic(part):
+                break
+            prefix.append(part)
+        base = '/'.join(prefix) or '.'
+        pattern = '/'.join(parts[len(prefix):])
+        max_depth = None if '**' in pattern else pattern.count('/')
+        return base, re.compile(_translate_path_glob(pattern), re.IGNORECASE), True, max_depth
+
+    def discover(self, roots: Sequence[str]) -> List[DiscoveredFile]:
+        """
+        Находит файлы во всех корнях.
+
+        Args:
+            roots (Sequence[str]): Директории, пути к файлам или glob-паттерны
+
+        Returns:
+            List[DiscoveredFile]: Найденные файлы без повторов, отсортированные по пути
+        """
+        started = time.perf_counter()
+        found = {}
+        skipped = 0
+        directories = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Для каждой задачи хранится ее корень: ключ, паттерн файлов и пройденные директории
+            pending = {}
+            for root in roots:
+                base, include, path_only, max_depth = self._resolve_root(root)
+                if os.path.isfile(base):
+                    try:
+                        stat = os.stat(base)
+                    except OSError as e:
+                        logger.warning("Пропускаем недоступный файл %s: %s", base, e)
+                        continue
+                    if self._accept_size(stat.st_size):
+                        found.setdefault(os.path.normcase(os.path.abspath(base)), DiscoveredFile(base, stat))
+                    continue
+                if not os.path.isdir(base):
+                    logger.warning("Пропускаем корень %s: путь не существует", root)
+                    continue
+                # Ключ файла - абсолютный путь корня и относительный путь, чтобы файлы
+                # пересекающихся корней не загружались дважды
+                scan_root = _Root(os.path.normcase(os.path.abspath(base)), include, path_only, max_depth, set())
+                try:
+                    dir_id = self._dir_id(base)
+                except OSError as e:
+                    logger.warning("Пропускаем недоступную директорию %s: %s", base, e)
+                    continue
+                if dir_id is not None:
+                    scan_root.visited.add(dir_id)
+                pending[executor.submit(self._scan_dir, base, '', scan_root)] = scan_root
+                directories += 1
+
+            # Все корни обходятся параллельно
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    scan_root = pending.pop(future)
+                    files, subdirs, dir_skipped = future.result()
+                    skipped += dir_skipped
+                    for relative, file in files:
+                        found.setdefault(scan_root.key + os.sep + relative.replace('/', os.sep), file)
+                    for path, relative, dir_id in subdirs:
+                        if dir_id is not None:
+                            # Директория уже пройдена по другому пути (цикл символических ссылок)
+                            if dir_id in scan_root.visited:
+                                continue
+                            scan_root.visited.add(dir_id)
+                        pending[executor.submit(self._scan_dir, path, relative, scan_root)] = scan_root
+                        directories += 1
+
+        result = sorted(found.values(), key=lambda file: file.path)
+        logger.info("Поиск файлов завершен за %.2f с: "
+                    "найдено %s, пропущено %s, просмотрено директорий %s",
+                    time.perf_counter() - started, len(result), skipped, directories)
+        return result
+
+    async def discover_async(self, roots: Sequence[str]) -> List[DiscoveredFile]:
+        """
+        Асинхронная обертка: обход выполняется в отдельном потоке, не блокируя цикл событий.
+        """
+        return await asyncio.to_thread(self.discover, roots)
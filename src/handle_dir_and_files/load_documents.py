@@ -1,4 +1,4 @@
-from typing import List
+from typing import Iterator, List, Tuple
 import os
 import asyncio
 import aiofiles
@@ -6,8 +6,10 @@ from langchain_core.documents import Document
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
 
 from utils.mylogger import Logger
-from src.handle_dir_and_files.check_dir import CheckDirExists
-from src.handle_dir_and_files.check_file import CheckFile
+from src.handle_dir_and_files.discover_files import DiscoveredFile, FileDiscovery
+from src.handle_dir_and_files.text_cache import ExtractedTextCache, loader_version
+from src.monitoring.tracing import span
+from config import RAG_CONFIG
 
 logger = Logger('LoadDocuments', 'logs/rag.log')
 
@@ -17,27 +19,43 @@ class LoadDocuments:
     
     Этот класс предоставляет функциональность для:
     - Загрузки документов из PDF, TXT и DOCX файлов
-    - Проверки существования и доступа к файлам и директориям
+    - Поиска файлов во всех переданных корнях за один проход os.scandir
+      с фильтрами include/exclude и ограничением размера (FileDiscovery)
     - Фильтрации неподдерживаемых форматов
+    - Кэширования извлеченного текста PDF и DOCX на диске (ExtractedTextCache)
     - Обработки ошибок при загрузке документов
     
     Attributes:
-        file_patterns (List[str]): Список паттернов для поиска файлов
-        check_dir (CheckDirExists): Объект для проверки директорий
-        check_file (CheckFile): Объект для проверки файлов
+        file_patterns (List[str]): Список директорий, файлов или glob-паттернов для поиска файлов
+        discovery (FileDiscovery): Объект для поиска файлов
+        discovered_files (List[DiscoveredFile]): Найденные файлы с результатами stat
+        text_cache (Optional[ExtractedTextCache]): Кэш извлеченного текста
     """
     def __init__(self, file_patterns: List[str]) -> None:
         """
         Инициализация класса LoadDocuments.
         
         Args:
-            file_patterns (List[str]): Список паттернов для поиска файлов
+            file_patterns (List[str]): Список директорий, файлов или glob-паттернов для поиска файлов
         """
         logger.info("Инициализация класса LoadDocuments")
         self.file_patterns = file_patterns
-        logger.debug(f"Получены паттерны для поиска файлов: {file_patterns}")
-        self.check_dir = CheckDirExists()
-        self.check_file = CheckFile()
+        logger.debug("Получены паттерны для поиска файлов: %s", file_patterns)
+        config = RAG_CONFIG["discovery"]
+        self.discovery = FileDiscovery(
+            include=config["include"],
+            exclude=config["exclude"],
+            min_size=config["min_size"],
+            max_size=config["max_size_mb"] * 1024 * 1024 or None,
+            follow_symlinks=config["follow_symlinks"],
+            max_workers=config["workers"]
+        )
+        self.discovered_files: List[DiscoveredFile] = []
+        self._stats = {}
+        cache_config = RAG_CONFIG["text_cache"]
+        self.text_cache = None
+        if cache_config["enabled"]:
+            self.text_cache = ExtractedTextCache(cache_config["dir"], cache_config["max_mb"] * 1024 * 1024)
 
     def _get_supported_formats(self) -> List[str]:
         """
@@ -65,50 +83,154 @@ class LoadDocuments:
             
         supported_formats = self._get_supported_formats()
         is_supported = any(file_path.lower().endswith(fmt) for fmt in supported_formats)
-        logger.debug(f"Проверка формата файла {file_path}: {'поддерживается' if is_supported else 'не поддерживается'}")
+        logger.debug("Проверка формата файла %s: %s", file_path, 'поддерживается' if is_supported else 'не поддерживается')
         return is_supported
 
+    def _create_loader(self, file_path: str):
+        """
+        Создает загрузчик LangChain для файла по его расширению.
+
+        Returns:
+            Загрузчик или None, если формат не поддерживается
+        """
+        if file_path.lower().endswith('.pdf'):
+            logger.debug("Загрузка PDF файла: %s", file_path)
+            return PyPDFLoader(file_path)
+        if file_path.lower().endswith('.txt'):
+            logger.debug("Загрузка TXT файла: %s", file_path)
+            return TextLoader(file_path)
+        if file_path.lower().endswith('.docx'):
+            logger.debug("Загрузка DOCX файла: %s", file_path)
+            return Docx2txtLoader(file_path)
+        logger.warning("Неподдерживаемый формат файла: %s", file_path)
+        return None
+
+    def _iter_pages(self, file_path: str, loader) -> Iterator[Document]:
+        """
+        Возвращает страницы файла из кэша или от загрузчика с записью в кэш.
+
+        TXT файлы не кэшируются: их чтение не дороже чтения записи кэша.
+        """
+        if self.text_cache is None or isinstance(loader, TextLoader):
+            return loader.lazy_load()
+        stat = self._stats.get(file_path)
+        key = self.text_cache.key(file_path, loader_version(type(loader).__name__), stat)
+        cached = self.text_cache.get(key, file_path)
+        if cached is not None:
+            logger.debug("Текст файла %s взят из кэша", file_path)
+            return cached
+        return self.text_cache.put(key, loader.lazy_load())
+
     async def _load_single_document(self, file_path: str) -> List[Document]:
         """
         Асинхронно загружает один документ.
         """
         try:
-            if file_path.lower().endswith('.pdf'):
-                logger.debug(f"Загрузка PDF файла: {file_path}")
-                loader = PyPDFLoader(file_path)
-            elif file_path.lower().endswith('.txt'):
-                logger.debug(f"Загрузка TXT файла: {file_path}")
-                loader = TextLoader(file_path)
-            elif file_path.lower().endswith('.docx'):
-                logger.debug(f"Загрузка DOCX файла: {file_path}")
-                loader = Docx2txtLoader(file_path)
-            else:
-                logger.warning(f"Неподдерживаемый формат файла: {file_path}")
+            loader = self._create_loader(file_path)
+            if loader is None:
                 return []
 
-            # Загружаем документ
-            docs = loader.load()
+            # Загружаем документ (при наличии записи в кэше загрузчик не вызывается)
+            docs = list(self._iter_pages(file_path, loader))
             if docs:
-                logger.info(f"Успешно загружен файл: {file_path}")
+                logger.info("Успешно загружен файл: %s", file_path)
                 return docs
             else:
-                logger.warning(f"Файл не содержит текста: {file_path}")
+                logger.warning("Файл не содержит текста: %s", file_path)
                 return []
 
         except Exception as e:
-            logger.error(f"Ошибка при загрузке файла {file_path}: {str(e)}")
+            logger.error("Ошибка при загрузке файла %s: %s", file_path, e)
             return []
 
+    def _select_files(self, discovered_files: List[DiscoveredFile]) -> Tuple[List[str], int]:
+        """
+        Сохраняет результаты поиска файлов и отбирает файлы поддерживаемых форматов.
+
+        Returns:
+            Tuple[List[str], int]: Пути файлов для загрузки и количество пропущенных файлов
+
+        Raises:
+            FileNotFoundError: Если не найдено ни одного файла для загрузки
+        """
+        # Результаты stat сохраняются для следующих этапов
+        self.discovered_files = discovered_files
+        self._stats = {file.path: file.stat for file in discovered_files}
+        # Паттерны include могут быть шире списка форматов, для которых есть загрузчики
+        supported_formats = self._get_supported_formats()
+        files_to_load = [file.path for file in discovered_files
+                         if os.path.splitext(file.path)[1].lower() in supported_formats]
+        if not files_to_load:
+            error_msg = "Не найдено файлов для загрузки"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+        return files_to_load, len(discovered_files) - len(files_to_load)
+
+    def iter_documents(self) -> Iterator[Document]:
+        """
+        Лениво загружает документы постранично.
+
+        В отличие от load_documents, страницы не накапливаются в списке: загрузчик
+        каждого файла читается через lazy_load, и очередная страница PDF извлекается
+        только когда предыдущая обработана. Поэтому в памяти находятся несколько
+        страниц, а не весь документ. Страницы одного файла идут подряд.
+
+        Yields:
+            Document: Очередная страница (или весь текст для TXT и DOCX)
+
+        Raises:
+            ValueError: Если список паттернов пуст
+            FileNotFoundError: Если не найдено ни одного файла или ни одной страницы
+        """
+        logger.info("Начало потоковой загрузки документов")
+        if not self.file_patterns:
+            error_msg = "Список паттернов файлов не может быть пустым"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        files_to_load, skipped_files = self._select_files(self.discovery.discover(self.file_patterns))
+        loaded_files = 0
+        pages = 0
+        for file_path in files_to_load:
+            loader = self._create_loader(file_path)
+            if loader is None:
+                skipped_files += 1
+                continue
+            file_pages = 0
+            try:
+                for page in self._iter_pages(file_path, loader):
+                    file_pages += 1
+                    yield page
+            except Exception as e:
+                # Уже выданные страницы файла остаются в индексе, остальные пропускаются
+                logger.error("Ошибка при загрузке файла %s (страница %s): %s", file_path, file_pages + 1, e)
+            if file_pages:
+                loaded_files += 1
+                pages += file_pages
+                logger.debug("Успешно загружен файл: %s, страниц: %s", file_path, file_pages)
+            else:
+                logger.warning("Файл не содержит текста: %s", file_path)
+                skipped_files += 1
+
+        if self.text_cache is not None:
+            self.text_cache.save_index()
+        if not pages:
+            error_msg = "Не удалось загрузить ни одного документа"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+        logger.info("Потоковая загрузка завершена. Загружено: %s (%s страниц), "
+                    "пропущено: %s", loaded_files, pages, skipped_files)
+
     async def load_documents_async(self) -> List[Document]:
         """
         Асинхронная загрузка документов из указанных файловых паттернов.
 
         Процесс загрузки:
-        1. Проверка существования и доступа к директории
-        2. Рекурсивный поиск файлов с поддерживаемыми расширениями
-        3. Проверка прав доступа к каждому файлу
-        4. Загрузка документов в зависимости от формата
-        5. Обработка ошибок при загрузке
+        1. Поиск файлов во всех корнях за один проход os.scandir
+           (недоступные директории и файлы пропускаются)
+        2. Отбор файлов с поддерживаемыми расширениями
+        3. Загрузка документов в зависимости от формата
+        4. Обработка ошибок при загрузке
 
         Returns:
             List[Document]: Список загруженных документов
@@ -130,63 +252,35 @@ class LoadDocuments:
         skipped_files = 0
         
         try:
-            # Получаем базовую директорию из первого паттерна
-            base_dir = self.file_patterns[0]
-            logger.debug(f"Базовая директория для поиска: {base_dir}")
-            
-            # Проверяем существование и доступ к директории
-            if not self.check_dir.check_dir_exists(base_dir):
-                logger.warning(f"Пропускаем директорию {base_dir}: директория не существует")
-                return documents
-                
-            if not self.check_dir.check_dir_access(base_dir):
-                logger.warning(f"Пропускаем директорию {base_dir}: нет доступа к директории")
-                return documents
-                
-            # Получаем список поддерживаемых расширений
-            supported_formats = self._get_supported_formats()
-            
-            # Собираем все файлы для загрузки
-            files_to_load = []
-            for root, _, files in os.walk(base_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_ext = os.path.splitext(file_path)[1].lower()
-                    
-                    if file_ext in supported_formats:
-                        if self.check_file.check_file_access(file_path):
-                            files_to_load.append(file_path)
-                        else:
-                            logger.warning(f"Пропускаем файл без прав доступа: {file_path}")
-                            skipped_files += 1
-
-            if not files_to_load:
-                error_msg = "Не найдено файлов для загрузки"
-                logger.error(error_msg)
-                raise FileNotFoundError(error_msg)
+            with span('load') as load_span:
+                files_to_load, skipped_files = self._select_files(await self.discovery.discover_async(self.file_patterns))
 
-            # Асинхронно загружаем все документы
-            tasks = [self._load_single_document(file_path) for file_path in files_to_load]
-            results = await asyncio.gather(*tasks)
-            
-            # Объединяем результаты
-            for docs in results:
-                if docs:
-                    documents.extend(docs)
-                    loaded_files += 1
-                else:
-                    skipped_files += 1
+                # Асинхронно загружаем все документы
+                tasks = [self._load_single_document(file_path) for file_path in files_to_load]
+                results = await asyncio.gather(*tasks)
+
+                if self.text_cache is not None:
+                    self.text_cache.save_index()
+
+                # Объединяем результаты
+                for docs in results:
+                    if docs:
+                        documents.extend(docs)
+                        loaded_files += 1
+                    else:
+                        skipped_files += 1
+                load_span.set(files=loaded_files, skipped=skipped_files, documents=len(documents))
 
             if not documents:
                 error_msg = "Не удалось загрузить ни одного документа"
                 logger.error(error_msg)
                 raise FileNotFoundError(error_msg)
 
-            logger.info(f"Асинхронная загрузка завершена. Загружено: {loaded_files}, пропущено: {skipped_files}")
+            logger.info("Асинхронная загрузка завершена. Загружено: %s, пропущено: %s", loaded_files, skipped_files)
             return documents
 
         except Exception as e:
-            logger.error(f"Критическая ошибка при асинхронной загрузке документов: {str(e)}")
+            logger.error("Критическая ошибка при асинхронной загрузке документов: %s", e)
             raise
 
     def load_documents(self) -> List[Document]:
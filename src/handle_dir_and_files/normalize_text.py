@@ -0,0 +1,141 @@
+from typing import Dict, Iterable, List, Optional, Set
+from collections import Counter
+import re
+
+from utils.mylogger import Logger
+
+logger = Logger('TextNormalizer', 'logs/rag.log')
+
+# Невидимые символы, которые PDF-экстракторы оставляют в тексте
+INVISIBLE_CHARS = dict.fromkeys(map(ord, '\u00ad\u200b\u200c\u200d\u2060\ufeff'), None)
+# Строки, состоящие только из номера страницы: "12", "- 12 -", "Страница 3 из 10", "Page 3 of 10"
+PAGE_NUMBER_LINE = re.compile(r"^(?:[-–—\s]*\d+[-–—\s]*|(?:стр\.?|страница|page)\s*\d+(?:\s*(?:из|of)\s*\d+)?)$",
+                              re.IGNORECASE)
+DIGITS = re.compile(r"\d+")
+
+
+class TextNormalizer:
+    """
+    Нормализация текста документов с сохранением структуры.
+
+    В отличие от ' '.join(text.split()), сохраняет границы абзацев и строк,
+    чтобы разделители сплиттера ("\\n\\n", "\\n") продолжали работать.
+    За один проход по строкам текста:
+    - схлопывает пробельные символы внутри строки в один пробел
+    - удаляет невидимые символы (мягкие переносы, нулевой ширины)
+    - склеивает слова, разорванные переносом в конце строки ("сло-\\nво" -> "слово")
+    - сводит любое количество пустых строк к одной границе абзаца
+    - удаляет номера страниц в первой и последней строке и повторяющиеся колонтитулы
+
+    Нормализация выполняется один раз при загрузке, поэтому на этапе
+    форматирования контекста повторная очистка текста не требуется.
+    """
+    def __init__(self, header_footer_lines: int = 1, header_footer_ratio: float = 0.5) -> None:
+        """
+        Инициализация нормализатора.
+
+        Args:
+            header_footer_lines (int): Сколько первых и последних строк страницы
+                проверяется на колонтитулы
+            header_footer_ratio (float): Доля страниц документа, на которых строка должна
+                повторяться, чтобы считаться колонтитулом
+        """
+        self.header_footer_lines = header_footer_lines
+        self.header_footer_ratio = header_footer_ratio
+
+    @staticmethod
+    def _line_key(line: str) -> str:
+        """
+        Ключ строки для сравнения колонтитулов: номера страниц заменяются на "#".
+        """
+        return DIGITS.sub('#', ' '.join(line.split()).lower())
+
+    def detect_repeated_lines(self, pages: Iterable[str]) -> Set[str]:
+        """
+        Находит колонтитулы - строки, повторяющиеся в начале или конце большинства страниц.
+
+        Args:
+            pages (Iterable[str]): Тексты страниц одного документа
+
+        Returns:
+            Set[str]: Ключи строк-колонтитулов (см. _line_key)
+        """
+        counts: Counter = Counter()
+        n_pages = 0
+        for page in pages:
+            n_pages += 1
+            lines = [line for line in page.splitlines() if line.strip()]
+            # На коротких страницах края совпадают с основным текстом
+            if len(lines) <= 2 * self.header_footer_lines:
+                continue
+            edge = lines[:self.header_footer_lines] + lines[-self.header_footer_lines:]
+            counts.update({self._line_key(line) for line in edge})
+        if n_pages < 3:
+            return set()
+        threshold = max(3, int(n_pages * self.header_footer_ratio))
+        return {key for key, count in counts.items() if count >= threshold and key}
+
+    def normalize(self, text: str, repeated_lines: Optional[Set[str]] = None) -> str:
+        """
+        Нормализует текст за один проход по строкам.
+
+        Args:
+            text (str): Исходный текст страницы или документа
+            repeated_lines (Optional[Set[str]]): Ключи колонтитулов, которые нужно удалить
+
+        Returns:
+            str: Нормализованный текст с сохраненными границами строк и абзацев
+        """
+        lines: List[str] = []
+        blank = False
+        for raw_line in text.translate(INVISIBLE_CHARS).splitlines():
+            line = ' '.join(raw_line.split())
+            if not line:
+                blank = True
+                continue
+            if repeated_lines and self._line_key(line) in repeated_lines:
+                continue
+            if lines and not blank:
+                previous = lines[-1]
+                # Перенос слова: предыдущая строка заканчивается "буква-", текущая начинается со строчной буквы
+                if (len(previous) > 1 and previous[-1] == '-' and previous[-2].isalpha()
+                        and line[0].isalpha() and line[0].islower()):
+                    lines[-1] = previous[:-1] + line
+                    continue
+            if blank and lines:
+                lines.append('')
+            lines.append(line)
+            blank = False
+
+        # Номер страницы может стоять только в первой или последней строке страницы
+        if lines and PAGE_NUMBER_LINE.match(lines[-1]):
+            lines.pop()
+        if lines and PAGE_NUMBER_LINE.match(lines[0]):
+            lines.pop(0)
+        while lines and not lines[0]:
+            lines.pop(0)
+        while lines and not lines[-1]:
+            lines.pop()
+        return '\n'.join(lines)
+
+    def repeated_lines_by_source(self, documents) -> Dict[str, Set[str]]:
+        """
+        Находит колонтитулы для каждого источника по его страницам.
+
+        Args:
+            documents: Документы (страницы) с метаданными source
+
+        Returns:
+            Dict[str, Set[str]]: Ключи колонтитулов для каждого источника
+        """
+        pages_by_source: Dict[str, List[str]] = {}
+        for doc in documents:
+            source = doc.metadata.get('source', 'unknown')
+            pages_by_source.setdefault(source, []).append(doc.page_content)
+        repeated = {}
+        for source, pages in pages_by_source.items():
+            lines = self.detect_repeated_lines(pages)
+            if lines:
+                logger.debug("Найдены колонтитулы в %s: %s", source, len(lines))
+                repeated[source] = lines
+        return repeated
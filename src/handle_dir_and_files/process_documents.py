@@ -1,7 +1,9 @@
 from langchain_core.documents import Document
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Set
 import asyncio
 from utils.mylogger import Logger
+from src.handle_dir_and_files.normalize_text import TextNormalizer
+from src.monitoring.tracing import span
 
 logger = Logger('ProcessDocuments', 'logs/rag.log')
 
@@ -11,27 +13,40 @@ class ProcessDocuments:
     
     Этот класс предоставляет функциональность для:
     - Валидации содержимого документов
-    - Очистки текста от лишних пробелов и переносов строк
+    - Нормализации текста с сохранением границ абзацев и строк
+      (схлопывание пробелов внутри строк, склейка переносов, удаление колонтитулов)
     - Фильтрации документов с недостаточным количеством текста
     - Сохранения метаданных документов
     
+    Документы обрабатываются либо списком (process_documents_async), либо
+    потоком страниц (iter_processed), без загрузки документа целиком в память.
+
     Attributes:
         documents (List[Document]): Список документов для обработки
     """
-    def __init__(self, documents: List[Document]) -> None:
+    def __init__(self, documents: Optional[List[Document]] = None) -> None:
         """
         Инициализация класса ProcessDocuments.
         
         Args:
-            documents (List[Document]): Список документов для обработки
+            documents (Optional[List[Document]]): Список документов для обработки
+                (не нужен при потоковой обработке через iter_processed)
         """
         logger.info("Инициализация класса ProcessDocuments")
-        self.documents = documents
-        logger.debug(f"Получено документов для обработки: {len(documents)}")
+        self.documents = documents if documents is not None else []
+        self.normalizer = TextNormalizer()
+        logger.debug("Получено документов для обработки: %s", len(self.documents))
 
-    async def _process_single_document(self, doc: Document) -> Document:
+    def _normalize_document(self, doc: Document, repeated_lines: Optional[Set[str]] = None) -> Optional[Document]:
         """
-        Асинхронно обрабатывает один документ.
+        Нормализует текст одного документа (страницы).
+
+        Args:
+            doc (Document): Документ (страница) для обработки
+            repeated_lines (Optional[Set[str]]): Колонтитулы источника документа
+
+        Returns:
+            Optional[Document]: Обработанный документ или None, если текста недостаточно
         """
         try:
             # Проверяем наличие текста
@@ -39,8 +54,8 @@ class ProcessDocuments:
                 logger.warning("Пропускаем документ без текста")
                 return None
                 
-            # Очищаем текст от лишних пробелов и переносов строк
-            cleaned_text = ' '.join(doc.page_content.split())
+            # Нормализуем текст, сохраняя границы абзацев и строк для сплиттера
+            cleaned_text = self.normalizer.normalize(doc.page_content, repeated_lines)
             
             # Проверяем длину текста после очистки
             if len(cleaned_text) < 10:  # Минимальная длина текста
@@ -52,13 +67,79 @@ class ProcessDocuments:
                 page_content=cleaned_text,
                 metadata=doc.metadata
             )
-            logger.debug(f"Документ успешно обработан: {doc.metadata.get('source', 'unknown')}")
+            logger.debug("Документ успешно обработан: %s", doc.metadata.get('source', 'unknown'))
             return processed_doc
             
         except Exception as e:
-            logger.error(f"Ошибка при обработке документа: {str(e)}")
+            logger.error("Ошибка при обработке документа: %s", e)
             return None
 
+    async def _process_single_document(self, doc: Document, repeated_lines: Optional[Set[str]] = None) -> Document:
+        """
+        Асинхронно обрабатывает один документ.
+
+        Args:
+            doc (Document): Документ (страница) для обработки
+            repeated_lines (Optional[Set[str]]): Колонтитулы источника документа
+        """
+        return self._normalize_document(doc, repeated_lines)
+
+    def iter_processed(self, pages: Iterable[Document], header_window: int = 8) -> Iterator[Document]:
+        """
+        Потоково обрабатывает страницы, не накапливая документ целиком.
+
+        Колонтитулы источника определяются по первым header_window страницам,
+        которые ненадолго задерживаются в буфере; остальные страницы нормализуются
+        и передаются дальше по одной. Страницы одного источника должны идти подряд
+        (так их выдает LoadDocuments.iter_documents).
+
+        Args:
+            pages (Iterable[Document]): Поток страниц
+            header_window (int): Количество страниц для поиска колонтитулов
+
+        Yields:
+            Document: Обработанные страницы в исходном порядке
+        """
+        buffer: List[Document] = []
+        repeated_lines: Optional[Set[str]] = None
+        source = None
+        processed = 0
+        skipped = 0
+
+        def flush():
+            nonlocal processed, skipped
+            lines = self.normalizer.detect_repeated_lines(doc.page_content for doc in buffer)
+            for doc in buffer:
+                result = self._normalize_document(doc, lines)
+                if result is None:
+                    skipped += 1
+                else:
+                    processed += 1
+                    yield result
+            buffer.clear()
+            return lines
+
+        for doc in pages:
+            doc_source = doc.metadata.get('source', 'unknown')
+            if doc_source != source:
+                if buffer:
+                    yield from flush()
+                source, repeated_lines = doc_source, None
+            if repeated_lines is None:
+                buffer.append(doc)
+                if len(buffer) >= header_window:
+                    repeated_lines = yield from flush()
+                continue
+            result = self._normalize_document(doc, repeated_lines)
+            if result is None:
+                skipped += 1
+            else:
+                processed += 1
+                yield result
+        if buffer:
+            yield from flush()
+        logger.info("Потоковая обработка завершена. Обработано: %s, пропущено: %s", processed, skipped)
+
     async def process_documents_async(self) -> List[Document]:
         """
         Асинхронная обработка и подготовка документов для индексации.
@@ -71,24 +152,31 @@ class ProcessDocuments:
             raise ValueError(error_msg)
             
         try:
-            # Создаем задачи для асинхронной обработки каждого документа
-            tasks = [self._process_single_document(doc) for doc in self.documents]
-            results = await asyncio.gather(*tasks)
-            
-            # Фильтруем None значения и подсчитываем статистику
-            processed_docs = [doc for doc in results if doc is not None]
-            skipped_docs = len(results) - len(processed_docs)
+            with span('clean', documents=len(self.documents)) as clean_span:
+                # Находим колонтитулы, повторяющиеся на страницах одного источника
+                repeated_lines = self.normalizer.repeated_lines_by_source(self.documents)
+                # Создаем задачи для асинхронной обработки каждого документа
+                tasks = [
+                    self._process_single_document(doc, repeated_lines.get(doc.metadata.get('source', 'unknown')))
+                    for doc in self.documents
+                ]
+                results = await asyncio.gather(*tasks)
+
+                # Фильтруем None значения и подсчитываем статистику
+                processed_docs = [doc for doc in results if doc is not None]
+                skipped_docs = len(results) - len(processed_docs)
+                clean_span.set(kept_documents=len(processed_docs))
             
             if not processed_docs:
                 error_msg = "Не удалось обработать ни одного документа"
                 logger.error(error_msg)
                 raise ValueError(error_msg)
                 
-            logger.info(f"Асинхронная обработка завершена. Обработано: {len(processed_docs)}, пропущено: {skipped_docs}")
+            logger.info("Асинхронная обработка завершена. Обработано: %s, пропущено: %s", len(processed_docs), skipped_docs)
             return processed_docs
             
         except Exception as e:
-            logger.error(f"Критическая ошибка при асинхронной обработке документов: {str(e)}")
+            logger.error("Критическая ошибка при асинхронной обработке документов: %s", e)
             raise
 
     def process_documents(self) -> List[Document]:
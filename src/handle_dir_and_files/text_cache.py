@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, Optional
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from langchain_core.documents import Document
+
+from utils.mylogger import Logger
+
+logger = Logger('ExtractedTextCache', 'logs/rag.log')
+
+# Версия формата кэша: увеличивается при изменении извлечения или нормализации страниц
+CACHE_FORMAT_VERSION = 1
+ENTRY_SUFFIX = '.jsonl.gz'
+
+
+def loader_version(loader_name: str) -> str:
+    """
+    Строка версии загрузчика: имя класса, версии пакетов извлечения текста и формата кэша.
+
+    При обновлении pypdf или docx2txt текст может извлекаться иначе,
+    поэтому старые записи кэша перестают совпадать по ключу.
+    """
+    from importlib.metadata import PackageNotFoundError, version
+
+    versions = []
+    for package in ('langchain-community', 'pypdf', 'docx2txt'):
+        try:
+            versions.append(f'{package}={version(package)}')
+        except PackageNotFoundError:
+            continue
+    return f"{loader_name}/{CACHE_FORMAT_VERSION}/{','.join(versions)}"
+
+
+class ExtractedTextCache:
+    """
+    Дисковый кэш извлеченных текстов страниц и их метаданных.
+
+    Повторное извлечение текста из PDF и DOCX - самый медленный этап пересборки
+    индекса (например, после смены сплиттера или модели эмбеддингов). Кэш хранит
+    страницы каждого файла в сжатом файле JSON Lines (gzip), ключ записи -
+    SHA-256 содержимого файла и версия загрузчика. Поэтому:
+    - неизмененные файлы не разбираются загрузчиком повторно
+    - копии одного файла в разных папках разделяют одну запись
+    - записи от другой версии загрузчика не используются
+
+    Чтобы не читать каждый файл целиком для вычисления хеша, кэш хранит индекс
+    путь -> (размер, mtime, хеш) и пересчитывает хеш только при изменении stat.
+    Общий размер кэша ограничен max_bytes: при превышении удаляются записи,
+    которые дольше всего не использовались (LRU).
+
+    Attributes:
+        cache_dir (str): Директория кэша
+        max_bytes (int): Максимальный суммарный размер записей в байтах
+    """
+    INDEX_FILE = 'hashes.json'
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # Записи в порядке последнего использования: имя файла записи -> размер
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        entries = []
+        with os.scandir(cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+        self._total_bytes = sum(self._entries.values())
+        self._hashes: Dict[str, list] = {}
+        index_path = os.path.join(cache_dir, self.INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    self._hashes = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Индекс хешей кэша поврежден и будет создан заново: %s", e)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def key(self, path: str, version: str, stat: Optional[os.stat_result] = None) -> str:
+        """
+        Ключ записи для файла: хеш содержимого и версии загрузчика.
+
+        Args:
+            path (str): Путь к файлу
+            version (str): Версия загрузчика (см. loader_version)
+            stat (Optional[os.stat_result]): Результат stat, полученный при поиске файлов
+
+        Returns:
+            str: Ключ записи
+        """
+        stat = stat or os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        known = self._hashes.get(path)
+        if known is not None and known[:2] == signature:
+            content_hash = known[2]
+        else:
+            content_hash = self._file_hash(path)
+            self._hashes[path] = signature + [content_hash]
+        return hashlib.sha256(f'{content_hash}:{version}'.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, key: str, source: str) -> Optional[Iterator[Document]]:
+        """
+        Возвращает страницы из кэша в виде ленивого итератора.
+
+        Args:
+            key (str): Ключ записи
+            source (str): Текущий путь к файлу (подставляется в metadata['source'])
+
+        Returns:
+            Optional[Iterator[Document]]: Страницы или None, если записи нет
+        """
+        name = key + ENTRY_SUFFIX
+        if name not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(name)
+        path = self._entry_path(key)
+        try:
+            # Время изменения записи отражает последнее использование после перезапуска
+            os.utime(path, (time.time(), time.time()))
+        except OSError:
+            pass
+        return self._read(path, source)
+
+    def _read(self, path: str, source: str) -> Iterator[Document]:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                page = json.loads(line)
+                metadata = page['metadata']
+                metadata['source'] = source
+                yield Document(page_content=page['text'], metadata=metadata)
+
+    def put(self, key: str, pages: Iterable[Document]) -> Iterator[Document]:
+        """
+        Передает страницы дальше и одновременно записывает их в кэш.
+
+        Запись фиксируется только после того, как загрузчик выдал все страницы;
+        при ошибке извлечения незавершенная запись удаляется.
+
+        Args:
+            key (str): Ключ записи
+            pages (Iterable[Document]): Страницы от загрузчика
+
+        Yields:
+            Document: Те же страницы
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        committed = False
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                for page in pages:
+                    metadata = {k: v for k, v in page.metadata.items() if k != 'source'}
+                    line = json.dumps({'text': page.page_content, 'metadata': metadata},
+                                      ensure_ascii=False, default=str)
+                    f.write(line.encode('utf-8') + b'\n')
+                    yield page
+            path = self._entry_path(key)
+            os.replace(tmp_path, path)
+            committed = True
+            name = os.path.basename(path)
+            self._total_bytes += os.path.getsize(path) - self._entries.pop(name, 0)
+            self._entries[name] = os.path.getsize(path)
+            self._evict()
+        finally:
+            if not committed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self) -> None:
+        """
+        Удаляет давно не использованные записи, пока размер кэша превышает лимит.
+        """
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError as e:
+                logger.warning("Не удалось удалить запись кэша %s: %s", name, e)
+            self._total_bytes -= size
+            logger.debug("Запись кэша %s удалена (%s байт)", name, size)
+
+    def save_index(self) -> None:
+        """
+        Сохраняет индекс хешей файлов и сообщает статистику кэша.
+        """
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        # Уникальное имя временного файла: кэш может использоваться несколькими процессами
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._hashes, f)
+        os.replace(tmp_path, index_path)
+        logger.info("Кэш извлеченного текста: попаданий %s, промахов %s, "
+                    "записей %s, размер %s байт",
+                    self.hits, self.misses, len(self._entries), self._total_bytes)
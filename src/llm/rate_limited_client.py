@@ -0,0 +1,274 @@
+from functools import cached_property
+from typing import Any, Dict, NamedTuple, Optional
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from utils.mylogger import Logger
+
+# Инициализация логгера для отслеживания обращений к LLM
+logger = Logger('RateLimitedLLM', 'logs/rag.log')
+
+
+def estimate_tokens(text: str, chars_per_token: float = 3.0) -> int:
+    """
+    Оценка количества токенов текста до отправки запроса (без токенизатора провайдера).
+
+    Для русского текста в токенизаторах GPT на токен приходится 2-4 символа,
+    поэтому по умолчанию оценка немного завышена, а не занижена.
+    """
+    return max(1, int(len(text) / chars_per_token) + 1)
+
+
+class TokenBucket:
+    """
+    Ограничение скорости «ведро токенов» с резервированием.
+
+    Запрос списывает amount единиц сразу; если баланс стал отрицательным,
+    запрос ждет, пока баланс восстановится со скоростью rate_per_minute.
+    Резервирование сохраняет порядок запросов и не требует примитивов
+    asyncio, поэтому одно ведро работает в любом цикле событий и потоке.
+
+    Attributes:
+        rate_per_minute (float): Скорость пополнения (0 - без ограничения)
+        capacity (float): Наибольший запас (всплеск), по умолчанию минутная норма
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity or rate_per_minute
+        self._balance = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.rate_per_minute / 60)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Списывает amount единиц и возвращает время ожидания в секундах.
+        """
+        if not self.rate_per_minute:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._balance -= amount
+            return max(0.0, -self._balance * 60 / self.rate_per_minute)
+
+    def adjust(self, amount: float) -> None:
+        """
+        Возвращает (amount > 0) или дополнительно списывает (amount < 0) единицы
+        после того, как стал известен фактический расход.
+        """
+        if not self.rate_per_minute:
+            return
+        with self._lock:
+            self._refill()
+            self._balance = min(self.capacity, self._balance + amount)
+
+    def drain(self, seconds: float) -> None:
+        """
+        Обнуляет запас так, чтобы следующие запросы ждали не меньше seconds
+        (после ответа 429 от провайдера).
+        """
+        if not self.rate_per_minute:
+            return
+        with self._lock:
+            self._refill()
+            self._balance = min(self._balance, -seconds * self.rate_per_minute / 60)
+
+    async def acquire(self, amount: float) -> None:
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _LoopClient(NamedTuple):
+    """
+    Пул соединений, модель и семафор одного цикла событий.
+    """
+    semaphore: asyncio.Semaphore
+    http_client: Any
+    model: Any
+
+
+class RateLimitedChatModel:
+    """
+    Клиент LLM с общим пулом соединений, ограничением параллельности и скорости.
+
+    ChatOpenAI создается один раз, но без ограничений: все запросы сразу уходят
+    провайдеру, ответы 429 доходят до повторов tenacity всего конвейера. Клиент:
+    - использует общий пул HTTP-соединений httpx (keep-alive) с max_concurrent соединениями
+    - выполняет не более max_concurrent запросов одновременно
+    - соблюдает лимиты провайдера на запросы и токены в минуту: токены запроса
+      оцениваются по тексту промпта до отправки (плюс ожидаемая длина ответа)
+      и уточняются по фактическому расходу из ответа
+    - при ответе 429 ждет Retry-After и повторяет только этот запрос
+
+    Соединения пула привязаны к циклу событий, в котором открыты, поэтому пул,
+    ChatOpenAI с ним и семафор создаются для каждого цикла событий (синхронные
+    обертки с asyncio.run, потоки со своими циклами); после fork дочерний
+    процесс создает свои пулы, не используя соединения родителя.
+
+    Остальные атрибуты и методы делегируются ChatOpenAI. ChatOpenAI и пул
+    соединений создаются при первом обращении: импорт langchain_openai, openai
+    и httpx не замедляет запуск программы.
+
+    Attributes:
+        model (ChatOpenAI): Модель LangChain для атрибутов и синхронных вызовов
+        max_concurrent (int): Количество одновременных запросов в цикле событий
+        requests (TokenBucket): Ограничение запросов в минуту
+        tokens (TokenBucket): Ограничение токенов в минуту
+    """
+    def __init__(self,
+                 model_name: str,
+                 api_key: str,
+                 base_url: str,
+                 temperature: float,
+                 max_concurrent: int = 8,
+                 requests_per_minute: float = 0,
+                 tokens_per_minute: float = 0,
+                 expected_completion_tokens: int = 512,
+                 max_rate_limit_retries: int = 5,
+                 timeout: float = 60.0,
+                 chars_per_token: float = 3.0) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.expected_completion_tokens = expected_completion_tokens
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.chars_per_token = chars_per_token
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.rate_limited = 0
+        self._settings = {
+            'model': model_name,
+            'api_key': api_key,
+            'base_url': base_url,
+            'temperature': temperature,
+        }
+        self._timeout = timeout
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._loop_lock = threading.Lock()
+        _clients.add(self)
+
+    def _create_model(self, http_async_client=None):
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            **self._settings,
+            http_async_client=http_async_client,
+            # Ответы 429 обрабатываются здесь с учетом Retry-After и лимитов
+            max_retries=0
+        )
+
+    @cached_property
+    def model(self):
+        return self._create_model()
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _loop_client(self) -> _LoopClient:
+        """
+        Пул соединений, модель и семафор текущего цикла событий (создаются при первом запросе в нем).
+        """
+        loop = asyncio.get_running_loop()
+        with self._loop_lock:
+            client = self._loop_clients.get(loop)
+            if client is None:
+                import httpx
+
+                limits = httpx.Limits(max_connections=self.max_concurrent,
+                                      max_keepalive_connections=self.max_concurrent)
+                http_client = httpx.AsyncClient(limits=limits, timeout=self._timeout)
+                client = _LoopClient(asyncio.Semaphore(self.max_concurrent), http_client,
+                                     self._create_model(http_client))
+                self._loop_clients[loop] = client
+            return client
+
+    @property
+    def http_client(self):
+        """
+        Пул HTTP-соединений текущего цикла событий.
+        """
+        return self._loop_client().http_client
+
+    def _reset_after_fork(self) -> None:
+        # Соединения пулов принадлежат родителю: дочерний процесс открывает свои
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._loop_lock = threading.Lock()
+
+    @staticmethod
+    def _retry_after(error) -> float:
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        try:
+            return max(0.0, float(headers.get('retry-after', 1.0)))
+        except ValueError:
+            return 1.0
+
+    async def ainvoke(self, prompt, **kwargs):
+        """
+        Отправляет промпт модели с соблюдением лимитов.
+
+        Raises:
+            RateLimitError: Если провайдер отвечает 429 после всех повторов
+        """
+        from openai import RateLimitError
+
+        estimated = estimate_tokens(str(prompt), self.chars_per_token) + self.expected_completion_tokens
+        client = self._loop_client()
+        async with client.semaphore:
+            for attempt in range(self.max_rate_limit_retries + 1):
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimated)
+                try:
+                    response = await client.model.ainvoke(prompt, **kwargs)
+                except RateLimitError as e:
+                    self.rate_limited += 1
+                    delay = self._retry_after(e)
+                    if attempt == self.max_rate_limit_retries:
+                        raise
+                    logger.warning("Провайдер LLM ограничил скорость (429), повтор через %.1f с", delay)
+                    # Опустошенные ведра задерживают и этот, и остальные запросы
+                    self.requests.drain(delay)
+                    self.tokens.drain(delay)
+                    if not (self.requests.rate_per_minute or self.tokens.rate_per_minute):
+                        await asyncio.sleep(delay)
+                    continue
+                usage: Optional[Dict] = getattr(response, 'usage_metadata', None)
+                if usage and usage.get('total_tokens'):
+                    self.tokens.adjust(estimated - usage['total_tokens'])
+                return response
+
+    def snapshot(self) -> Dict:
+        """
+        Метрики клиента: количество ответов 429.
+        """
+        return {'rate_limited': self.rate_limited}
+
+    async def aclose(self) -> None:
+        """
+        Закрывает пул соединений текущего цикла событий.
+        """
+        loop = asyncio.get_running_loop()
+        with self._loop_lock:
+            client = self._loop_clients.pop(loop, None)
+        if client is not None:
+            await client.http_client.aclose()
+
+
+# Клиенты процесса: после fork их пулы соединений сбрасываются
+_clients = weakref.WeakSet()
+
+
+def _reset_clients_after_fork() -> None:
+    for client in list(_clients):
+        client._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
@@ -0,0 +1,395 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+
+from utils.mylogger import Logger
+from config import RAG_CONFIG
+
+# Инициализация логгера для отслеживания трассировки
+logger = Logger('Tracing', 'logs/rag.log')
+
+# Этапы загрузки и запроса в порядке выполнения
+STAGES = ('load', 'clean', 'split', 'embed', 'index',
+          'retrieve', 'filter', 'rerank', 'format', 'llm', 'verify')
+
+# Трасса текущего запроса; asyncio.to_thread и run_in_stage копируют контекст в потоки
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('rag_trace', default=None)
+
+
+class Span:
+    """
+    Этап в трассе: время выполнения и счетчики (документы, токены, кандидаты).
+
+    Attributes:
+        stage (str): Имя этапа
+        start (float): Начало относительно начала трассы, с
+        duration (float): Длительность, с
+        counts (Dict[str, int]): Счетчики этапа
+        error (Optional[str]): Тип исключения, если этап завершился ошибкой
+    """
+    __slots__ = ('stage', 'start', 'duration', 'counts', 'error')
+
+    def __init__(self, stage: str, start: float, counts: Dict[str, int]) -> None:
+        self.stage = stage
+        self.start = start
+        self.duration = 0.0
+        self.counts = counts
+        self.error: Optional[str] = None
+
+    def set(self, **counts: int) -> None:
+        """
+        Добавляет или заменяет счетчики этапа.
+        """
+        self.counts.update(counts)
+
+    def as_dict(self) -> Dict:
+        span = {'stage': self.stage, 'start_ms': round(self.start * 1000, 3),
+                'duration_ms': round(self.duration * 1000, 3), 'counts': self.counts}
+        if self.error is not None:
+            span['error'] = self.error
+        return span
+
+
+class _NoopSpan:
+    """
+    Этап при отключенной трассировке: один общий объект без записи времени.
+
+    Ложен в условии, поэтому дорогие счетчики считаются только при включенной
+    трассировке: if span: span.set(...).
+    """
+    __slots__ = ()
+
+    def set(self, **counts: int) -> None:
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    async def __aenter__(self) -> '_NoopSpan':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, tracer: 'Tracer', stage: str, counts: Dict[str, int]) -> None:
+        self.tracer = tracer
+        self.trace = _current_trace.get()
+        origin = self.trace.started if self.trace is not None else 0.0
+        self.started = time.perf_counter()
+        self.span = Span(stage, self.started - origin, counts)
+
+    def __enter__(self) -> Span:
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        span = self.span
+        span.duration = time.perf_counter() - self.started
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        if self.trace is not None:
+            # list.append атомарен: этапы из потоков пулов добавляются без блокировки
+            self.trace.spans.append(span)
+        self.tracer.metrics.record(span)
+        return None
+
+    # Этап можно открыть вместе с асинхронными контекстами: async with stage(...), span(...)
+    async def __aenter__(self) -> Span:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        return self.__exit__(exc_type, exc, tb)
+
+
+class Trace:
+    """
+    Трасса одного запроса или одной загрузки документов.
+
+    Attributes:
+        trace_id (str): Идентификатор трассы
+        name (str): Вид трассы (query, ingest)
+        attributes (Dict): Атрибуты трассы (коллекция, фильтры)
+        spans (List[Span]): Этапы в порядке завершения
+    """
+    def __init__(self, name: str, attributes: Dict) -> None:
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[Span] = []
+        self.error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        trace = {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'spans': [span.as_dict() for span in sorted(self.spans, key=lambda span: span.start)],
+        }
+        if self.error is not None:
+            trace['error'] = self.error
+        return trace
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин (как histogram в Prometheus).
+    """
+    __slots__ = ('bounds', 'buckets', 'sum', 'count')
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        Накопленные значения корзин с границей le, последняя - +Inf.
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.buckets):
+            total += count
+            result.append(('+Inf' if bound == float('inf') else repr(float(bound)), total))
+        return result
+
+
+def _labels(**labels: str) -> str:
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class MetricsRegistry:
+    """
+    Метрики этапов процесса: гистограммы длительности, счетчики вызовов,
+    ошибок и элементов (документы, токены, кандидаты).
+
+    Метрики живут в процессе: рабочие процессы сервера отдают каждый свои.
+    """
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Histogram] = {}
+        self._errors: Dict[str, int] = {}
+        self._items: Dict[Tuple[str, str], int] = {}
+
+    def _histogram(self, name: str) -> Histogram:
+        histogram = self._durations.get(name)
+        if histogram is None:
+            histogram = self._durations[name] = Histogram(self.buckets)
+        return histogram
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._histogram(span.stage).observe(span.duration)
+            if span.error is not None:
+                self._errors[span.stage] = self._errors.get(span.stage, 0) + 1
+            for item, value in span.counts.items():
+                key = (span.stage, item)
+                self._items[key] = self._items.get(key, 0) + value
+
+    def record_trace(self, trace: Trace) -> None:
+        # Полное время трассы записывается как этап с ее именем (query, ingest)
+        with self._lock:
+            self._histogram(trace.name).observe(trace.duration)
+            if trace.error is not None:
+                self._errors[trace.name] = self._errors.get(trace.name, 0) + 1
+
+    def snapshot(self) -> Dict:
+        """
+        Метрики в виде словаря: число вызовов, средняя длительность, ошибки и элементы по этапам.
+        """
+        with self._lock:
+            return {
+                stage: {
+                    'count': histogram.count,
+                    'mean_ms': round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                    'errors': self._errors.get(stage, 0),
+                    'items': {item: value for (item_stage, item), value in self._items.items() if item_stage == stage},
+                }
+                for stage, histogram in self._durations.items()
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Метрики в текстовом формате Prometheus.
+        """
+        with self._lock:
+            lines = [
+                "# HELP rag_stage_duration_seconds Длительность этапов загрузки и запроса",
+                "# TYPE rag_stage_duration_seconds histogram",
+            ]
+            for stage, histogram in sorted(self._durations.items()):
+                for bound, total in histogram.cumulative():
+                    lines.append(f"rag_stage_duration_seconds_bucket{{{_labels(stage=stage, le=bound)}}} {total}")
+                lines.append(f"rag_stage_duration_seconds_sum{{{_labels(stage=stage)}}} {histogram.sum!r}")
+                lines.append(f"rag_stage_duration_seconds_count{{{_labels(stage=stage)}}} {histogram.count}")
+            lines += [
+                "# HELP rag_stage_errors_total Этапы, завершившиеся исключением",
+                "# TYPE rag_stage_errors_total counter",
+            ]
+            for stage, count in sorted(self._errors.items()):
+                lines.append(f"rag_stage_errors_total{{{_labels(stage=stage)}}} {count}")
+            lines += [
+                "# HELP rag_stage_items_total Обработанные этапами элементы (документы, токены, кандидаты)",
+                "# TYPE rag_stage_items_total counter",
+            ]
+            for (stage, item), value in sorted(self._items.items()):
+                lines.append(f"rag_stage_items_total{{{_labels(stage=stage, item=item)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._errors.clear()
+            self._items.clear()
+
+
+class Tracer:
+    """
+    Трассировка этапов загрузки документов и запросов.
+
+    span(stage, **counts) измеряет этап и пополняет метрики процесса; если
+    этап выполняется внутри trace(...), он также попадает в трассу запроса.
+    Завершенные трассы хранятся в памяти (последние max_traces) и, если задан
+    файл, дописываются в него построчно в JSON.
+
+    При отключенной трассировке span возвращает общий пустой объект, а trace -
+    None, поэтому вызовы в коде этапов почти ничего не стоят.
+
+    Attributes:
+        enabled (bool): Включена ли трассировка
+        traces_file (Optional[str]): Файл трасс в формате JSON Lines
+        metrics (MetricsRegistry): Метрики этапов процесса
+        traces (Deque[Dict]): Последние завершенные трассы
+    """
+    def __init__(self,
+                 enabled: bool = False,
+                 traces_file: Optional[str] = None,
+                 buckets: Sequence[float] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+                 max_traces: int = 100) -> None:
+        self.enabled = enabled
+        self.traces_file = traces_file or None
+        self.metrics = MetricsRegistry(buckets)
+        self.traces: Deque[Dict] = deque(maxlen=max_traces)
+        self._file_lock = threading.Lock()
+
+    def span(self, stage: str, **counts: int):
+        """
+        Контекст этапа; внутри можно дописать счетчики через span.set(...).
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _ActiveSpan(self, stage, counts)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """
+        Трасса запроса или загрузки: этапы внутри контекста попадают в нее.
+
+        Вложенный вызов продолжает внешнюю трассу (например, повтор запроса).
+        """
+        if not self.enabled or _current_trace.get() is not None:
+            yield _current_trace.get()
+            return
+        trace = Trace(name, attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            self.metrics.record_trace(trace)
+            self._finish(trace.as_dict())
+
+    def _finish(self, trace: Dict) -> None:
+        self.traces.append(trace)
+        if self.traces_file is None:
+            return
+        try:
+            line = json.dumps(trace, ensure_ascii=False)
+            with self._file_lock:
+                with open(self.traces_file, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logger.warning("Не удалось записать трассу в %s: %s", self.traces_file, e)
+
+    def _reset_after_fork(self) -> None:
+        # Рабочий процесс сервера считает свои метрики с нуля
+        self.metrics = MetricsRegistry(self.metrics.buckets)
+        self.traces.clear()
+        self._file_lock = threading.Lock()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    """
+    Трассировщик процесса, созданный по RAG_CONFIG['tracing'].
+    """
+    global _tracer
+    if _tracer is None:
+        config = RAG_CONFIG['tracing']
+        _tracer = Tracer(config['enabled'], config['traces_file'], config['buckets'], config['max_traces'])
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> None:
+    """
+    Заменяет трассировщик процесса (например, в бенчмарке).
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def span(stage: str, **counts: int):
+    """
+    Контекст этапа в трассировщике процесса (см. Tracer.span).
+    """
+    return get_tracer().span(stage, **counts)
+
+
+def trace(name: str, **attributes):
+    """
+    Контекст трассы в трассировщике процесса (см. Tracer.trace).
+    """
+    return get_tracer().trace(name, **attributes)
+
+
+def _after_fork_in_child() -> None:
+    if _tracer is not None:
+        _tracer._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -1,8 +1,8 @@
 from typing import List
-from langchain.schema import Document
-from langchain.prompts import ChatPromptTemplate
-from sentence_transformers import CrossEncoder
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate
 from utils.mylogger import Logger
+from src.serving.cpu_scheduler import run_in_stage
 import asyncio
 
 logger = Logger('Promts', 'logs/rag.log')
@@ -32,11 +32,11 @@ class Promts:
             llm: Экземпляр класса AdvancedRAG, которому будут присвоены промпты
         """
         self.llm = llm
-        # Инициализируем cross-encoder для реранжирования документов
+        # Cross-encoder для реранжирования документов берется у AdvancedRAG
+        # (загружается в фоне один раз, без второй копии модели)
         # Эта модель помогает определить наиболее релевантные документы
         # путем оценки их соответствия вопросу пользователя
-        self.cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-        logger.info("Cross-encoder успешно инициализирован")
+        self.cross_encoder = llm.cross_encoder
 
     async def setup_prompts_async(self) -> None:
         """
@@ -97,7 +97,7 @@ class Promts:
             )
             logger.info("Промпты успешно настроены")
         except Exception as e:
-            logger.error(f"Ошибка настройки промптов: {str(e)}")
+            logger.error("Ошибка настройки промптов: %s", e)
             raise
 
     def setup_prompts(self) -> None:
@@ -133,7 +133,7 @@ class Promts:
             pairs = [(question, doc.page_content) for doc in documents]
             
             # Получаем оценки релевантности
-            scores = await asyncio.to_thread(self.cross_encoder.predict, pairs)
+            scores = await run_in_stage('rerank', self.cross_encoder.predict, pairs)
             
             # Сортируем документы по оценкам
             scored_docs = list(zip(documents, scores))
@@ -143,7 +143,7 @@ class Promts:
             return [doc for doc, _ in scored_docs]
             
         except Exception as e:
-            logger.error(f"Ошибка при реранжировании документов: {str(e)}")
+            logger.error("Ошибка при реранжировании документов: %s", e)
             raise
 
     def rerank_documents(self, question: str, documents: List[Document]) -> List[Document]:
@@ -1,20 +1,45 @@
 # общие библиотеки
 from typing import Optional
-from tenacity import retry, stop_after_attempt, wait_exponential
-# библиотеки для работы с LLM
-from langchain_openai import ChatOpenAI
-from sentence_transformers import CrossEncoder, SentenceTransformer
-import torch
+from contextlib import nullcontext
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
 # локальные библиотеки
 from utils.mylogger import Logger
+from src.embedded.background_model import BackgroundModel
 from src.retrieval.retriever import Retriever
 from src.date.vector_store import VectorStore
 from src.promts.promts import Promts
 from src.format_context.format_context import FormatContext
-import asyncio
+from src.date.collection_manager import CollectionManager
+from src.llm.rate_limited_client import RateLimitedChatModel, estimate_tokens
+from src.serving.admission import AdmissionController, AdmissionRejected
+from src.serving.cpu_scheduler import run_in_stage
+from src.monitoring.tracing import span, trace
+from config import RAG_CONFIG
 # Настройка логирования
 logger = Logger('RAG', 'logs/rag.log')
 
+
+def load_sentence_transformer():
+    """
+    Загружает модель эмбеддингов (torch и sentence_transformers импортируются здесь,
+    а не при импорте модуля, чтобы --help и служебные команды запускались быстро).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    logger.info("Используем устройство: %s", device)
+    return SentenceTransformer(RAG_CONFIG["embedding_model"], device=device)
+
+
+def load_cross_encoder():
+    """
+    Загружает cross-encoder для реранжирования.
+    """
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+
 class AdvancedRAG:
     """
     Реализация RAG (Retrieval-Augmented Generation) системы.
@@ -62,14 +87,23 @@ class AdvancedRAG:
         if not base_url:
             raise ValueError("base_url не может быть пустым")
         try:
-            # Инициализация LLM - основной модели для генерации ответов
-            self.llm = ChatOpenAI(
-                model=model_name,
-                api_key=api_key,
-                base_url=base_url,
-                temperature=temperature
+            # Инициализация LLM - основной модели для генерации ответов.
+            # ChatOpenAI работает через клиент с общим пулом соединений,
+            # ограничением параллельности и лимитами запросов и токенов в минуту
+            llm_client_config = RAG_CONFIG["llm_client"]
+            self.llm = RateLimitedChatModel(
+                model_name,
+                api_key,
+                base_url,
+                temperature,
+                max_concurrent=llm_client_config["max_concurrent"],
+                requests_per_minute=llm_client_config["requests_per_minute"],
+                tokens_per_minute=llm_client_config["tokens_per_minute"],
+                expected_completion_tokens=llm_client_config["expected_completion_tokens"],
+                max_rate_limit_retries=llm_client_config["max_rate_limit_retries"],
+                timeout=llm_client_config["timeout"]
             )
-            logger.info(f"LLM модель {model_name} успешно инициализирована")
+            logger.info("LLM модель %s успешно инициализирована", model_name)
             
             # После инициализации self.llm объект класса AdvancedRAG получает доступ к методам LLM:
             # - invoke: метод для отправки запросов к LLM с использованием промптов
@@ -79,19 +113,11 @@ class AdvancedRAG:
             # Эти методы используются в методе query() класса AdvancedRAG для генерации ответов
             # на вопросы пользователя и в методе verification_query() для проверки качества ответов
             
-            # Инициализация модели эмбеддингов - для векторного представления текста
-            try:
-                # Используем sentence-transformers для создания эмбеддингов
-                device = 'cuda' if torch.cuda.is_available() else 'cpu'
-                logger.info(f"Используем устройство: {device}")
-                # Инициализируем модель для русского языка
-                self.sentence_transformer = SentenceTransformer(
-                    "sergeyzh/LaBSE-ru-turbo",
-                    device=device
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при инициализации модели эмбеддингов: {str(e)}")
-                raise
+            # Инициализация модели эмбеддингов - для векторного представления текста.
+            # Модели загружаются в фоновом потоке, пока индекс отображается в память;
+            # первое обращение к модели ждет окончания загрузки, ошибка загрузки
+            # возникает при этом обращении
+            self.sentence_transformer = BackgroundModel('SentenceTransformer', load_sentence_transformer)
                 
             # После инициализации self.sentence_transformer объект класса AdvancedRAG получает доступ к методам:
             # - encode: метод для создания векторных представлений текста
@@ -100,9 +126,10 @@ class AdvancedRAG:
             # которые затем используются в VectorStore для индексации и поиска документов
                 
             # Инициализируем cross-encoder для реранжирования документов
-            # Эта модель помогает определить наиболее релевантные документы
-            self.cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-            logger.info("Cross-encoder успешно инициализирован")
+            # Эта модель помогает определить наиболее релевантные документы.
+            # Загрузка начинается после модели эмбеддингов: обе модели импортируют
+            # torch, а модель эмбеддингов нужна раньше (настройка ретриверов)
+            self.cross_encoder = BackgroundModel('CrossEncoder', self._load_cross_encoder)
             
             # После инициализации self.cross_encoder объект класса AdvancedRAG получает доступ к методам:
             # - predict: метод для оценки релевантности пар вопрос-документ
@@ -119,7 +146,14 @@ class AdvancedRAG:
             # векторного хранилища из обработанных документов, что позволяет быстро находить релевантные
             # документы при запросах пользователя
             
+            # create_vector_store() заменяет self.vectorstore на векторное хранилище FAISS,
+            # поэтому объект VectorStore сохраняется отдельно для сохранения и загрузки индекса
+            self.vector_store_manager = self.vectorstore
+            
             self.retriever = Retriever(self)      # Поиск релевантных документов
+            # setup_retrievers() заменяет self.retriever на ретривер LangChain,
+            # поэтому объект Retriever сохраняется отдельно для пакетного поиска
+            self.retriever_manager = self.retriever
             # После инициализации self.retriever объект класса AdvancedRAG получает доступ к методам:
             # - setup_retrievers: метод для настройки системы ретриверов
             # - get_relevant_documents: метод для поиска релевантных документов
@@ -142,38 +176,153 @@ class AdvancedRAG:
             # Этот компонент используется в методе query() для форматирования контекста из найденных
             # документов, который затем передается в LLM для генерации ответа
             
+            # Именованные коллекции документов с общими моделями: индексы коллекций
+            # загружаются при первом запросе и выгружаются по LRU при превышении лимита памяти
+            collections_config = RAG_CONFIG["collections"]
+            self.collections = CollectionManager(
+                self,
+                collections_config["dirs"],
+                collections_config["root"],
+                collections_config["memory_cap_mb"] * 1024 * 1024
+            )
+
+            # Допуск запросов: ограниченная очередь перед обработкой и семафоры этапов,
+            # лишние запросы при всплеске отклоняются вместо общего замедления
+            admission_config = RAG_CONFIG["admission"]
+            self.admission = AdmissionController(
+                admission_config["max_concurrent"],
+                admission_config["max_queue"],
+                admission_config["queue_timeout"],
+                admission_config["stages"]
+            ) if admission_config["enabled"] else None
+
         except Exception as e:
-            logger.error(f"Ошибка инициализации компонентов: {str(e)}")
+            logger.error("Ошибка инициализации компонентов: %s", e)
             raise
         
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=15))
-    async def query_async(self, question: str) -> str:
+    def _load_cross_encoder(self):
+        self.sentence_transformer.result()
+        return load_cross_encoder()
+
+    def wait_for_models(self) -> None:
+        """
+        Ждет окончания фоновой загрузки моделей (например, перед fork рабочих процессов).
+
+        Raises:
+            Exception: Ошибка загрузки модели
+        """
+        self.sentence_transformer.result()
+        self.cross_encoder.result()
+
+    @retry(stop=stop_after_attempt(3),
+           wait=wait_exponential(multiplier=1, min=4, max=15),
+           retry=retry_if_not_exception_type(AdmissionRejected))
+    async def query_async(self,
+                          question: str,
+                          filters: Optional[dict] = None,
+                          collection: Optional[str] = None) -> str:
         """
         Асинхронно обрабатывает запрос пользователя.
+
+        Args:
+            question (str): Вопрос пользователя
+            filters (Optional[dict]): Фильтры по метаданным (sources, directories,
+                file_types, pages). Отбор выполняется внутри поиска FAISS
+            collection (Optional[str]): Имя коллекции документов (см. CollectionManager).
+                Коллекция загружается при первом запросе; без имени используется
+                индекс, созданный при настройке
+
+        Raises:
+            AdmissionRejected: Если запрос не допущен к обработке (очередь заполнена
+                или время ожидания в ней истекло); такой запрос не повторяется
+        """
+        if not question.strip():
+            return "Вопрос не может быть пустым"
+        # Трасса запроса: этапы ниже попадают в нее (RAG_CONFIG['tracing'])
+        with trace('query', collection=collection, filtered=bool(filters)):
+            if self.admission is None:
+                return await self._route_query_async(question, filters, collection)
+            async with self.admission.admit():
+                return await self._route_query_async(question, filters, collection)
+
+    def _stage(self, name: str):
         """
+        Контекст этапа запроса с ограничением параллельности (без контроллера допуска - пустой).
+        """
+        return self.admission.stage(name) if self.admission is not None else nullcontext()
+
+    async def _route_query_async(self, question: str, filters: Optional[dict], collection: Optional[str]) -> str:
+        if collection is None:
+            return await self._query_source_async(self, question, filters)
         try:
-            if not question.strip():
-                return "Вопрос не может быть пустым"
+            async with self.collections.use(collection) as source:
+                return await self._query_source_async(source, question, filters)
+        except Exception as e:
+            logger.error("Ошибка при обработке запроса к коллекции %s: %s", collection, e)
+            return f"Произошла ошибка при обработке запроса: {str(e)}"
 
-            # Асинхронный поиск релевантных документов через to_thread
-            relevant_docs = await asyncio.to_thread(
-                self.retriever.get_relevant_documents,
-                question
-            )
+    async def _query_source_async(self, source, question: str, filters: Optional[dict] = None) -> str:
+        """
+        Отвечает на вопрос по индексу источника: самого AdvancedRAG или коллекции.
+
+        Модели (cross-encoder, LLM) и промпты общие, от источника берутся
+        только индексы и ретриверы.
+        """
+        try:
+            # Этапы запроса ограничены семафорами контроллера допуска (RAG_CONFIG['admission'])
+            async with self._stage('retrieve'), span('retrieve') as retrieve_span:
+                if getattr(source.retriever_manager, 'sharded', None) is not None:
+                    # Поиск по шардам индекса с объединением k лучших результатов
+                    relevant_docs = (await source.retriever_manager.search_batch_async([question], filters=filters))[0]
+                    if not relevant_docs:
+                        return "Не найдено релевантных документов"
+                elif getattr(source, 'lexical_index', None) is not None and RAG_CONFIG["hybrid"]["enabled"]:
+                    # Гибридный поиск FAISS + BM25, объединенный через RRF до реранжирования
+                    relevant_docs = await source.retriever_manager.hybrid_search_async(question, filters=filters)
+                    if not relevant_docs:
+                        return "Не найдено релевантных документов"
+                elif RAG_CONFIG["mmr"]["enabled"]:
+                    # Поиск с диверсификацией результатов, чтобы почти одинаковые чанки
+                    # не занимали место в реранжировании и контексте
+                    relevant_docs = await source.retriever_manager.mmr_search_async(question, filters=filters)
+                    if not relevant_docs:
+                        return "Не найдено релевантных документов"
+                elif filters:
+                    # Поиск только среди чанков, подходящих под фильтры
+                    relevant_docs = (await source.retriever_manager.search_batch_async([question], filters=filters))[0]
+                    if not relevant_docs:
+                        return "Не найдено документов, подходящих под фильтры"
+                else:
+                    # Асинхронный поиск релевантных документов в пуле этапа поиска
+                    relevant_docs = await run_in_stage(
+                        'search',
+                        source.retriever.get_relevant_documents,
+                        question
+                    )
+                retrieve_span.set(documents=len(relevant_docs))
             
             # Асинхронное реранжирование документов
-            reranked_docs = await self.promts.rerank_documents_async(question, relevant_docs)
+            async with self._stage('rerank'), span('rerank', candidates=len(relevant_docs)) as rerank_span:
+                reranked_docs = await self.promts.rerank_documents_async(question, relevant_docs)
+                rerank_span.set(documents=len(reranked_docs))
             
             # Форматирование контекста
-            context = self.format_context.format_context(reranked_docs)
+            with span('format', documents=len(reranked_docs)) as format_span:
+                context = self.format_context.format_context(reranked_docs)
+                format_span.set(chars=len(context), tokens=estimate_tokens(context))
             
             # Асинхронная генерация ответа
-            response = await self.llm.ainvoke(
-                self.main_prompt.format(
-                    context=context,
-                    question=question
+            async with self._stage('llm'), span('llm') as llm_span:
+                response = await self.llm.ainvoke(
+                    self.main_prompt.format(
+                        context=context,
+                        question=question
+                    )
                 )
-            )
+                usage = getattr(response, 'usage_metadata', None)
+                if llm_span and usage:
+                    llm_span.set(prompt_tokens=usage.get('input_tokens', 0),
+                                 completion_tokens=usage.get('output_tokens', 0))
             
             if not response or not response.content:
                 return "Не удалось сгенерировать ответ"
@@ -182,12 +331,13 @@ class AdvancedRAG:
             answer = self.extract_answer(response.content)
             
             # Асинхронная верификация ответа
-            verified_response = await self.verification_query_async(question, answer, context)
+            async with self._stage('llm'), span('verify'):
+                verified_response = await self.verification_query_async(question, answer, context)
             
             return verified_response
             
         except Exception as e:
-            logger.error(f"Ошибка при обработке запроса: {str(e)}")
+            logger.error("Ошибка при обработке запроса: %s", e)
             return f"Произошла ошибка при обработке запроса: {str(e)}"
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=15))
@@ -215,7 +365,7 @@ class AdvancedRAG:
             return self.extract_answer(verification_response.content)
 
         except Exception as e:
-            logger.error(f"Ошибка при верификации ответа: {str(e)}")
+            logger.error("Ошибка при верификации ответа: %s", e)
             return response
 
     def extract_answer(self, response: str) -> str:
@@ -242,7 +392,8 @@ class AdvancedRAG:
             start_index = response.find(start_tag)
             end_index = response.find(end_tag)
             if start_index != -1 and end_index != -1:
-                logger.info(f"Найден улучшенный ответ: {response[start_index + len(start_tag):end_index]}")
+                # Текст ответа не логируется: на каждый запрос пишется только его длина
+                logger.debug("Найден улучшенный ответ: %s символов", end_index - start_index - len(start_tag))
                 return response[start_index + len(start_tag):end_index]
 
             # Проверяем наличие тегов <answer> и </answer>
@@ -251,12 +402,12 @@ class AdvancedRAG:
             start_index = response.find(start_tag)
             end_index = response.find(end_tag)
             if start_index != -1 and end_index != -1:
-                logger.info(f"Найден ответ: {response[start_index + len(start_tag):end_index]}")
+                logger.debug("Найден ответ: %s символов", end_index - start_index - len(start_tag))
                 return response[start_index + len(start_tag):end_index]
             
-            logger.info("Ответ не найден")
+            logger.warning("Ответ не найден в ответе модели")
             return "Ответ не найден"
         
         except Exception as e:
-            logger.error(f"Ошибка при извлечении точного ответа: {str(e)}")
+            logger.error("Ошибка при извлечении точного ответа: %s", e)
             return "Ответ не найден"
\ No newline at end of file
@@ -0,0 +1,46 @@
+from typing import List
+import numpy as np
+
+
+def maximal_marginal_relevance(query_vector: np.ndarray,
+                               candidate_vectors: np.ndarray,
+                               k: int,
+                               lambda_mult: float = 0.5) -> List[int]:
+    """
+    Выбирает k разнообразных кандидатов методом maximal marginal relevance.
+
+    Все попарные близости кандидатов считаются одним матричным умножением,
+    после чего жадный отбор выполняется векторизованно: на каждом шаге
+    обновляется только вектор максимальной близости к уже выбранным.
+
+    Оценка кандидата: lambda_mult * sim(query, d) - (1 - lambda_mult) * max sim(d, выбранные)
+
+    Args:
+        query_vector (np.ndarray): Нормализованный эмбеддинг запроса (dim)
+        candidate_vectors (np.ndarray): Нормализованные эмбеддинги кандидатов (m x dim)
+        k (int): Количество выбираемых кандидатов
+        lambda_mult (float): Баланс релевантности (1.0) и разнообразия (0.0)
+
+    Returns:
+        List[int]: Позиции выбранных кандидатов в порядке отбора
+    """
+    m = len(candidate_vectors)
+    if m == 0 or k <= 0:
+        return []
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    query_similarity = vectors @ np.asarray(query_vector, dtype=np.float32)
+    pairwise_similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(query_similarity))]
+    max_similarity = pairwise_similarity[selected[0]].copy()
+    available = np.ones(m, dtype=bool)
+    available[selected[0]] = False
+
+    for _ in range(min(k, m) - 1):
+        scores = lambda_mult * query_similarity - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, pairwise_similarity[best], out=max_similarity)
+    return selected
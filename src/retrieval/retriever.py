@@ -1,9 +1,19 @@
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import EmbeddingsFilter
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+import numpy as np
 from src.embedded.custom_embeddings import CustomEmbeddings
+from src.date.compact_docstore import CompactDocstore
+from src.date.quantized_index import RescoringIndex
+from src.date.bm25_index import reciprocal_rank_fusion
+from src.retrieval.mmr import maximal_marginal_relevance
+from src.retrieval.sharded_retrieval import ShardedSearcher, search_index, threshold_hits
+from src.serving.cpu_scheduler import run_in_stage
+from src.monitoring.tracing import span
 from utils.mylogger import Logger
 from config import RAG_CONFIG
 import asyncio
+import logging
+import time
 
 logger = Logger('Retriever', 'logs/rag.log')
 
@@ -15,6 +25,13 @@ class Retriever:
     - Настройки базового ретривера на основе векторного хранилища
     - Настройки фильтра по эмбеддингам для улучшения релевантности
     - Создания компресионного ретривера для финального поиска
+    - Пакетного поиска по нескольким запросам одним обращением к индексу
+    - Фильтрации по метаданным (файлы, директории, страницы, типы файлов)
+      внутри поиска FAISS
+    - Гибридного поиска (FAISS + BM25) с объединением через reciprocal rank fusion
+    - Диверсификации результатов методом MMR по векторам из индекса
+    - Поиска по N шардам индекса (в текущем процессе или в рабочих процессах)
+      с параллельной рассылкой запроса и объединением top-k
     
     Attributes:
         llm: Объект класса LLM, содержащий векторное хранилище
@@ -32,6 +49,8 @@ class Retriever:
         self.llm = llm
         self.vectorstore = llm.vectorstore
         self.embedding_model = CustomEmbeddings(llm.sentence_transformer)
+        # Поиск по шардам (см. setup_sharded_async), None - поиск по общему индексу
+        self.sharded: Optional[ShardedSearcher] = None
         logger.debug("Компоненты Retriever успешно инициализированы")
 
     async def get_relevant_documents_async(self, query: str):
@@ -45,16 +64,16 @@ class Retriever:
             List[Document]: Список релевантных документов
         """
         try:
-            logger.debug(f"Асинхронный поиск документов для запроса: {query[:100]}...")
+            logger.debug("Асинхронный поиск документов для запроса: %s...", query[:100])
             # Используем to_thread для асинхронного выполнения синхронного метода
             documents = await asyncio.to_thread(
                 self.llm.retriever.get_relevant_documents,
                 query
             )
-            logger.info(f"Найдено {len(documents)} релевантных документов")
+            logger.debug("Найдено %s релевантных документов", len(documents))
             return documents
         except Exception as e:
-            logger.error(f"Ошибка при поиске документов: {str(e)}")
+            logger.error("Ошибка при поиске документов: %s", e)
             raise
 
     def get_relevant_documents(self, query: str):
@@ -77,6 +96,9 @@ class Retriever:
             ValueError: Если векторное хранилище не инициализировано
             Exception: При ошибках настройки ретриверов
         """
+        from langchain.retrievers import ContextualCompressionRetriever
+        from langchain.retrievers.document_compressors import EmbeddingsFilter
+
         logger.info("Начало настройки системы ретриверов")
         
         if not self.vectorstore:
@@ -95,7 +117,7 @@ class Retriever:
                 )
                 logger.info("Базовый ретривер успешно настроен")
             except Exception as e:
-                logger.error(f"Ошибка при настройке базового ретривера: {str(e)}")
+                logger.error("Ошибка при настройке базового ретривера: %s", e)
                 raise
                 
             # Настраиваем фильтр по эмбеддингам для LLM
@@ -108,7 +130,7 @@ class Retriever:
                 )
                 logger.info("Фильтр по эмбеддингам успешно настроен")
             except Exception as e:
-                logger.warning(f"Не удалось настроить фильтр по эмбеддингам: {str(e)}")
+                logger.warning("Не удалось настроить фильтр по эмбеддингам: %s", e)
                 logger.info("Продолжаем работу без фильтра по эмбеддингам")
                 embeddings_filter = None
                 
@@ -126,14 +148,14 @@ class Retriever:
                     self.llm.retriever = self.llm.base_retriever
                     logger.info("Используется базовый ретривер без фильтрации")
             except Exception as e:
-                logger.warning(f"Не удалось создать компресионный ретривер: {str(e)}")
+                logger.warning("Не удалось создать компресионный ретривер: %s", e)
                 logger.info("Используем базовый ретривер")
                 self.llm.retriever = self.llm.base_retriever
                 
             logger.info("Настройка системы ретриверов успешно завершена")
             
         except Exception as e:
-            logger.error(f"Ошибка при настройке системы ретриверов: {str(e)}")
+            logger.error("Ошибка при настройке системы ретриверов: %s", e)
             raise
 
     def setup_retrievers(self) -> None:
@@ -142,3 +164,392 @@ class Retriever:
         """
         asyncio.run(self.setup_retrievers_async())
 
+    async def setup_sharded_async(self,
+                                  shards_dir: Optional[str] = None,
+                                  mode: Optional[str] = None,
+                                  timeout: Optional[float] = None) -> None:
+        """
+        Подключает поиск по шардам индекса вместо общего индекса.
+
+        Пакетный поиск (search_batch_async) рассылает эмбеддинги запросов во все
+        шарды параллельно и объединяет k лучших результатов с тем же score_threshold.
+
+        Args:
+            shards_dir (Optional[str]): Директория шардов (по умолчанию RAG_CONFIG['sharding']['dir'])
+            mode (Optional[str]): local или process (по умолчанию RAG_CONFIG['sharding']['serving'])
+            timeout (Optional[float]): Таймаут шарда в секундах (по умолчанию RAG_CONFIG['sharding']['timeout'])
+        """
+        config = RAG_CONFIG["sharding"]
+        self.close_shards()
+        self.sharded = await asyncio.to_thread(
+            ShardedSearcher.from_manifest,
+            shards_dir or config["dir"],
+            mode or config["serving"],
+            config["timeout"] if timeout is None else timeout
+        )
+
+    def setup_sharded(self,
+                      shards_dir: Optional[str] = None,
+                      mode: Optional[str] = None,
+                      timeout: Optional[float] = None) -> None:
+        """
+        Синхронная обертка для подключения поиска по шардам
+        """
+        asyncio.run(self.setup_sharded_async(shards_dir, mode, timeout))
+
+    def close_shards(self) -> None:
+        """
+        Закрывает шарды (останавливает рабочие процессы шардов).
+        """
+        if self.sharded is not None:
+            self.sharded.close()
+            self.sharded = None
+
+    def _search_index(self, query_embeddings: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+        """
+        Выполняет поиск по индексу FAISS, при наличии маски - только среди отобранных чанков.
+
+        Args:
+            query_embeddings (np.ndarray): Эмбеддинги запросов (float32, nq x dim)
+            k (int): Количество результатов на запрос
+            mask (Optional[np.ndarray]): Булева маска допустимых чанков
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Квадраты L2-расстояний и номера чанков (nq x k)
+        """
+        return search_index(self.llm.vectorstore.index, query_embeddings, k, mask)
+
+    def _search_ids(self,
+                    query_embeddings: np.ndarray,
+                    k: int,
+                    score_threshold: float,
+                    mask: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Пакетный поиск по матрице эмбеддингов запросов с векторизованным порогом.
+
+        Оценка релевантности вычисляется так же, как в FAISS из LangChain для
+        евклидова расстояния (1 - d / sqrt(2)), поэтому score_threshold имеет
+        тот же смысл, что и в search_kwargs базового ретривера. Дополнительно
+        применяется порог similarity_threshold по косинусной близости, которую
+        для нормализованных векторов можно получить из расстояния без
+        повторного вычисления эмбеддингов документов (1 - d / 2).
+
+        Args:
+            query_embeddings (np.ndarray): Нормализованные эмбеддинги запросов (nq x dim)
+            k (int): Количество кандидатов на запрос
+            score_threshold (float): Минимальная оценка релевантности
+            mask (Optional[np.ndarray]): Булева маска допустимых чанков
+
+        Returns:
+            List[Tuple[np.ndarray, np.ndarray]]: Для каждого запроса номера чанков
+                и их оценки релевантности в порядке убывания
+        """
+        nq = len(query_embeddings)
+        if mask is not None and not mask.any():
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(nq)]
+        distances, labels = self._search_index(
+            np.ascontiguousarray(query_embeddings, dtype=np.float32), k, mask
+        )
+        return threshold_hits(distances, labels, score_threshold, RAG_CONFIG["similarity_threshold"])
+
+    def _select_mask(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        Строит маску чанков по фильтрам метаданных.
+
+        Raises:
+            ValueError: Если фильтры заданы, а индекс метаданных не построен
+        """
+        if not filters:
+            return None
+        if getattr(self.llm, 'metadata_index', None) is None:
+            raise ValueError("Индекс метаданных не построен, фильтрация недоступна")
+        with span('filter') as filter_span:
+            mask = self.llm.metadata_index.select(filters)
+            if filter_span and mask is not None:
+                filter_span.set(candidates=int(np.count_nonzero(mask)))
+        return mask
+
+    def _ids_to_documents(self, ids) -> List[Document]:
+        """
+        Создает документы только для найденных номеров чанков.
+
+        Args:
+            ids: Номера чанков в индексе FAISS
+
+        Returns:
+            List[Document]: Документы в порядке переданных номеров
+        """
+        vectorstore = self.llm.vectorstore
+        if isinstance(vectorstore.docstore, CompactDocstore):
+            return vectorstore.docstore.get_documents(ids)
+        return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)]) for i in ids]
+
+    async def search_batch_with_scores_async(self,
+                                             queries: List[str],
+                                             k: Optional[int] = None,
+                                             score_threshold: Optional[float] = None,
+                                             filters: Optional[Dict] = None
+                                             ) -> List[List[Tuple[Document, float]]]:
+        """
+        Асинхронный пакетный поиск документов с оценками релевантности.
+
+        Процесс поиска:
+        1. Все запросы преобразуются в эмбеддинги одним вызовом encode
+        2. Выполняется один пакетный поиск FAISS по матрице запросов
+        3. Порог релевантности применяется векторизованно ко всей матрице оценок
+        4. Документы создаются только для прошедших порог результатов
+
+        Если заданы filters, по индексу метаданных строится маска чанков, и поиск
+        FAISS сканирует только подходящие чанки (см. MetadataIndex).
+
+        Args:
+            queries (List[str]): Список текстовых запросов
+            k (Optional[int]): Количество результатов на запрос (по умолчанию из search_kwargs)
+            score_threshold (Optional[float]): Порог релевантности (по умолчанию из search_kwargs)
+            filters (Optional[Dict]): Фильтры по метаданным (sources, directories, file_types, pages)
+
+        Returns:
+            List[List[Tuple[Document, float]]]: Для каждого запроса список пар
+                (документ, оценка релевантности) в порядке убывания оценки
+
+        Raises:
+            ValueError: Если векторное хранилище не создано
+        """
+        if not queries:
+            return []
+        if self.sharded is not None:
+            return await self._search_sharded_async(queries, k, score_threshold, filters)
+        if not hasattr(self.llm.vectorstore, 'index'):
+            raise ValueError("Векторное хранилище не инициализировано")
+        k = k or RAG_CONFIG["search_kwargs"]["k"]
+        if score_threshold is None:
+            score_threshold = RAG_CONFIG["search_kwargs"]["score_threshold"]
+        try:
+            logger.debug("Пакетный поиск документов для %s запросов", len(queries))
+            query_embeddings = await self.embedding_model.embed_documents_array_async(queries, stage='embed')
+            mask = self._select_mask(filters)
+            hits = await run_in_stage('search', self._search_ids, query_embeddings, k, score_threshold, mask)
+            results = [
+                list(zip(self._ids_to_documents(ids), scores.tolist()))
+                for ids, scores in hits
+            ]
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Пакетный поиск завершен: %s запросов, "
+                             "%s документов", len(queries), sum(len(r) for r in results))
+            return results
+        except Exception as e:
+            logger.error("Ошибка при пакетном поиске документов: %s", e)
+            raise
+
+    async def _search_sharded_async(self,
+                                    queries: List[str],
+                                    k: Optional[int],
+                                    score_threshold: Optional[float],
+                                    filters: Optional[Dict]) -> List[List[Tuple[Document, float]]]:
+        """
+        Пакетный поиск по шардам: фильтры метаданных применяются внутри каждого шарда.
+        """
+        k = k or RAG_CONFIG["search_kwargs"]["k"]
+        if score_threshold is None:
+            score_threshold = RAG_CONFIG["search_kwargs"]["score_threshold"]
+        try:
+            query_embeddings = await self.embedding_model.embed_documents_array_async(queries, stage='embed')
+            results, statuses = await self.sharded.search_async(
+                query_embeddings, k, score_threshold, RAG_CONFIG["similarity_threshold"], filters
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                skipped = [name for name, state in statuses.items() if state['status'] != 'ok']
+                logger.debug("Поиск по %s шардам: %s запросов, "
+                             "%s документов, пропущено шардов: %s",
+                             len(self.sharded.shards), len(queries), sum(len(r) for r in results), len(skipped))
+            return results
+        except Exception as e:
+            logger.error("Ошибка при поиске по шардам: %s", e)
+            raise
+
+    async def search_batch_async(self,
+                                 queries: List[str],
+                                 k: Optional[int] = None,
+                                 score_threshold: Optional[float] = None,
+                                 filters: Optional[Dict] = None) -> List[List[Document]]:
+        """
+        Асинхронный пакетный поиск документов для списка запросов.
+
+        Args:
+            queries (List[str]): Список текстовых запросов
+            k (Optional[int]): Количество результатов на запрос
+            score_threshold (Optional[float]): Порог релевантности
+            filters (Optional[Dict]): Фильтры по метаданным
+
+        Returns:
+            List[List[Document]]: Список релевантных документов для каждого запроса
+        """
+        results = await self.search_batch_with_scores_async(queries, k, score_threshold, filters)
+        return [[doc for doc, _ in result] for result in results]
+
+    def search_batch(self,
+                     queries: List[str],
+                     k: Optional[int] = None,
+                     score_threshold: Optional[float] = None,
+                     filters: Optional[Dict] = None) -> List[List[Document]]:
+        """
+        Синхронная обертка для пакетного поиска документов
+        """
+        return asyncio.run(self.search_batch_async(queries, k, score_threshold, filters))
+
+    async def hybrid_search_async(self,
+                                  query: str,
+                                  k: Optional[int] = None,
+                                  filters: Optional[Dict] = None) -> List[Document]:
+        """
+        Асинхронный гибридный поиск: плотный (FAISS) и лексический (BM25).
+
+        Процесс поиска:
+        1. Плотный поиск dense_k кандидатов с порогом score_threshold
+        2. Лексический поиск lexical_k кандидатов по индексу BM25
+           (оба этапа выполняются параллельно и учитывают фильтры метаданных)
+        3. Объединение списков через reciprocal rank fusion
+        4. Документы создаются только для k лучших объединенных результатов
+
+        Время каждого этапа сохраняется в self.last_timings (в миллисекундах).
+        Результат предназначен для последующего реранжирования cross-encoder.
+
+        Args:
+            query (str): Текстовый запрос пользователя
+            k (Optional[int]): Количество результатов (по умолчанию из search_kwargs)
+            filters (Optional[Dict]): Фильтры по метаданным
+
+        Returns:
+            List[Document]: Документы в порядке убывания оценки RRF
+
+        Raises:
+            ValueError: Если лексический индекс не построен
+        """
+        lexical_index = getattr(self.llm, 'lexical_index', None)
+        if lexical_index is None:
+            raise ValueError("Лексический индекс не построен, гибридный поиск недоступен")
+        hybrid_config = RAG_CONFIG["hybrid"]
+        k = k or RAG_CONFIG["search_kwargs"]["k"]
+        try:
+            mask = self._select_mask(filters)
+
+            async def dense_leg():
+                started = time.perf_counter()
+                query_embeddings = await self.embedding_model.embed_documents_array_async([query], stage='embed')
+                hits = await run_in_stage(
+                    'search',
+                    self._search_ids,
+                    query_embeddings,
+                    hybrid_config["dense_k"],
+                    RAG_CONFIG["search_kwargs"]["score_threshold"],
+                    mask
+                )
+                return hits[0][0], (time.perf_counter() - started) * 1000
+
+            async def lexical_leg():
+                started = time.perf_counter()
+                ids, _ = await run_in_stage('search', lexical_index.search, query, hybrid_config["lexical_k"], mask)
+                return ids, (time.perf_counter() - started) * 1000
+
+            (dense_ids, dense_ms), (lexical_ids, lexical_ms) = await asyncio.gather(dense_leg(), lexical_leg())
+
+            started = time.perf_counter()
+            fused_ids, _ = reciprocal_rank_fusion([dense_ids, lexical_ids], k, hybrid_config["rrf_k"])
+            documents = self._ids_to_documents(fused_ids)
+            fusion_ms = (time.perf_counter() - started) * 1000
+
+            self.last_timings = {'dense_ms': dense_ms, 'lexical_ms': lexical_ms, 'fusion_ms': fusion_ms}
+            logger.debug("Гибридный поиск: плотный %s за %.1f мс, "
+                         "лексический %s за %.1f мс, "
+                         "объединено %s за %.1f мс",
+                         len(dense_ids), dense_ms, len(lexical_ids), lexical_ms, len(documents), fusion_ms)
+            return documents
+        except Exception as e:
+            logger.error("Ошибка при гибридном поиске документов: %s", e)
+            raise
+
+    def hybrid_search(self, query: str, k: Optional[int] = None, filters: Optional[Dict] = None) -> List[Document]:
+        """
+        Синхронная обертка для гибридного поиска документов
+        """
+        return asyncio.run(self.hybrid_search_async(query, k, filters))
+
+    def _get_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Возвращает сохраненные в индексе векторы чанков без повторного вычисления эмбеддингов.
+
+        Args:
+            ids (np.ndarray): Номера чанков
+
+        Returns:
+            np.ndarray: Векторы чанков (float32, len(ids) x dim)
+        """
+        index = self.llm.vectorstore.index
+        ids = np.asarray(ids, dtype=np.int64)
+        if isinstance(index, RescoringIndex):
+            # Полноточные векторы читаются из файла, отображенного в память
+            return np.asarray(index.vectors[ids], dtype=np.float32)
+        return index.reconstruct_batch(ids)
+
+    async def mmr_search_async(self,
+                               query: str,
+                               k: Optional[int] = None,
+                               fetch_k: Optional[int] = None,
+                               lambda_mult: Optional[float] = None,
+                               filters: Optional[Dict] = None) -> List[Document]:
+        """
+        Асинхронный поиск с диверсификацией результатов методом MMR.
+
+        Процесс поиска:
+        1. Плотный поиск fetch_k кандидатов с порогом score_threshold
+        2. Извлечение векторов кандидатов из индекса (без повторного вычисления эмбеддингов)
+        3. Векторизованный отбор k кандидатов по одной матрице попарных близостей
+
+        Args:
+            query (str): Текстовый запрос пользователя
+            k (Optional[int]): Количество результатов (по умолчанию из search_kwargs)
+            fetch_k (Optional[int]): Количество кандидатов (по умолчанию из RAG_CONFIG['mmr'])
+            lambda_mult (Optional[float]): Баланс релевантности и разнообразия
+            filters (Optional[Dict]): Фильтры по метаданным
+
+        Returns:
+            List[Document]: Разнообразные релевантные документы в порядке отбора
+        """
+        mmr_config = RAG_CONFIG["mmr"]
+        k = k or RAG_CONFIG["search_kwargs"]["k"]
+        fetch_k = max(fetch_k or mmr_config["fetch_k"], k)
+        if lambda_mult is None:
+            lambda_mult = mmr_config["lambda_mult"]
+        try:
+            mask = self._select_mask(filters)
+            query_embeddings = await self.embedding_model.embed_documents_array_async([query], stage='embed')
+
+            def select():
+                ids, _ = self._search_ids(
+                    query_embeddings,
+                    fetch_k,
+                    RAG_CONFIG["search_kwargs"]["score_threshold"],
+                    mask
+                )[0]
+                if ids.size == 0:
+                    return ids
+                positions = maximal_marginal_relevance(query_embeddings[0], self._get_vectors(ids), k, lambda_mult)
+                return ids[positions]
+
+            selected_ids = await run_in_stage('search', select)
+            logger.debug("MMR: выбрано %s документов из %s кандидатов", len(selected_ids), fetch_k)
+            return self._ids_to_documents(selected_ids)
+        except Exception as e:
+            logger.error("Ошибка при поиске документов с MMR: %s", e)
+            raise
+
+    def mmr_search(self,
+                   query: str,
+                   k: Optional[int] = None,
+                   fetch_k: Optional[int] = None,
+                   lambda_mult: Optional[float] = None,
+                   filters: Optional[Dict] = None) -> List[Document]:
+        """
+        Синхронная обертка для поиска с диверсификацией MMR
+        """
+        return asyncio.run(self.mmr_search_async(query, k, fetch_k, lambda_mult, filters))
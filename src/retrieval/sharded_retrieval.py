@@ -0,0 +1,371 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.mylogger import Logger
+from src.date.compact_docstore import CompactDocstore
+from src.date.metadata_index import MetadataIndex
+from src.date.quantized_index import RescoringIndex, load_flat_index
+from src.date.sharded_build import DOCSTORE_DIR, INDEX_FILE, METADATA_DIR, load_manifest
+
+logger = Logger('ShardedRetrieval', 'logs/rag.log')
+
+# Результат поиска в шарде для одного запроса: (глобальный номер, оценка, текст, метаданные)
+ShardHit = Tuple[int, float, str, dict]
+
+
+def search_index(index, query_embeddings: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+    """
+    Выполняет поиск по индексу FAISS, при наличии маски - только среди отобранных чанков.
+
+    Args:
+        index: Индекс FAISS или RescoringIndex
+        query_embeddings (np.ndarray): Эмбеддинги запросов (float32, nq x dim)
+        k (int): Количество результатов на запрос
+        mask (Optional[np.ndarray]): Булева маска допустимых чанков
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Квадраты L2-расстояний и номера чанков (nq x k)
+    """
+    if mask is None:
+        return index.search(query_embeddings, k)
+    if isinstance(index, RescoringIndex) and index.precision == 'binary':
+        # Бинарные индексы FAISS не принимают селектор, поэтому выполняем
+        # точный поиск по полноточным векторам отобранных чанков
+        return index.search_subset(query_embeddings, k, np.flatnonzero(mask))
+    # bitmap должен оставаться в памяти, пока выполняется поиск с селектором
+    selector, bitmap = MetadataIndex.to_selector(mask)
+    return index.search(query_embeddings, k, params=faiss.SearchParameters(sel=selector))
+
+
+def threshold_hits(distances: np.ndarray,
+                   labels: np.ndarray,
+                   score_threshold: float,
+                   similarity_threshold: float) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Переводит L2-расстояния в оценки релевантности и применяет пороги.
+
+    Оценка вычисляется так же, как в FAISS из LangChain для евклидова расстояния
+    (1 - d / sqrt(2)); косинусная близость нормализованных векторов - 1 - d / 2.
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: Для каждого запроса номера и оценки прошедших порог
+    """
+    scores = 1.0 - distances / np.sqrt(2)
+    keep = (labels >= 0) & (scores >= score_threshold)
+    keep &= (1.0 - distances / 2) >= similarity_threshold
+    return [(labels[row][keep[row]], scores[row][keep[row]]) for row in range(labels.shape[0])]
+
+
+class LocalShard:
+    """
+    Шард индекса в текущем процессе: индекс FAISS, колоночное хранилище и индекс метаданных.
+
+    Attributes:
+        name (str): Имя шарда
+        offset (int): Смещение номеров чанков шарда в глобальной нумерации
+    """
+    def __init__(self, name: str, index, docstore: CompactDocstore, metadata_index: MetadataIndex, offset: int) -> None:
+        self.name = name
+        self.index = index
+        self.docstore = docstore
+        self.metadata_index = metadata_index
+        self.offset = offset
+
+    @classmethod
+    def load(cls, shard_dir: str, offset: int = 0, mmap: bool = True) -> "LocalShard":
+        """
+        Загружает шард, сохраненный VectorStore.save_vector_store или ShardedIndexBuilder.
+        """
+        if RescoringIndex.exists(shard_dir):
+            index = RescoringIndex.load(shard_dir)
+        else:
+            index = load_flat_index(os.path.join(shard_dir, INDEX_FILE), mmap)
+        docstore = CompactDocstore.load(os.path.join(shard_dir, DOCSTORE_DIR), mmap)
+        metadata_path = os.path.join(shard_dir, METADATA_DIR)
+        if os.path.exists(metadata_path):
+            metadata_index = MetadataIndex.load(metadata_path, docstore, mmap)
+        else:
+            metadata_index = MetadataIndex.from_docstore(docstore)
+        return cls(os.path.basename(os.path.normpath(shard_dir)), index, docstore, metadata_index, offset)
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def search(self,
+               query_embeddings: np.ndarray,
+               k: int,
+               score_threshold: float,
+               similarity_threshold: float,
+               filters: Optional[Dict] = None) -> List[List[ShardHit]]:
+        """
+        Поиск k лучших чанков шарда для каждого запроса с порогами релевантности.
+
+        Returns:
+            List[List[ShardHit]]: Для каждого запроса найденные чанки с глобальными номерами
+        """
+        mask = self.metadata_index.select(filters) if filters else None
+        if mask is not None and not mask.any():
+            return [[] for _ in range(len(query_embeddings))]
+        distances, labels = search_index(
+            self.index, np.ascontiguousarray(query_embeddings, dtype=np.float32), min(k, self.index.ntotal), mask
+        )
+        results = []
+        for ids, scores in threshold_hits(distances, labels, score_threshold, similarity_threshold):
+            results.append([
+                (self.offset + int(i), float(score), self.docstore.get_text(int(i)), self.docstore.get_metadata(int(i)))
+                for i, score in zip(ids, scores)
+            ])
+        return results
+
+    async def search_async(self, *args) -> List[List[ShardHit]]:
+        return await asyncio.to_thread(self.search, *args)
+
+    def close(self) -> None:
+        pass
+
+
+def _serve_shard(shard_dir: str, offset: int, conn, threads: int) -> None:
+    """
+    Цикл рабочего процесса шарда: загружает шард и отвечает на запросы из канала.
+
+    Запрос - кортеж (номер, метод, аргументы), ответ - (номер, успех, результат или текст ошибки).
+    """
+    faiss.omp_set_num_threads(threads)
+    try:
+        shard = LocalShard.load(shard_dir, offset)
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+        return
+    conn.send(('ready', len(shard)))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        request_id, method, args = message
+        try:
+            conn.send((request_id, True, getattr(shard, method)(*args)))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {str(e)}"))
+
+
+def _resolve(future: asyncio.Future, ok: bool, payload) -> None:
+    if future.done():
+        return
+    if ok:
+        future.set_result(payload)
+    else:
+        future.set_exception(RuntimeError(payload))
+
+
+class ShardProcess:
+    """
+    Шард индекса в отдельном рабочем процессе за локальным RPC (multiprocessing.Pipe).
+
+    Запросы отправляются в канал с номером; поток чтения сопоставляет ответы
+    с ожидающими запросами по номеру. Ответы на запросы, которые уже завершились
+    по таймауту, отбрасываются.
+
+    Attributes:
+        name (str): Имя шарда
+        offset (int): Смещение номеров чанков шарда в глобальной нумерации
+    """
+    def __init__(self, shard_dir: str, offset: int = 0, threads: int = 1, start_timeout: float = 120.0) -> None:
+        self.name = os.path.basename(os.path.normpath(shard_dir))
+        self.offset = offset
+        context = multiprocessing.get_context('spawn')
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_serve_shard, args=(shard_dir, offset, child_conn, threads), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        if not self._conn.poll(start_timeout):
+            self._process.kill()
+            raise TimeoutError(f"Шард {self.name} не загрузился за {start_timeout} с")
+        status, payload = self._conn.recv()
+        if status != 'ready':
+            self._process.join()
+            raise RuntimeError(f"Не удалось загрузить шард {self.name}: {payload}")
+        self.size = payload
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._reader = threading.Thread(target=self._read_loop, name=f'shard-{self.name}', daemon=True)
+        self._reader.start()
+        logger.info("Шард %s запущен в процессе %s: %s чанков", self.name, self._process.pid, self.size)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _read_loop(self) -> None:
+        while True:
+            try:
+                request_id, ok, payload = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is not None:
+                loop, future = entry
+                loop.call_soon_threadsafe(_resolve, future, ok, payload)
+        # Процесс шарда завершился: ожидающие запросы завершаются ошибкой
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for loop, future in pending.values():
+            loop.call_soon_threadsafe(_resolve, future, False, f"Процесс шарда {self.name} завершился")
+
+    async def _call(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = (loop, future)
+            self._conn.send((request_id, method, args))
+        try:
+            return await future
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    async def search_async(self, *args) -> List[List[ShardHit]]:
+        return await self._call('search', *args)
+
+    def close(self) -> None:
+        """
+        Останавливает процесс шарда.
+        """
+        try:
+            with self._lock:
+                self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.kill()
+        self._conn.close()
+
+
+class ShardedSearcher:
+    """
+    Поиск по N шардам индекса с параллельной рассылкой запроса и объединением top-k.
+
+    Каждый шард возвращает свои k лучших чанков, прошедших пороги релевантности;
+    оценки всех шардов вычисляются одинаково, поэтому объединение по оценке
+    и отбор k лучших дают тот же результат, что и поиск по общему индексу
+    с тем же score_threshold. Номера чанков глобальные (смещение шарда из манифеста).
+
+    Шард, не ответивший за timeout секунд или завершившийся с ошибкой, пропускается:
+    результат строится по остальным шардам, состояние каждого шарда возвращается
+    вместе с результатом запроса.
+
+    Attributes:
+        shards (List): Шарды (LocalShard или ShardProcess)
+        timeout (float): Таймаут ответа одного шарда в секундах
+    """
+    def __init__(self, shards: List, timeout: float = 5.0) -> None:
+        self.shards = shards
+        self.timeout = timeout
+
+    @classmethod
+    def from_manifest(cls, shards_dir: str, mode: str = 'local', timeout: float = 5.0) -> "ShardedSearcher":
+        """
+        Открывает шарды из директории с манифестом shards.json.
+
+        Args:
+            shards_dir (str): Директория шардов
+            mode (str): local - шарды в текущем процессе, process - каждый шард
+                в отдельном рабочем процессе (локальный многопроцессный режим)
+            timeout (float): Таймаут ответа одного шарда в секундах
+
+        Raises:
+            ValueError: Если режим не поддерживается
+        """
+        if mode not in ('local', 'process'):
+            raise ValueError(f"Неподдерживаемый режим шардов: {mode}. Допустимые значения: local, process")
+        manifest = load_manifest(shards_dir)
+        threads = max(1, (os.cpu_count() or 1) // max(1, len(manifest['shards'])))
+        shards = []
+        try:
+            for entry in manifest['shards']:
+                path = os.path.join(shards_dir, entry['path'])
+                if mode == 'process':
+                    shards.append(ShardProcess(path, entry['offset'], threads))
+                else:
+                    shards.append(LocalShard.load(path, entry['offset']))
+        except Exception:
+            for shard in shards:
+                shard.close()
+            raise
+        logger.info("Открыто %s шардов (%s): %s чанков", len(shards), mode, manifest['total_chunks'])
+        return cls(shards, timeout)
+
+    async def _search_shard(self, shard, *args) -> Tuple[Optional[List[List[ShardHit]]], Dict]:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(shard.search_async(*args), self.timeout)
+            status = 'ok'
+        except asyncio.TimeoutError:
+            logger.warning("Шард %s не ответил за %s с и пропущен", shard.name, self.timeout)
+            result, status = None, 'timeout'
+        except Exception as e:
+            logger.error("Ошибка поиска в шарде %s: %s", shard.name, e)
+            result, status = None, 'error'
+        return result, {'status': status, 'ms': (time.perf_counter() - started) * 1000}
+
+    async def search_async(self,
+                           query_embeddings: np.ndarray,
+                           k: int,
+                           score_threshold: float,
+                           similarity_threshold: float,
+                           filters: Optional[Dict] = None
+                           ) -> Tuple[List[List[Tuple[Document, float]]], Dict[str, Dict]]:
+        """
+        Параллельный поиск во всех шардах и объединение k лучших результатов по оценке.
+
+        Returns:
+            Tuple[List[List[Tuple[Document, float]]], Dict[str, Dict]]: Для каждого запроса
+                пары (документ, оценка) в порядке убывания оценки и состояние шардов
+                этого вызова: имя шарда -> {'status': 'ok' | 'timeout' | 'error', 'ms': время}
+
+        Raises:
+            RuntimeError: Если не ответил ни один шард
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        # Состояние шардов - локальное для вызова: одновременные запросы не перезаписывают его
+        replies = await asyncio.gather(*(
+            self._search_shard(shard, query_embeddings, k, score_threshold, similarity_threshold, filters)
+            for shard in self.shards
+        ))
+        statuses = {shard.name: status for shard, (_, status) in zip(self.shards, replies)}
+        answered = [result for result, _ in replies if result is not None]
+        if not answered:
+            raise RuntimeError("Ни один шард не ответил на запрос")
+        merged = []
+        for row in range(len(query_embeddings)):
+            hits = [hit for result in answered for hit in result[row]]
+            # При равных оценках порядок определяется глобальным номером, как в общем индексе
+            hits.sort(key=lambda hit: (-hit[1], hit[0]))
+            merged.append([
+                (Document(page_content=text, metadata=metadata), score)
+                for _, score, text, metadata in hits[:k]
+            ])
+        return merged, statuses
+
+    def close(self) -> None:
+        """
+        Закрывает все шарды (останавливает рабочие процессы).
+        """
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,177 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+import asyncio
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from utils.mylogger import Logger
+
+# Инициализация логгера для отслеживания допуска запросов
+logger = Logger('AdmissionController', 'logs/rag.log')
+
+
+class AdmissionRejected(RuntimeError):
+    """
+    Запрос отклонен: очередь допуска заполнена или время ожидания в ней истекло.
+    """
+
+
+class _WaitStats:
+    """
+    Счетчики и последние времена ожидания одной очереди (допуска или этапа).
+    """
+    def __init__(self, window: int) -> None:
+        self.waiting = 0
+        self.active = 0
+        self.waits_ms = deque(maxlen=window)
+
+    def snapshot(self) -> Dict:
+        waits = np.fromiter(self.waits_ms, dtype=np.float64, count=len(self.waits_ms))
+        return {
+            'waiting': self.waiting,
+            'active': self.active,
+            'wait_ms_p50': round(float(np.percentile(waits, 50)), 1) if waits.size else 0.0,
+            'wait_ms_p95': round(float(np.percentile(waits, 95)), 1) if waits.size else 0.0,
+        }
+
+
+class AdmissionController:
+    """
+    Допуск запросов и ограничение параллельности этапов.
+
+    При всплеске запросов каждый вопрос сразу начинает эмбеддинг, реранжирование
+    и обращения к LLM, и все запросы замедляются одновременно. Контроллер
+    пропускает к обработке не более max_concurrent запросов, остальные ждут
+    в ограниченной очереди (max_queue):
+    - запрос, пришедший при полной очереди, отклоняется сразу
+    - запрос, прождавший в очереди дольше queue_timeout секунд, отклоняется
+    Отклоненные запросы завершаются быстро и не отнимают ресурсы у допущенных,
+    поэтому пропускная способность остается стабильной.
+
+    Внутри запроса этапы (retrieve, rerank, llm) ограничиваются своими семафорами,
+    чтобы медленный этап не накапливал все допущенные запросы.
+
+    Семафоры создаются для каждого цикла событий отдельно (CLI, рабочие процессы
+    сервера и синхронные обертки используют разные циклы).
+
+    Attributes:
+        max_concurrent (int): Количество одновременно обрабатываемых запросов
+        max_queue (int): Количество запросов, ожидающих допуска
+        queue_timeout (float): Время ожидания в очереди в секундах
+        stage_limits (Dict[str, int]): Ограничение параллельности этапов
+    """
+    def __init__(self,
+                 max_concurrent: int = 8,
+                 max_queue: int = 64,
+                 queue_timeout: float = 10.0,
+                 stage_limits: Optional[Dict[str, int]] = None,
+                 window: int = 1024) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.stage_limits = dict(stage_limits or {})
+        self.admission = _WaitStats(window)
+        self.stages = {stage: _WaitStats(window) for stage in self.stage_limits}
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._semaphores = weakref.WeakKeyDictionary()
+        # Счетчики обновляются из разных циклов событий (например, синхронных оберток в потоках)
+        self._lock = threading.Lock()
+
+    def _semaphore(self, name: Optional[str]) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = {None: asyncio.Semaphore(self.max_concurrent)}
+            semaphores.update({stage: asyncio.Semaphore(limit) for stage, limit in self.stage_limits.items()})
+            self._semaphores[loop] = semaphores
+        return semaphores[name]
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Контекст обработки запроса: ждет свободного места не дольше queue_timeout.
+
+        Raises:
+            AdmissionRejected: Если очередь заполнена или время ожидания истекло
+        """
+        semaphore = self._semaphore(None)
+        with self._lock:
+            # Ожидающие допуска учитываются сразу, до захвата семафора
+            if self.admission.active + self.admission.waiting >= self.max_concurrent + self.max_queue:
+                self.rejected_full += 1
+                logger.warning("Запрос отклонен: очередь заполнена (%s запросов)", self.max_queue)
+                raise AdmissionRejected("Сервер перегружен: очередь запросов заполнена, повторите запрос позже")
+            self.admission.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.rejected_timeout += 1
+            logger.warning("Запрос отклонен: ожидание в очереди дольше %s с", self.queue_timeout)
+            raise AdmissionRejected("Сервер перегружен: время ожидания в очереди истекло, повторите запрос позже")
+        finally:
+            with self._lock:
+                self.admission.waiting -= 1
+        with self._lock:
+            self.admission.waits_ms.append((time.perf_counter() - started) * 1000)
+            self.admission.active += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.admission.active -= 1
+            semaphore.release()
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """
+        Контекст этапа запроса; этапы без ограничения в stage_limits выполняются сразу.
+        """
+        stats = self.stages.get(name)
+        if stats is None:
+            yield
+            return
+        semaphore = self._semaphore(name)
+        with self._lock:
+            stats.waiting += 1
+        started = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            with self._lock:
+                stats.waiting -= 1
+        with self._lock:
+            stats.waits_ms.append((time.perf_counter() - started) * 1000)
+            stats.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                stats.active -= 1
+            semaphore.release()
+
+    def snapshot(self) -> Dict:
+        """
+        Метрики: длина очереди, обрабатываемые запросы, время ожидания (p50/p95)
+        и количество отклоненных запросов, в том числе по этапам.
+        """
+        with self._lock:
+            admission = self.admission.snapshot()
+            return {
+                'queue_length': admission['waiting'],
+                'in_flight': admission['active'],
+                'admitted': self.admitted,
+                'rejected_queue_full': self.rejected_full,
+                'rejected_timeout': self.rejected_timeout,
+                'wait_ms_p50': admission['wait_ms_p50'],
+                'wait_ms_p95': admission['wait_ms_p95'],
+                'stages': {name: stats.snapshot() for name, stats in self.stages.items()},
+            }
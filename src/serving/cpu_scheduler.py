@@ -0,0 +1,218 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+
+from utils.mylogger import Logger
+from config import RAG_CONFIG
+
+# Инициализация логгера для отслеживания распределения потоков
+logger = Logger('CPUScheduler', 'logs/rag.log')
+
+STAGES = ('embed', 'rerank', 'search')
+
+
+def available_cores() -> int:
+    """
+    Количество ядер, доступных процессу (с учетом привязки к ядрам и ограничений контейнера).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan_profile(profile: str, cores: int) -> Dict:
+    """
+    Распределение ядер между этапами запроса для профиля.
+
+    - latency: по одному исполнителю на этап, каждая операция использует
+      половину ядер (эмбеддинг одного запроса и реранжирование другого
+      выполняются одновременно, не превышая числа ядер)
+    - throughput: операции однопоточные, параллельно выполняется столько
+      операций, сколько ядер отведено этапу; эмбеддинг и реранжирование
+      получают по половине ядер, поиск FAISS - четверть
+
+    Returns:
+        Dict: torch_threads (потоки torch, общие для embed и rerank) и
+            для каждого этапа {'workers': исполнители, 'threads': потоки операции}
+
+    Raises:
+        ValueError: Если профиль неизвестен
+    """
+    half = max(1, cores // 2)
+    if profile == 'latency':
+        return {
+            'torch_threads': half,
+            'embed': {'workers': 1, 'threads': half},
+            'rerank': {'workers': 1, 'threads': half},
+            'search': {'workers': 1, 'threads': half},
+        }
+    if profile == 'throughput':
+        return {
+            'torch_threads': 1,
+            'embed': {'workers': half, 'threads': 1},
+            'rerank': {'workers': half, 'threads': 1},
+            'search': {'workers': max(1, cores // 4), 'threads': 1},
+        }
+    raise ValueError(f"Неизвестный профиль планировщика: {profile}. Доступные профили: latency, throughput, off")
+
+
+class CPUScheduler:
+    """
+    Распределение ядер между этапами запроса: эмбеддинг, реранжирование, поиск.
+
+    asyncio.to_thread выполняет все этапы в общем пуле потоков, а torch и
+    OpenMP (FAISS) в каждой операции запускают столько потоков, сколько ядер.
+    При нескольких одновременных запросах потоков становится в разы больше,
+    чем ядер, и задержка p99 резко растет. Планировщик выделяет каждому этапу
+    свой пул исполнителей и задает количество потоков операций:
+    - torch.set_num_threads - общее для эмбеддинга и реранжирования
+      (в torch количество потоков задается на процесс)
+    - faiss.omp_set_num_threads - в каждом потоке поиска (в OpenMP
+      количество потоков задается на поток)
+
+    Профиль off отключает планировщик: этапы выполняются через asyncio.to_thread.
+
+    Attributes:
+        profile (str): Профиль (latency, throughput или off)
+        cores (int): Количество ядер, распределяемых между этапами
+        plan (Dict): Распределение ядер (см. plan_profile)
+    """
+    def __init__(self, profile: str = 'latency', cores: int = 0, overrides: Optional[Dict] = None) -> None:
+        """
+        Args:
+            profile (str): Профиль распределения ядер
+            cores (int): Количество ядер (0 - все доступные процессу)
+            overrides (Optional[Dict]): Явные значения поверх профиля,
+                например {'embed': {'workers': 2}, 'torch_threads': 4}
+        """
+        self.profile = profile
+        self.cores = cores or available_cores()
+        self.plan = None if profile == 'off' else plan_profile(profile, self.cores)
+        for key, value in (overrides or {}).items():
+            if isinstance(value, dict):
+                self.plan[key].update(value)
+            else:
+                self.plan[key] = value
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._configured = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.plan is not None
+
+    def _configure(self) -> None:
+        try:
+            import torch
+        except ImportError:
+            # Модели без torch (локальные заменители в бенчмарках): распределяются только пулы этапов
+            torch = None
+        if torch is not None:
+            torch.set_num_threads(self.plan['torch_threads'])
+        self._configured = True
+        logger.info("Профиль %s на %s ядрах: потоков torch %s, %s",
+                    self.profile, self.cores, self.plan['torch_threads'],
+                    ", ".join(f"{stage} {self.plan[stage]['workers']}x{self.plan[stage]['threads']}"
+                              for stage in STAGES))
+
+    @staticmethod
+    def _init_search_thread(threads: int) -> None:
+        import faiss
+
+        faiss.omp_set_num_threads(threads)
+
+    def executor(self, stage: str) -> ThreadPoolExecutor:
+        """
+        Пул исполнителей этапа (создается при первом обращении).
+
+        Raises:
+            KeyError: Если этап неизвестен
+        """
+        executor = self._executors.get(stage)
+        if executor is not None:
+            return executor
+        with self._lock:
+            if not self._configured:
+                self._configure()
+            if stage not in self._executors:
+                settings = self.plan[stage]
+                initializer, initargs = None, ()
+                if stage == 'search':
+                    initializer, initargs = self._init_search_thread, (settings['threads'],)
+                self._executors[stage] = ThreadPoolExecutor(
+                    max_workers=settings['workers'],
+                    thread_name_prefix=f'rag-{stage}',
+                    initializer=initializer,
+                    initargs=initargs
+                )
+            return self._executors[stage]
+
+    async def run(self, stage: str, func: Callable, *args, **kwargs):
+        """
+        Выполняет функцию в пуле этапа, как asyncio.to_thread (с копией контекста).
+        """
+        if not self.enabled:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor(stage), call)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Останавливает пулы этапов.
+        """
+        with self._lock:
+            executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=wait)
+
+    def _reset_after_fork(self) -> None:
+        # Потоки пулов не переживают fork: дочерний процесс создает свои пулы
+        self._executors = {}
+        self._configured = False
+        self._lock = threading.Lock()
+
+
+_scheduler: Optional[CPUScheduler] = None
+
+
+def get_scheduler() -> CPUScheduler:
+    """
+    Планировщик процесса, созданный по RAG_CONFIG['cpu_scheduler'].
+    """
+    global _scheduler
+    if _scheduler is None:
+        config = RAG_CONFIG['cpu_scheduler']
+        _scheduler = CPUScheduler(config['profile'], config['cores'])
+    return _scheduler
+
+
+def set_scheduler(scheduler: CPUScheduler) -> None:
+    """
+    Заменяет планировщик процесса (например, в рабочем процессе сервера с его долей ядер).
+    """
+    global _scheduler
+    previous, _scheduler = _scheduler, scheduler
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+async def run_in_stage(stage: str, func: Callable, *args, **kwargs):
+    """
+    Выполняет функцию этапа запроса (embed, rerank, search) в пуле планировщика.
+    """
+    return await get_scheduler().run(stage, func, *args, **kwargs)
+
+
+def _after_fork_in_child() -> None:
+    if _scheduler is not None:
+        _scheduler._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
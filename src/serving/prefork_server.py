@@ -0,0 +1,345 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+from utils.mylogger import Logger, flush_logs
+from src.serving.admission import AdmissionRejected
+from src.serving.cpu_scheduler import CPUScheduler, set_scheduler
+from src.monitoring.tracing import get_tracer
+from config import RAG_CONFIG
+
+# Инициализация логгера для отслеживания работы сервера
+logger = Logger('PreforkServer', 'logs/rag.log')
+
+
+def memory_usage() -> Dict[str, int]:
+    """
+    Память текущего процесса в килобайтах по /proc/self/smaps_rollup (только Linux).
+
+    Pss делит разделяемые страницы между процессами, поэтому сумма Pss всех рабочих
+    процессов показывает реальный общий объем памяти. Пустой словарь, если данные недоступны.
+    """
+    fields = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    usage[name.lower() + '_kb'] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def configure_worker_threads(threads: int) -> None:
+    """
+    Ограничивает количество потоков torch и FAISS в рабочем процессе,
+    чтобы рабочие процессы вместе не занимали больше потоков, чем ядер.
+    """
+    import faiss
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError:
+        # Количество межоперационных потоков можно задать только до первой параллельной работы
+        pass
+    faiss.omp_set_num_threads(threads)
+
+
+class _WorkerHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер рабочего процесса на уже открытом слушающем сокете родителя.
+
+    Каждое соединение обслуживается в своем потоке, а запросы к RAG выполняются
+    в одном цикле событий процесса (loop), который работает в отдельном потоке.
+    Поэтому рабочий процесс ведет несколько запросов одновременно, и очередь
+    допуска и ограничения этапов (AdmissionController) действуют внутри процесса.
+    """
+    def __init__(self, listen_socket: socket.socket, handler, llm, loop: asyncio.AbstractEventLoop, slot: int) -> None:
+        # Сокет создан и привязан родителем, поэтому bind и listen не выполняются
+        super().__init__(listen_socket.getsockname()[:2], handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listen_socket
+        self.server_name, self.server_port = listen_socket.getsockname()[:2]
+        self.llm = llm
+        self.loop = loop
+        self.slot = slot
+        self.requests_served = 0
+        self._served_lock = threading.Lock()
+
+    def run(self, coro):
+        """
+        Выполняет корутину в цикле событий процесса и ждет результат в потоке соединения.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def count_served(self) -> None:
+        with self._served_lock:
+            self.requests_served += 1
+
+
+class _RAGRequestHandler(BaseHTTPRequestHandler):
+    """
+    Обработчик запросов рабочего процесса:
+    - GET /health - состояние и память рабочего процесса
+    - GET /metrics - очередь допуска и время ожидания запросов (AdmissionController),
+      сводка по этапам запроса
+    - GET /metrics/prometheus - метрики этапов в текстовом формате Prometheus
+    - GET /traces - последние трассы запросов в JSON
+    Метрики и трассы относятся к рабочему процессу, который принял соединение (поле pid).
+    - POST /query - ответ на вопрос, тело JSON {"question", "filters", "collection"};
+      503 с Retry-After, если запрос отклонен допуском, 500 при ошибке обработки
+    """
+    server: _WorkerHTTPServer
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics':
+            admission = getattr(self.server.llm, 'admission', None)
+            self._send_json(200, {
+                'pid': os.getpid(),
+                'admission': admission.snapshot() if admission is not None else None,
+                'stages': get_tracer().metrics.snapshot(),
+            })
+            return
+        if self.path == '/metrics/prometheus':
+            body = get_tracer().metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == '/traces':
+            self._send_json(200, {'pid': os.getpid(), 'traces': list(get_tracer().traces)})
+            return
+        if self.path != '/health':
+            self._send_json(404, {'error': 'not found'})
+            return
+        self._send_json(200, {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'worker': self.server.slot,
+            'requests_served': self.server.requests_served,
+            'memory': memory_usage(),
+        })
+
+    def do_POST(self) -> None:
+        if self.path != '/query':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            question = request['question']
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': f"Некорректный запрос: {str(e)}"})
+            return
+        started = time.perf_counter()
+        try:
+            answer = self.server.run(
+                self.server.llm.query_async(question, filters=request.get('filters'), collection=request.get('collection'))
+            )
+        except AdmissionRejected as e:
+            # Отклоненный запрос завершается сразу: клиент повторяет его позже
+            self._send_json(503, {'error': str(e)}, {'Retry-After': '1'})
+            return
+        except Exception as e:
+            logger.exception("Ошибка при обработке запроса: %s", e)
+            self._send_json(500, {'error': f"Внутренняя ошибка: {str(e)}", 'pid': os.getpid()})
+            return
+        self.server.count_served()
+        self._send_json(200, {
+            'answer': answer,
+            'pid': os.getpid(),
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug("%s " + format, self.address_string(), *args)
+
+
+class PreforkServer:
+    """
+    Многопроцессный HTTP-сервер, разделяющий один индекс между рабочими процессами.
+
+    Родительский процесс один раз загружает модели, индекс FAISS и колоночное
+    хранилище (отображенные в память из файлов), открывает слушающий сокет и
+    создает рабочие процессы через fork. Рабочие процессы разделяют страницы
+    моделей и индекса с родителем по copy-on-write, а страницы отображенных
+    файлов - через общий страничный кэш, поэтому память почти не растет
+    с числом рабочих процессов, а пропускная способность растет.
+
+    Меры против копирования страниц и переподписки ядер:
+    - перед fork объекты родителя исключаются из сборки мусора (gc.freeze),
+      иначе проход GC в рабочем процессе записывает в заголовки объектов
+      и копирует страницы
+    - каждый рабочий процесс ограничивает потоки torch и FAISS
+      (threads_per_worker, по умолчанию ядра / рабочие процессы)
+    - родитель не выполняет вычислений моделей до fork: пулы потоков OpenMP
+      не переживают fork, а CUDA не поддерживает fork, поэтому модели должны быть на CPU
+
+    Рабочие процессы принимают соединения с общего сокета и обслуживают их
+    в потоках, выполняя запросы в одном цикле событий процесса, поэтому
+    одновременных запросов может быть больше, чем рабочих процессов.
+    Завершившийся рабочий процесс перезапускается; если он завершился вскоре
+    после запуска (например, падает при старте), перезапуск откладывается
+    с удвоением паузы до RESTART_BACKOFF_MAX секунд.
+    Поддерживаются только системы с os.fork.
+
+    Attributes:
+        host (str): Адрес сервера
+        port (int): Порт сервера
+        workers (int): Количество рабочих процессов
+        threads_per_worker (int): Потоки torch и FAISS в рабочем процессе
+    """
+    # Рабочий процесс, проработавший меньше RESTART_MIN_UPTIME секунд, считается упавшим при запуске
+    RESTART_MIN_UPTIME = 10.0
+    RESTART_BACKOFF = 0.5
+    RESTART_BACKOFF_MAX = 30.0
+
+    def __init__(self,
+                 llm,
+                 host: str = '127.0.0.1',
+                 port: int = 8000,
+                 workers: int = 2,
+                 threads_per_worker: int = 0,
+                 backlog: int = 128) -> None:
+        self.llm = llm
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.backlog = backlog
+        self.socket: Optional[socket.socket] = None
+        self._children: Dict[int, int] = {}
+        # Время начала работы и число быстрых завершений подряд для каждого слота
+        self._started: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._stopping = False
+
+    def _spawn(self, slot: int, delay: float = 0.0) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(slot, delay)
+            except BaseException as e:
+                logger.error("Рабочий процесс %s завершился с ошибкой: %s", slot, e)
+                code = 1
+            finally:
+                flush_logs()
+                os._exit(code)
+        self._children[pid] = slot
+        self._started[slot] = time.monotonic() + delay
+
+    def _restart_delay(self, slot: int) -> float:
+        """
+        Пауза перед перезапуском: удваивается, пока рабочий процесс завершается вскоре после запуска.
+        """
+        uptime = time.monotonic() - self._started.get(slot, 0.0)
+        if uptime >= self.RESTART_MIN_UPTIME:
+            self._failures[slot] = 0
+            return 0.0
+        self._failures[slot] = self._failures.get(slot, 0) + 1
+        return min(self.RESTART_BACKOFF_MAX, self.RESTART_BACKOFF * 2 ** (self._failures[slot] - 1))
+
+    def _run_worker(self, slot: int, delay: float = 0.0) -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Пауза выдерживается в дочернем процессе: родитель продолжает следить
+        # за остальными рабочими процессами и сигналами остановки
+        if delay:
+            time.sleep(delay)
+        configure_worker_threads(self.threads_per_worker)
+        # Этапы запроса распределяют между собой только ядра этого рабочего процесса
+        set_scheduler(CPUScheduler(RAG_CONFIG['cpu_scheduler']['profile'], self.threads_per_worker))
+        # Цикл событий процесса работает в своем потоке, потоки соединений передают ему запросы
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name='worker-loop', daemon=True).start()
+        server = _WorkerHTTPServer(self.socket, _RAGRequestHandler, self.llm, loop, slot)
+        logger.info("Рабочий процесс %s (pid %s) принимает запросы, "
+                    "потоков: %s", slot, os.getpid(), self.threads_per_worker)
+        server.serve_forever()
+
+    def _terminate_children(self) -> None:
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self, signum, frame) -> None:
+        # os.wait повторяется после обработчика сигнала, поэтому цикл
+        # родителя завершается по выходу рабочих процессов
+        self._stopping = True
+        self._terminate_children()
+
+    def serve_forever(self) -> None:
+        """
+        Открывает сокет, запускает рабочие процессы и перезапускает завершившиеся до сигнала остановки.
+
+        Raises:
+            RuntimeError: Если система не поддерживает fork или модели загружены на GPU
+        """
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("Многопроцессный режим с fork не поддерживается в этой системе")
+        import torch
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            raise RuntimeError("CUDA не поддерживает fork: для многопроцессного режима модели должны быть на CPU")
+
+        self.socket = socket.create_server((self.host, self.port), backlog=self.backlog)
+        gc.collect()
+        gc.freeze()
+        previous_handlers = {sig: signal.signal(sig, self._stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for slot in range(self.workers):
+                self._spawn(slot)
+            logger.info("Сервер запущен на %s:%s: рабочих процессов %s, "
+                        "потоков на процесс %s, память родителя %s",
+                        self.host, self.port, self.workers, self.threads_per_worker, memory_usage())
+            while not self._stopping:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                except InterruptedError:
+                    continue
+                slot = self._children.pop(pid, None)
+                if slot is not None and not self._stopping:
+                    delay = self._restart_delay(slot)
+                    logger.warning("Рабочий процесс %s (pid %s) завершился со статусом %s, "
+                                   "перезапускаем через %.1f с", slot, pid, status, delay)
+                    self._spawn(slot, delay)
+        finally:
+            self._terminate_children()
+            for pid in list(self._children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            self._children.clear()
+            self.socket.close()
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+            gc.unfreeze()
+            logger.info("Сервер остановлен")
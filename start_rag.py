@@ -1,17 +1,126 @@
+# Отсчет профиля запуска начинается с первого импорта
+from utils.startup_timer import startup_timer
+import argparse
 import asyncio
+import hashlib
+import json
+import os
+import sys
 import nest_asyncio
-from typing import List
-from src.rag import AdvancedRAG
-from src.handle_dir_and_files.load_documents import LoadDocuments
-from src.handle_dir_and_files.process_documents import ProcessDocuments
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, List, Optional
 from utils.mylogger import Logger
-from config import Config_LLM, docs_dir
+from config import Config_LLM, RAG_CONFIG, docs_dir
+
+if TYPE_CHECKING:
+    from src.rag import AdvancedRAG
 
 nest_asyncio.apply()
 
 # Инициализация логгера для отслеживания работы приложения
 logger = Logger('Start RAG', 'logs/rag.log')
 
+# Файлы сохраненного индекса (см. VectorStore и RescoringIndex); проверяются
+# без импорта FAISS, чтобы служебные команды запускались быстро
+INDEX_FILE = 'index.faiss'
+QUANTIZATION_META_FILE = 'quantization.json'
+SHARDS_MANIFEST_FILE = 'shards.json'
+# Пути документов, отпечаток файлов и настройки, с которыми построен сохраненный индекс
+BUILD_MANIFEST_FILE = 'build.json'
+
+
+def index_exists(index_dir: str) -> bool:
+    """
+    Проверяет наличие сохраненного индекса (float32 или сжатого) в директории.
+    """
+    return (os.path.exists(os.path.join(index_dir, INDEX_FILE))
+            or os.path.exists(os.path.join(index_dir, QUANTIZATION_META_FILE)))
+
+
+def corpus_fingerprint(documents: List[str]) -> dict:
+    """
+    Отпечаток файлов документов: количество и хэш SHA-256 отсортированных
+    (путь, размер, mtime_ns) найденных файлов.
+
+    Файлы ищутся так же, как при загрузке (FileDiscovery с настройками
+    RAG_CONFIG['discovery']), результат stat берется из обхода, файлы не читаются.
+    """
+    from src.handle_dir_and_files.discover_files import FileDiscovery
+
+    config = RAG_CONFIG["discovery"]
+    discovery = FileDiscovery(
+        include=config["include"],
+        exclude=config["exclude"],
+        min_size=config["min_size"],
+        max_size=config["max_size_mb"] * 1024 * 1024 or None,
+        follow_symlinks=config["follow_symlinks"],
+        max_workers=config["workers"]
+    )
+    files = sorted((os.path.normcase(os.path.abspath(file.path)), file.size, file.mtime_ns)
+                   for file in discovery.discover(documents))
+    digest = hashlib.sha256()
+    for path, size, mtime_ns in files:
+        digest.update(f'{path}\0{size}\0{mtime_ns}\n'.encode('utf-8', 'surrogateescape'))
+    return {'files': len(files), 'sha256': digest.hexdigest()}
+
+
+def build_manifest(documents: List[str]) -> dict:
+    """
+    Пути и отпечаток документов и настройки, от которых зависит содержимое индекса.
+
+    Изменение любого из них (другая директория документов, добавленный,
+    измененный или удаленный файл, модель эмбеддингов, сплиттер, формат
+    векторов и т.д.) делает сохраненный индекс непригодным.
+    """
+    discovery = RAG_CONFIG["discovery"]
+    sharding = RAG_CONFIG["sharding"]
+    return {
+        'docs': sorted(os.path.normcase(os.path.abspath(path)) for path in documents),
+        'corpus': corpus_fingerprint(documents),
+        'embedding_model': RAG_CONFIG["embedding_model"],
+        'splitter': RAG_CONFIG["splitter"],
+        'chunk_size': RAG_CONFIG["text_splitter"]["chunk_size"],
+        'chunk_overlap': RAG_CONFIG["text_splitter"]["chunk_overlap"],
+        'token_splitter': RAG_CONFIG["token_splitter"],
+        'precision': RAG_CONFIG["vector_storage"]["precision"],
+        'deduplication': RAG_CONFIG["deduplication"],
+        'hybrid': RAG_CONFIG["hybrid"]["enabled"],
+        'discovery': {key: discovery[key] for key in ('include', 'exclude', 'min_size',
+                                                      'max_size_mb', 'follow_symlinks')},
+        'sharding': {'shards': sharding["shards"], 'merge': sharding["merge"]},
+    }
+
+
+def write_build_manifest(path: str, manifest: dict) -> None:
+    """
+    Сохраняет манифест сборки (build_manifest) рядом с индексом.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, BUILD_MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def stale_build_settings(path: str, documents: List[str]) -> List[str]:
+    """
+    Сравнивает манифест сохраненного индекса с текущим запуском.
+
+    Returns:
+        List[str]: Отличающиеся настройки (['build.json'], если манифеста нет
+            или он поврежден); пустой список - индекс можно использовать
+    """
+    try:
+        with open(os.path.join(path, BUILD_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return [BUILD_MANIFEST_FILE]
+    # Значения сравниваются после сериализации: кортежи конфигурации сохраняются списками
+    current = json.loads(json.dumps(build_manifest(documents), ensure_ascii=False))
+    return [key for key in current if saved.get(key) != current[key]]
+
+
 def create_LLM(llm, config):
     """
     Создает и настраивает экземпляр класса AdvancedRAG.
@@ -19,6 +128,7 @@ def create_LLM(llm, config):
     Процесс создания:
     1. Получение конфигурации из config
     2. Инициализация AdvancedRAG с параметрами из конфигурации
+       (модели эмбеддингов и cross-encoder начинают загружаться в фоне)
     3. Возврат готового экземпляра
 
     Args:
@@ -33,60 +143,147 @@ def create_LLM(llm, config):
         AdvancedRAG: Настроенный экземпляр класса AdvancedRAG
     """
     conf = config
-    LLM = llm(
-        conf.model_name,
-        conf.api_key,
-        conf.base_url,
-        conf.temperature
-    )
+    with startup_timer.phase('создание AdvancedRAG'):
+        LLM = llm(
+            conf.model_name,
+            conf.api_key,
+            conf.base_url,
+            conf.temperature
+        )
     return LLM
 
-async def setting_up_LLM(llm, documents: List[str]):
+async def build_index_async(vector_store_manager, documents: List[str]) -> None:
     """
-    Асинхронно настраивает LLM для работы с документами.
+    Строит индекс по документам и сохраняет его на диск.
 
-    Процесс настройки:
+    Процесс построения:
     1. Асинхронная загрузка документов из указанных путей
     2. Асинхронная обработка документов (разбивка на чанки)
-    3. Создание векторного хранилища
-    4. Настройка ретриверов
-    5. Настройка промптов
+    3. Создание векторного хранилища и его сохранение на диск
+       (при RAG_CONFIG['streaming_ingest'] шаги 1-3 выполняются потоком страниц,
+       при RAG_CONFIG['sharding'] - параллельно по шардам в рабочих процессах,
+       которые объединяются в один индекс или остаются раздельными для поиска по шардам;
+       в этом случае vector_store_manager не используется)
+    4. Сохранение манифеста сборки (build.json) с путями и отпечатком документов
+       и настройками; отпечаток снимается до загрузки, поэтому файлы, измененные
+       во время построения, при следующем запуске считаются измененными
+
+    Args:
+        vector_store_manager: Объект VectorStore
+        documents: Список путей к документам для обработки
+    """
+    from src.date.sharded_build import ShardedIndexBuilder, merge_shards
+    from src.handle_dir_and_files.load_documents import LoadDocuments
+    from src.handle_dir_and_files.process_documents import ProcessDocuments
+    from src.monitoring.tracing import trace
+
+    # Трасса загрузки: этапы load, clean, split, embed, index (RAG_CONFIG['tracing'])
+    manifest = await asyncio.to_thread(build_manifest, documents)
+    with trace('ingest', paths=len(documents)):
+        sharding = RAG_CONFIG["sharding"]
+        if sharding["shards"] > 1:
+            # Шарды строятся параллельно в рабочих процессах
+            builder = ShardedIndexBuilder(sharding["dir"], sharding["shards"], sharding["workers"] or None)
+            await asyncio.to_thread(builder.build, documents)
+            if sharding["merge"]:
+                # Шарды объединяются в один индекс с глобальными номерами чанков прямо на диске
+                await asyncio.to_thread(
+                    merge_shards,
+                    sharding["dir"],
+                    RAG_CONFIG["index_dir"],
+                    RAG_CONFIG["out_of_core"]["add_batch_size"],
+                    RAG_CONFIG["out_of_core"]["train_size"]
+                )
+            write_build_manifest(RAG_CONFIG["index_dir"] if sharding["merge"] else sharding["dir"], manifest)
+            return
+        if RAG_CONFIG["streaming_ingest"] and RAG_CONFIG["splitter"] != "recursive":
+            # Страницы загружаются, обрабатываются и разбиваются на чанки по одной,
+            # поэтому документ не держится в памяти целиком
+            pages = ProcessDocuments().iter_processed(LoadDocuments(documents).iter_documents())
+            await vector_store_manager.create_vector_store_from_stream_async(pages)
+        else:
+            # Асинхронная загрузка документов
+            loaded_documents = await LoadDocuments(documents).load_documents_async()
+            # Асинхронная обработка документов
+            processed_documents = await ProcessDocuments(loaded_documents).process_documents_async()
+            # Создание векторного хранилища для быстрого поиска
+            await vector_store_manager.create_vector_store_async(processed_documents)
+        # Сохранение индекса и колоночного хранилища чанков на диск
+        await vector_store_manager.save_vector_store_async()
+        write_build_manifest(RAG_CONFIG["index_dir"], manifest)
+
+async def setting_up_LLM(llm, documents: List[str], rebuild: bool = True):
+    """
+    Асинхронно настраивает LLM для работы с документами.
+
+    Процесс настройки:
+    1. Построение индекса по документам (build_index_async) или, если rebuild=False
+       и сохраненный индекс построен по тем же, не изменявшимся с тех пор файлам
+       документов с теми же настройками (манифест build.json), отображение сохраненного индекса в память, пока
+       модели загружаются в фоне
+    2. Настройка ретриверов
+    3. Настройка промптов
 
     Args:
         llm: Экземпляр класса AdvancedRAG
         documents: Список путей к документам для обработки
             Поддерживаемые форматы: PDF, TXT, DOCX
+        rebuild: Строить индекс заново, даже если он уже сохранен
 
     Returns:
         AdvancedRAG: Настроенный экземпляр с загруженными документами
     """
-    # Асинхронная загрузка документов
-    loaded_documents = await LoadDocuments(documents).load_documents_async()
-    # Асинхронная обработка документов
-    processed_documents = await ProcessDocuments(loaded_documents).process_documents_async()
-    # Создание векторного хранилища для быстрого поиска
-    llm.vectorstore.create_vector_store(processed_documents)
+    sharding = RAG_CONFIG["sharding"]
+    split_shards = sharding["shards"] > 1 and not sharding["merge"]
+    if split_shards:
+        saved_dir = sharding["dir"]
+        saved = os.path.exists(os.path.join(saved_dir, SHARDS_MANIFEST_FILE))
+    else:
+        saved_dir = RAG_CONFIG["index_dir"]
+        saved = index_exists(saved_dir)
+    if saved and not rebuild:
+        stale = await asyncio.to_thread(stale_build_settings, saved_dir, documents)
+        if stale:
+            logger.info("Сохраненный индекс в %s построен по другим документам или настройкам "
+                        "(%s), строим заново", saved_dir, ', '.join(stale))
+            saved = False
+    if rebuild or not saved:
+        with startup_timer.phase('построение индекса'):
+            await build_index_async(llm.vector_store_manager, documents)
+        if sharding["shards"] > 1 and sharding["merge"]:
+            # Объединенный индекс загружается с диска
+            await llm.vector_store_manager.load_vector_store_async()
+    elif not split_shards:
+        with startup_timer.phase('загрузка индекса (mmap)'):
+            await llm.vector_store_manager.load_vector_store_async()
+    if split_shards:
+        # Шарды остаются раздельными: поиск рассылается во все шарды параллельно
+        with startup_timer.phase('загрузка шардов'):
+            await llm.retriever_manager.setup_sharded_async()
+        llm.promts.setup_prompts()
+        return llm
     # Настройка компонентов для поиска документов
-    llm.retriever.setup_retrievers()
+    with startup_timer.phase('настройка ретриверов'):
+        await llm.retriever_manager.setup_retrievers_async()
     # Настройка промптов для генерации ответов
     llm.promts.setup_prompts()
     return llm
 
-async def process_question(llm: AdvancedRAG, question: str) -> str:
+async def process_question(llm: 'AdvancedRAG', question: str, collection: Optional[str] = None) -> str:
     """
     Асинхронно обрабатывает вопрос пользователя.
     """
     try:
-        response = await llm.query_async(question)
+        response = await llm.query_async(question, collection=collection)
         return response
     except Exception as e:
-        logger.error(f"Ошибка при обработке вопроса: {str(e)}")
+        logger.error("Ошибка при обработке вопроса: %s", e)
         return f"Произошла ошибка: {str(e)}"
 
-async def main(docs_dir: str):
+async def main(docs_dir: str, rebuild: bool = True, profile_startup: bool = False):
     """
     Асинхронная основная функция приложения.
-    
+
     Процесс работы:
     1. Создание экземпляра AdvancedRAG
     2. Проверка наличия директории с документами
@@ -96,32 +293,130 @@ async def main(docs_dir: str):
     6. Извлечение и вывод точных ответов
     """
     try:
+        with startup_timer.phase('импорт src.rag'):
+            from src.rag import AdvancedRAG
+
         # Создание и настройка LLM
         llm = create_LLM(AdvancedRAG, Config_LLM)
-        
+
         # Асинхронная настройка LLM для работы с документами
-        llm = await setting_up_LLM(llm, [docs_dir])
-        
+        llm = await setting_up_LLM(llm, [docs_dir], rebuild)
+
+        if profile_startup:
+            with startup_timer.phase('ожидание фоновой загрузки моделей'):
+                await asyncio.to_thread(llm.wait_for_models)
+            print(startup_timer.report(), file=sys.stderr)
+
         while True:
             # Получение вопроса от пользователя
             question = input("Введите ваш вопрос (или 'exit' для выхода): ")
-            
+
             if question.lower() == "exit":
                 break
-                
+
+            # Коллекция документов (RAG_CONFIG['collections']), пустой ввод - основной индекс
+            collection = None
+            if llm.collections.names:
+                collection = input(f"Коллекция ({', '.join(llm.collections.names)}): ").strip() or None
+
             # Асинхронная обработка вопроса
-            response = await process_question(llm, question)
-            
+            response = await process_question(llm, question, collection)
+
             # Выводим ответ
             print("\nОтвет:")
             print("-" * 50)
             print(response)
             print("-" * 50)
-        
+
     except Exception as e:
-        logger.error(f"Произошла ошибка: {str(e)}")
+        logger.error("Произошла ошибка: %s", e)
         print(f"Произошла ошибка: {str(e)}")
 
+async def index_only(docs_dir: str) -> None:
+    """
+    Строит и сохраняет индекс без LLM и cross-encoder: загружается только
+    модель эмбеддингов (при сборке по шардам - в рабочих процессах).
+    """
+    llm = None
+    if RAG_CONFIG["sharding"]["shards"] <= 1:
+        with startup_timer.phase('импорт VectorStore'):
+            from src.date.vector_store import VectorStore
+            from src.embedded.background_model import BackgroundModel
+            from src.rag import load_sentence_transformer
+        # Контекст с атрибутами AdvancedRAG, которые использует VectorStore
+        llm = SimpleNamespace(sentence_transformer=BackgroundModel('SentenceTransformer', load_sentence_transformer))
+        llm.vector_store_manager = VectorStore(llm)
+    with startup_timer.phase('построение индекса'):
+        await build_index_async(llm.vector_store_manager if llm else None, [docs_dir])
+    print(f"Индекс сохранен в {RAG_CONFIG['index_dir']}")
+
+def health() -> dict:
+    """
+    Проверка готовности без загрузки моделей и индекса: наличие и размер
+    файлов индекса, количество чанков и настройки LLM.
+    """
+    index_dir = RAG_CONFIG["index_dir"]
+    report = {
+        'index_dir': index_dir,
+        'index': None,
+        'chunks': None,
+        'files_mb': {},
+        'llm_configured': bool(Config_LLM.api_key and Config_LLM.base_url),
+    }
+    if os.path.exists(os.path.join(index_dir, QUANTIZATION_META_FILE)):
+        with open(os.path.join(index_dir, QUANTIZATION_META_FILE), 'r', encoding='utf-8') as f:
+            report['index'] = json.load(f).get('precision')
+    elif os.path.exists(os.path.join(index_dir, INDEX_FILE)):
+        report['index'] = 'float32'
+    if report['index'] is not None:
+        for root, _, files in os.walk(index_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                report['files_mb'][os.path.relpath(path, index_dir)] = round(os.path.getsize(path) / 2 ** 20, 2)
+        manifest_path = os.path.join(index_dir, BUILD_MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                report['docs'] = json.load(f).get('docs')
+        offsets_path = os.path.join(index_dir, 'docstore', 'offsets.npy')
+        if os.path.exists(offsets_path):
+            import numpy as np
+
+            report['chunks'] = int(np.load(offsets_path, mmap_mode='r').shape[0]) - 1
+    shards_manifest = os.path.join(RAG_CONFIG["sharding"]["dir"], SHARDS_MANIFEST_FILE)
+    if os.path.exists(shards_manifest):
+        with open(shards_manifest, 'r', encoding='utf-8') as f:
+            report['shards'] = len(json.load(f)['shards'])
+    report['ok'] = (report['index'] is not None or 'shards' in report) and report['llm_configured']
+    return report
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="RAG по документам: вопросы, построение индекса, проверка готовности")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Вывести время импортов, загрузки моделей и индекса по этапам")
+    commands = parser.add_subparsers(dest="command")
+    ask = commands.add_parser("ask", help="Ответы на вопросы (по умолчанию)")
+    ask.add_argument("--docs", default=docs_dir, help="Директория документов")
+    ask.add_argument("--rebuild", action="store_true",
+                     help="Построить индекс заново, даже если сохранен индекс тех же файлов "
+                          "документов с теми же настройками")
+    index = commands.add_parser("index", help="Только построить и сохранить индекс")
+    index.add_argument("--docs", default=docs_dir, help="Директория документов")
+    commands.add_parser("health", help="Проверка индекса и настроек без загрузки моделей")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
     logger.info("Запуск приложения")
-    asyncio.run(main(docs_dir))
\ No newline at end of file
+    if args.command == "health":
+        result = health()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        exit_code = 0 if result['ok'] else 1
+    elif args.command == "index":
+        asyncio.run(index_only(args.docs))
+        exit_code = 0
+    else:
+        asyncio.run(main(getattr(args, 'docs', docs_dir), getattr(args, 'rebuild', False), args.profile_startup))
+        exit_code = 0
+    if args.profile_startup and args.command in ("health", "index"):
+        print(startup_timer.report(), file=sys.stderr)
+    sys.exit(exit_code)
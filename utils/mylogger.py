@@ -1,31 +1,181 @@
+import atexit
+import copy
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler, WatchedFileHandler
 import os
+import queue
+import threading
+from typing import Dict
+
+from config import RAG_CONFIG
+
+# Процесс, который выполняет ротацию файлов лога: первый импортировавший модуль.
+# Переменная окружения наследуется рабочими процессами (fork и spawn), поэтому
+# они пишут в тот же файл без ротации и не переименовывают его каждый в полночь
+_ROTATION_OWNER_ENV = 'RAG_LOG_ROTATION_PID'
+os.environ.setdefault(_ROTATION_OWNER_ENV, str(os.getpid()))
+
+
+def _owns_rotation() -> bool:
+    return os.environ.get(_ROTATION_OWNER_ENV) == str(os.getpid())
+
+
+def ensure_log_directory(log_file: str = os.path.join("logs", "rag.log")):
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Обработчик, передающий запись в очередь без форматирования.
+
+    В потоке вызова подставляются только аргументы сообщения (%-стиль), чтобы
+    изменяемые объекты не поменялись до записи; дата, уровень и трассировка
+    исключения форматируются в потоке записи. Очередь живет в том же процессе,
+    поэтому запись не нужно готовить к сериализации.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _LogFile:
+    """
+    Файл лога с одним обработчиком ротации и потоком записи.
+
+    Все логгеры, пишущие в файл, кладут записи в общую очередь, а
+    QueueListener пишет их на диск в отдельном потоке: поток событийного
+    цикла не ждет диск, файл открыт один раз, ротация в полночь выполняется
+    одним обработчиком. Рабочие процессы пишут в тот же файл через
+    WatchedFileHandler, который открывает файл заново после ротации,
+    выполненной процессом-владельцем.
+    """
+    def __init__(self, log_file: str) -> None:
+        ensure_log_directory(log_file)
+        self.log_file = log_file
+        self.file_handler = self._create_file_handler(_owns_rotation())
+        self.queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+        self.listener = QueueListener(self.queue_handler.queue, self.file_handler)
+        self.listener.start()
+
+    def _create_file_handler(self, rotate: bool) -> logging.Handler:
+        if rotate:
+            handler = TimedRotatingFileHandler(
+                self.log_file, when="midnight", interval=1,
+                backupCount=RAG_CONFIG['logging']['backup_count'], encoding='utf-8'
+            )
+            handler.suffix = "%Y-%m-%d"
+        else:
+            handler = WatchedFileHandler(self.log_file, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        return handler
+
+    def reopen_without_rotation(self) -> None:
+        """
+        Заменяет обработчик ротации на WatchedFileHandler в дочернем процессе после fork.
+        """
+        self.file_handler.close()
+        self.file_handler = self._create_file_handler(rotate=False)
+
+    def restart(self) -> None:
+        """
+        Новая очередь и поток записи в дочернем процессе после fork.
+
+        Поток записи не переживает fork, а записи родителя, оставшиеся в
+        очереди, допишет сам родитель.
+        """
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue_handler.queue, self.file_handler)
+        self.listener.start()
+
+    def stop(self) -> None:
+        self.listener.stop()
+        self.file_handler.close()
+
+
+_log_files: Dict[str, _LogFile] = {}
+_log_files_lock = threading.Lock()
+
+
+def _shared_log_file(log_file: str) -> _LogFile:
+    path = os.path.abspath(log_file)
+    with _log_files_lock:
+        if path not in _log_files:
+            _log_files[path] = _LogFile(log_file)
+        return _log_files[path]
+
+
+def flush_logs() -> None:
+    """
+    Дописывает очереди всех файлов лога на диск и запускает потоки записи заново.
+
+    Нужна перед os._exit, который не вызывает обработчики atexit.
+    """
+    with _log_files_lock:
+        for log_file in _log_files.values():
+            log_file.listener.stop()
+            log_file.file_handler.flush()
+            log_file.restart()
+
+
+def _stop_log_files() -> None:
+    with _log_files_lock:
+        for log_file in _log_files.values():
+            log_file.stop()
+        _log_files.clear()
+
+
+def _hold_log_files_before_fork() -> None:
+    # Блокировка обработчика удерживается потоком записи на время записи в файл:
+    # fork посреди записи оставил бы буфер файла заблокированным в дочернем процессе
+    _log_files_lock.acquire()
+    for log_file in _log_files.values():
+        log_file.file_handler.acquire()
+
+
+def _release_log_files_after_fork() -> None:
+    for log_file in _log_files.values():
+        log_file.file_handler.release()
+    _log_files_lock.release()
+
+
+def _restart_log_files_after_fork() -> None:
+    # Блокировки обработчиков в дочернем процессе пересоздает модуль logging;
+    # ротацию файлов продолжает выполнять только родитель
+    global _log_files_lock
+    _log_files_lock = threading.Lock()
+    for log_file in _log_files.values():
+        log_file.reopen_without_rotation()
+        log_file.restart()
+
+
+atexit.register(_stop_log_files)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_hold_log_files_before_fork,
+                        after_in_parent=_release_log_files_after_fork,
+                        after_in_child=_restart_log_files_after_fork)
 
-def ensure_log_directory():
-    log_dir = "logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
 
 class Logger(logging.Logger):
-    """Класс, обеспечивающий настройку логгирования с ротацией логов по времени."""
-    def __init__(self, name, log_file, level=logging.INFO):
+    """
+    Класс, обеспечивающий настройку логгирования с ротацией логов по времени.
+
+    Логгеры модулей, пишущие в один файл, делят один обработчик ротации и
+    один поток записи. Сообщения передаются в %-стиле (logger.info("%s", x)):
+    строка собирается, только если уровень записи включен.
+    """
+    def __init__(self, name, log_file, level=None):
         """
             Инициализация класса Logger.
 
             :param name: Имя логгера.
             :param log_file: Имя файла для сохранения логов.
-            :param level: Уровень логгирования.
+            :param level: Уровень логгирования (по умолчанию RAG_CONFIG['logging']['level']).
             """
-        super().__init__(name, level)
-
-        # Форматтер
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-        # Обработчик для ротации файлов по времени
-        handler = TimedRotatingFileHandler(log_file, when="midnight", interval=1, encoding='utf-8')
-        handler.suffix = "%Y-%m-%d"
-        handler.setFormatter(formatter)
+        super().__init__(name, level if level is not None else RAG_CONFIG['logging']['level'])
 
-        # Добавление обработчика в логгер
-        self.addHandler(handler)
\ No newline at end of file
+        # Общий для всех логгеров файла обработчик очереди
+        self.addHandler(_shared_log_file(log_file).queue_handler)
@@ -0,0 +1,46 @@
+from contextlib import contextmanager
+from typing import List, Tuple
+import threading
+import time
+
+
+class StartupTimer:
+    """
+    Профиль запуска: время импортов, загрузки моделей и индекса по этапам.
+
+    Этапы записываются из любого потока (модели загружаются в фоне), поэтому
+    в отчете указаны начало этапа от запуска программы, длительность и поток:
+    параллельные этапы перекрываются по времени. Подробный профиль импортов
+    по модулям дает python -X importtime start_rag.py --help.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float, float, str]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append((name, start - self.started, end - start, threading.current_thread().name))
+
+    def report(self) -> str:
+        """
+        Таблица этапов в порядке начала и общее время от запуска.
+        """
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        width = max([len(name) for name, *_ in phases] + [len('этап')])
+        lines = [f"{'этап':<{width}} {'начало, с':>10} {'время, с':>9}  поток"]
+        for name, start, duration, thread in phases:
+            lines.append(f"{name:<{width}} {start:10.3f} {duration:9.3f}  {thread}")
+        lines.append(f"{'всего':<{width}} {0:10.3f} {time.perf_counter() - self.started:9.3f}")
+        return "\n".join(lines)
+
+
+# Профиль запуска процесса: отсчет идет от первого импорта модуля
+startup_timer = StartupTimer()